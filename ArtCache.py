@@ -0,0 +1,159 @@
+"""
+A cache of card art that has already been decoded and scaled to fit a template's art box
+
+Every render of a card would otherwise decode its art crop from data/scryfall/card-art and
+resample it to cover the art box, the same way every time. Instead the scaled pixels are
+stored raw in data/art-cache, and later renders map that file straight into memory and wrap it
+as a surface, with nothing to decode or scale.
+
+Entries are named by a hash of the source image's contents and the size it was scaled to
+cover, so replacing the art or changing the art box never picks up a stale entry. Once the
+cache is over ART_CACHE_LIMIT, the entries used least recently are removed.
+"""
+
+import os, mmap, struct, hashlib, threading, pygame
+import os.path as path
+import Cards, Profiler
+
+ART_CACHE_DIR = "data/art-cache"
+ART_CACHE_LIMIT = 4 << 30     # Bytes, each entry is around 12 MB for the art box of BasicModern
+
+# Every entry starts with this header: a magic number, the width and height, and the pixel format
+HEADER = struct.Struct("<4sII4s")
+MAGIC = b"ART1"
+
+# The hash of each source image, by its (filepath, size, mtime), so it is only hashed once per process
+_hashes = {}
+
+# The size in bytes of each cache directory this process has stored entries in. Found with one scan
+# on the first store and then added to, so a directory is only scanned again when it needs pruning
+_sizes = {}
+_sizes_lock = threading.Lock()
+
+def source_hash(filepath):
+  """
+  RETURNS:
+   - The sha1 of the contents of an image, as a hex string
+  """
+  stat = os.stat(filepath)
+  signature = (filepath, stat.st_size, stat.st_mtime_ns)
+  if signature not in _hashes:
+    with open(filepath, 'rb') as f:
+      _hashes[signature] = hashlib.sha1(f.read()).hexdigest()
+  return _hashes[signature]
+
+def entry_path(filepath, size, directory=ART_CACHE_DIR):
+  """
+  RETURNS:
+   - Where the art at filepath, scaled to cover size, is cached
+  """
+  return path.join(directory, source_hash(filepath) + "-" + str(size[0]) + "x" + str(size[1]) + ".raw")
+
+def load_entry(filepath):
+  """
+  Maps a cache entry into memory and wraps it as a surface, without copying the pixels
+
+  RETURNS:
+   - The pygame Surface, or None if the entry is not a valid one
+  """
+  with open(filepath, 'rb') as f:
+    if os.fstat(f.fileno()).st_size < HEADER.size:
+      return None
+    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  magic, width, height, format = HEADER.unpack_from(mapped)
+  format = format.rstrip(b"\0").decode('ascii')
+  if magic != MAGIC or format not in ("RGB", "RGBA", "BGRA") or len(mapped) != HEADER.size + width * height * len(format):
+    mapped.close()
+    return None
+  # The surface keeps the mapping open for as long as it is used
+  return pygame.image.frombuffer(memoryview(mapped)[HEADER.size:], (width, height), format)
+
+def store_entry(filepath, image, directory=ART_CACHE_DIR, format=None):
+  """
+  Writes a scaled image to the cache, to a temporary file first so an entry is never half written
+
+  PARAMETERS:
+   - format: The pixel format to store, "RGB", "RGBA" or "BGRA", by default RGBA if the image has
+     alpha and RGB if not. BGRA matches the byte order of pygame's own surfaces, which blit much faster
+  """
+  if not path.exists(directory):
+    os.makedirs(directory)
+  if format is None:
+    format = "RGBA" if image.get_flags() & pygame.SRCALPHA else "RGB"
+  temp = filepath + "." + str(os.getpid()) + ".tmp"
+  with open(temp, 'wb') as f:
+    f.write(HEADER.pack(MAGIC, image.get_width(), image.get_height(), format.encode('ascii')))
+    f.write(pygame.image.tobytes(image, format))
+  os.replace(temp, filepath)
+
+  # Other processes store entries too, so the size is only an estimate until the next prune
+  with _sizes_lock:
+    if directory not in _sizes:
+      _sizes[directory] = prune(directory)
+    else:
+      _sizes[directory] += path.getsize(filepath)
+      if _sizes[directory] > ART_CACHE_LIMIT:
+        _sizes[directory] = prune(directory)
+
+def prune(directory=ART_CACHE_DIR, limit=ART_CACHE_LIMIT):
+  """
+  Removes the entries used least recently until the cache fits in limit bytes
+
+  RETURNS:
+   - The size of the cache afterwards, in bytes
+  """
+  entries = []
+  total = 0
+  for entry in os.scandir(directory):
+    if entry.name.endswith(".raw"):
+      try:
+        stat = entry.stat()
+      except OSError:
+        # Pruned by another process in the meantime
+        continue
+      entries.append((stat.st_mtime, stat.st_size, entry.path))
+      total += stat.st_size
+  for mtime, size, filepath in sorted(entries):
+    if total <= limit:
+      break
+    try:
+      os.remove(filepath)
+    except OSError:
+      continue
+    total -= size
+  return total
+
+def load_scaled_art(filepath, size, directory=ART_CACHE_DIR):
+  """
+  Loads card art scaled to cover size, see Cards.dynamically_scale_card, from the cache if it
+  has been scaled to that size before
+
+  PARAMETERS:
+   - filepath: The art, such as data/scryfall/card-art/lightning-bolt.png
+   - size: The (width, height) the art has to cover, it can be bigger in one direction
+   - directory: Where the cache is kept
+
+  RETURNS:
+   - The scaled art as a pygame Surface. It may be backed by the cache file, so do not draw onto it
+  """
+  cached = entry_path(filepath, size, directory)
+  if path.exists(cached):
+    with Profiler.stage("art_cache"):
+      image = load_entry(cached)
+    if image is not None:
+      # Mark the entry as recently used, so it is the last to be pruned
+      os.utime(cached)
+      return image
+
+  with Profiler.stage("art_load"):
+    image = pygame.image.load(filepath)
+    Profiler.read_file(filepath)
+  with Profiler.stage("scale"):
+    image = Cards.dynamically_scale_card(image, size)
+  try:
+    with Profiler.stage("art_cache"):
+      store_entry(cached, image, directory)
+      Profiler.wrote_file(cached)
+  except OSError as e:
+    print("Could not cache the art of " + filepath + ": " + str(e))
+  return image
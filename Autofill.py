@@ -1,13 +1,130 @@
-import os, pygame, math
+import os, pygame, math, json, pickle, multiprocessing
+import os.path as path
+import Names
+
+AUTOFILL_DIR = "autofill"
+AUTOFILL_MANIFEST = "autofill/.manifest.json"
+
+# Whether each card has a power/toughness or loyalty box, written when the database is serialized
+# so that autofill does not need to load the whole database just to read type lines
+TYPE_FLAGS_FILE = "data/type-flags.ser"
+
+# The worker processes of remove_autofill reuse one mask between images
+_mask = None
+
+def has_stat_box(type_line):
+  """
+  RETURNS:
+   - True if a card with this type line has an extra power/toughness or loyalty box
+  """
+  return "Creature" in type_line or "Vehicle" in type_line or "Planeswalker" in type_line
+
+def write_type_flags(cards, filepath=TYPE_FLAGS_FILE, verbose=True):
+  """
+  Builds a small index of card name -> has_stat_box and serializes it to data/type-flags.ser
+
+  PARAMETERS:
+   - cards: (name, card) pairs of every card in the local database
+   - filepath: Where to write the index
+   - verbose: If you would like to see all messages printed to the terminal
+
+  RETURNS:
+   - The index as a dictionary
+  """
+  if verbose:
+    print("Indexing card types to " + filepath + "...")
+  flags = { name:has_stat_box(card["type_line"]) for name, card in cards if "type_line" in card }
+  with open(filepath, 'wb') as f:
+    pickle.dump(flags, f, pickle.HIGHEST_PROTOCOL)
+  return flags
+
+def load_type_flags(filepath=TYPE_FLAGS_FILE):
+  """
+  RETURNS:
+   - The dictionary of card name -> has_stat_box, or None if it has not been built yet
+  """
+  if not path.exists(filepath):
+    return None
+  with open(filepath, 'rb') as f:
+    return pickle.load(f)
+
+def load_manifest():
+  """
+  RETURNS:
+   - The images that have already been masked, as a dictionary of filename -> [size, mtime]
+  """
+  if not path.exists(AUTOFILL_MANIFEST):
+    return {}
+  try:
+    with open(AUTOFILL_MANIFEST) as f:
+      return json.load(f)
+  except ValueError:
+    return {}
+
+def save_manifest(manifest):
+  """
+  Writes the manifest of masked images, to a temporary file first so it is never half written
+  """
+  with open(AUTOFILL_MANIFEST + ".tmp", 'w') as f:
+    json.dump(manifest, f)
+  os.replace(AUTOFILL_MANIFEST + ".tmp", AUTOFILL_MANIFEST)
+
+def file_signature(filepath):
+  """
+  RETURNS:
+   - The [size, mtime] of a file, which changes whenever the file is replaced or edited
+  """
+  stat = os.stat(filepath)
+  return [stat.st_size, stat.st_mtime_ns]
+
+def mask_image(job):
+  """
+  Covers the mpcautofill text of a single image, saving it in place
+
+  PARAMETERS:
+   - job: A tuple of (filename, y), where y is the height to place the mask at
+
+  RETURNS:
+   - A tuple of (filename, signature, error), where signature is the file_signature of the
+     masked image, and error is None if the image was masked
+  """
+  global _mask
+  card, y = job
+  if _mask is None:
+    _mask = pygame.Surface((610, 100))
+    _mask.fill((0,0,0))
+
+  filepath = path.join(AUTOFILL_DIR, card)
+  try:
+    image = pygame.image.load(filepath)
+    image.blit(_mask, (2352, y))
+
+    # Save next to the original and then swap it in, so an interrupted run never leaves a broken image
+    name, ext = path.splitext(filepath)
+    pygame.image.save(image, name + ".tmp" + ext)
+    os.replace(name + ".tmp" + ext, filepath)
+  except Exception as e:
+    return (card, None, str(e))
+  return (card, file_signature(filepath), None)
 
 """
 Simply remove the mpcautofill text from all files in the autofill directory
 as it clashes with our previous proxies
+
+Images that were already masked are recorded in autofill/.manifest.json and skipped on
+later runs, unless they have been changed since
 """
-def remove_autofill(database, verbose=True):
+def remove_autofill(flags, verbose=True, jobs=1, force=False):
+  """
+  PARAMETERS:
+   - flags: The dictionary of card name -> has_stat_box, see load_type_flags
+   - verbose: If you would like to see all messages printed to the terminal
+   - jobs: How many worker processes to mask images with
+   - force: Mask every image again, even the ones in the manifest
+  """
   # First make sure the directory exists, create it if it does not
-  if not os.path.exists("autofill"):
-    os.mkdir("autofill")
+  if not os.path.exists(AUTOFILL_DIR):
+    os.mkdir(AUTOFILL_DIR)
     if verbose:
       print("Could not find autofill directory, creating and exiting")
       return False
@@ -15,51 +132,78 @@ def remove_autofill(database, verbose=True):
   # Keep track of all the broken cards, print them at the end
   broken = []
 
-  cards = os.listdir("autofill/")
-  # if verbose:
-  #   print("Working Directory:")
-  #   print(cards)
-
-  mask = pygame.Surface((610, 100))
-  mask.fill((0,0,0))
+  manifest = {} if force else load_manifest()
 
-  # for card in cards:
-  for i in range(len(cards)):
-    card = cards[i]
+  # Work out what needs to be done first, so that only those images are loaded
+  work = []
+  skipped = 0
+  for card in sorted(os.listdir(AUTOFILL_DIR)):
     cardname, ext = os.path.splitext(card)
-    if ext not in ['.png', '.jpg']:
+    if ext not in ['.png', '.jpg'] or cardname.endswith(".tmp"):
       continue
 
-    if cardname not in database:
+    # Image names do not always match the card name exactly, such as a single face of a split card
+    name = Names.find_card_name(cardname, flags)
+    if name is None:
       if verbose:
         print("[****] Cannot find " + cardname + " in local database!")
-        broken.append(cardname)
-        continue
-    
-    if verbose:
-      percentage = math.floor((i / len(cards)) * 100)
-      prefix = '['
-      if percentage < 100:
-        prefix = prefix + ' '
-      if percentage < 10:
-        prefix = prefix + ' '
-      prefix = prefix + str(percentage) + '%] '
-      print(prefix + cardname)
+      broken.append(cardname)
+      continue
+
+    if manifest.get(card) == file_signature(path.join(AUTOFILL_DIR, card)):
+      skipped += 1
+      continue
 
     # Creatures, Planeswalkers, and Vehicles need the mask lowered to account for an extra p/t/loyalty box
-    image = pygame.image.load('autofill/' + card)
-    type_line = database[cardname]["type_line"]
-    if "Creature" in type_line or "Vehicle" in type_line or "Planeswalker" in type_line:
+    if flags[name]:
       y = 4140
     else:
-      y = 4064
+      y = 4064  # 4064 for non-creatures
+    work.append((card, y))
 
-    image.blit(mask, (2352, y))  # 4064 for non-creatures
+  if verbose and skipped > 0:
+    print("Skipping " + str(skipped) + " images that were already masked")
+
+  if jobs > 1 and len(work) > 1:
+    # Spawn fresh workers rather than forking, so they do not inherit this process' pygame state
+    context = multiprocessing.get_context("spawn")
+    pool = context.Pool(min(jobs, len(work)))
+    results = pool.imap_unordered(mask_image, work)
+  else:
+    pool = None
+    results = map(mask_image, work)
+
+  try:
+    done = 0
+    for card, signature, error in results:
+      done += 1
+      cardname = os.path.splitext(card)[0]
+      if error is not None:
+        print("[****] Could not mask " + cardname + ": " + error)
+        broken.append(cardname)
+        continue
+
+      # Record every image as soon as it is done, so that an interrupted run can pick up where it left off
+      manifest[card] = signature
+      save_manifest(manifest)
+
+      if verbose:
+        percentage = math.floor((done / len(work)) * 100)
+        prefix = '['
+        if percentage < 100:
+          prefix = prefix + ' '
+        if percentage < 10:
+          prefix = prefix + ' '
+        prefix = prefix + str(percentage) + '%] '
+        print(prefix + cardname)
+  finally:
+    if pool is not None:
+      # Let the workers exit on their own, pygame catches the SIGTERM that terminating them would send
+      pool.close()
+      pool.join()
 
-    pygame.image.save(image, 'autofill/' + card)
   print("[100%] Complete!")
   if len(broken) > 0:
     print("\nMissing Cards:")
     for card in broken:
       print(card)
-  
@@ -0,0 +1,562 @@
+"""
+An offline benchmark of the engine, run with python Benchmark.py -help
+
+Builds a throwaway workspace with a synthetic scryfall bulk file, synthetic card art and
+autofill images, then times the main steps of the engine inside it. Every run of a benchmark
+happens in a fresh process with the caches on disk cleared, so that caches start cold like they
+would for the first run of Engine.py, and so that the peak memory of each benchmark can be
+measured on its own.
+"""
+
+import json, sys, os, time, random, shutil, subprocess, tempfile, platform
+import os.path as path
+
+REPO_DIR = path.dirname(path.abspath(__file__))
+RESULTS_VERSION = 1
+
+# The size of the synthetic workspace, all can be changed from the command line
+DEFAULT_CARDS = 5000      # Cards in the synthetic bulk file
+DEFAULT_DECK = 20         # Cards in the synthetic decklist, each of these gets art and is rendered
+DEFAULT_AUTOFILL = 10     # Images in the synthetic autofill directory
+DEFAULT_REPEAT = 3        # How many times to run each benchmark, the median is reported
+DEFAULT_THRESHOLD = 0.15  # How much slower or larger than the baseline counts as a regression
+
+# The most time Engine.py may spend importing modules beyond the interpreter's own for a quick
+# command such as -print_decklist, checked by the startup benchmark
+STARTUP_IMPORT_BUDGET_MS = 20
+
+COLLECTION_LINES = 100000     # Lines in the synthetic collection export, checked by the collection benchmark
+
+# Caches the engine keeps on disk between runs, removed before every run of a benchmark so that each
+# run starts cold. These are ArtCache.ART_CACHE_DIR, Template.FRAME_CACHE_DIR and RenderCache.RENDER_CACHE_DIR
+CACHE_DIRS = ["data/art-cache", "data/frame-cache", "data/render-cache"]
+
+ART_SIZE = (626, 457)         # The size of a scryfall art crop
+AUTOFILL_SIZE = (2976, 4152)  # The size of an mpcautofill image
+CARD_SIZE = (2688, 3744)      # The size of the template backgrounds
+
+# Template images that are not in the repository, these are drawn as flat placeholders if missing
+BACKGROUNDS = ["white", "blue", "black", "red", "green", "gold", "land", "artifact",
+               "wu", "wb", "rw", "gw", "ub", "ur", "gu", "br", "bg", "rg"]
+
+WORDS = ("the of creature target you draw card deal damage to any each opponent player flying "
+         "trample haste until end turn sacrifice return battlefield graveyard hand library").split()
+SYMBOLS = ["{T}", "{W}", "{U}", "{B}", "{R}", "{G}", "{1}", "{2}", "{X}"]
+TYPES = ["Creature — Human Wizard", "Instant", "Sorcery", "Enchantment Creature — God", "Artifact",
+         "Legendary Creature — Elf Druid", "Artifact — Vehicle", "Enchantment", "Legendary Planeswalker — Jace"]
+ARTISTS = ["Christopher Moeller", "Rebecca Guay", "Terese Nielsen", "John Avon", "Seb McKinnon"]
+
+def print_cmd_arguments():
+  print("""Help:
+Runs every benchmark against a synthetic workspace and prints the results as JSON
+
+Flags:
+  -cards N                      (Cards in the synthetic bulk file, default """ + str(DEFAULT_CARDS) + """)
+  -deck N                       (Cards in the synthetic decklist to render, default """ + str(DEFAULT_DECK) + """)
+  -autofill N                   (Images in the synthetic autofill directory, default """ + str(DEFAULT_AUTOFILL) + """)
+  -repeat N                     (Runs of each benchmark, the median is reported, default """ + str(DEFAULT_REPEAT) + """)
+  -only name,name               (Only run these benchmarks, see the list below)
+  -output Filepath              (Also write the results to this file)
+  -baseline Filepath            (Compare against earlier results, and exit with an error
+                                 if anything got slower or larger than the threshold)
+  -threshold N                  (Allowed slowdown against the baseline, default """ + str(DEFAULT_THRESHOLD) + """)
+  -workspace Directory          (Build the workspace here and keep it, rather than in a
+                                 temporary directory that is removed afterwards)
+
+The startup benchmark also fails if Engine.py spends more than """ + str(STARTUP_IMPORT_BUDGET_MS) + """ms importing
+modules for -print_decklist, see python -X importtime.
+
+Benchmarks:
+  """ + ", ".join(BENCHMARKS) + """
+
+Examples:
+  python Benchmark.py -output baseline.json
+  python Benchmark.py -baseline baseline.json
+  python Benchmark.py -cards 30000 -only serialize,deserialize""")
+
+def generate_card(i, rng):
+  """
+  RETURNS:
+   - A card dictionary shaped like the ones in the scryfall bulk file
+  """
+  land = i % 10 == 9
+  if land:
+    card_type = "Land"
+    colours = []
+  else:
+    card_type = rng.choice(TYPES)
+    colours = rng.sample(["W", "U", "B", "R", "G"], rng.choice([1, 1, 1, 2, 3]))
+
+  text = []
+  for _ in range(rng.randint(1, 3)):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(5, 30))]
+    words.insert(rng.randint(0, len(words)), rng.choice(SYMBOLS))
+    text.append(" ".join(words).capitalize() + ".")
+
+  card = {
+    "object":"card", "id":"synthetic-" + str(i), "oracle_id":"synthetic-oracle-" + str(i),
+    "name":"Synthetic Card " + str(i), "lang":"en", "layout":"normal",
+    "set":"syn", "set_name":"Synthetic", "collector_number":str(i), "rarity":"common",
+    "image_uris":{
+      "small":"http://127.0.0.1:9/small/" + str(i), "normal":"http://127.0.0.1:9/normal/" + str(i),
+      "large":"http://127.0.0.1:9/large/" + str(i), "png":"http://127.0.0.1:9/png/" + str(i),
+      "art_crop":"http://127.0.0.1:9/art_crop/" + str(i), "border_crop":"http://127.0.0.1:9/border_crop/" + str(i)
+    },
+    "mana_cost":"" if land else "{" + str(rng.randint(1, 4)) + "}" + "".join("{" + c + "}" for c in colours),
+    "cmc":float(len(colours)), "type_line":card_type, "oracle_text":"\n".join(text),
+    "colors":colours, "color_identity":colours, "keywords":[],
+    "legalities":{ f:"legal" for f in ["standard", "modern", "legacy", "vintage", "commander", "pauper"] },
+    "artist":rng.choice(ARTISTS), "prices":{"usd":"0.10", "eur":"0.08"},
+    "related_uris":{"gatherer":"https://gatherer.wizards.com/Pages/Card/Details.aspx?multiverseid=" + str(i)},
+  }
+  if land:
+    card["produced_mana"] = [rng.choice(["W", "U", "B", "R", "G"])]
+  if "Creature" in card_type or "Vehicle" in card_type:
+    card["power"] = str(rng.randint(0, 6))
+    card["toughness"] = str(rng.randint(1, 6))
+  if "Planeswalker" in card_type:
+    card["loyalty"] = str(rng.randint(2, 6))
+  return card
+
+def build_workspace(directory, cards, deck, autofill, seed=1):
+  """
+  Fills a directory with everything the engine needs to run offline: the template images,
+  a synthetic bulk file, art for every card in a synthetic decklist, a collection export and autofill images
+
+  PARAMETERS:
+   - directory: Where to build the workspace
+   - cards: How many cards to put in the bulk file
+   - deck: How many of those cards go in the decklist
+   - autofill: How many autofill images to create
+   - seed: The random seed, the same seed always builds the same workspace
+  """
+  import pygame
+  rng = random.Random(seed)
+  cwd = os.getcwd()
+  os.chdir(directory)
+  try:
+    # Link to the real template images, and draw placeholders for the ones that are not in the repository
+    os.makedirs("template-data/basic", exist_ok=True)
+    for entry in os.listdir(path.join(REPO_DIR, "template-data")):
+      if entry != "basic" and not path.exists(path.join("template-data", entry)):
+        os.symlink(path.join(REPO_DIR, "template-data", entry), path.join("template-data", entry))
+    for entry in os.listdir(path.join(REPO_DIR, "template-data", "basic")):
+      if not path.exists(path.join("template-data", "basic", entry)):
+        os.symlink(path.join(REPO_DIR, "template-data", "basic", entry), path.join("template-data", "basic", entry))
+
+    os.makedirs("template-data/basic/background", exist_ok=True)
+    for colour in BACKGROUNDS:
+      filepath = "template-data/basic/background/" + colour + ".png"
+      if not path.exists(filepath):
+        background = pygame.Surface(CARD_SIZE, pygame.SRCALPHA, 32)
+        background.fill((0, 0, 0, 0))
+        pygame.draw.rect(background, (120, 120, 120, 255), (0, 0, CARD_SIZE[0], 420))
+        pygame.draw.rect(background, (120, 120, 120, 255), (0, 2106, CARD_SIZE[0], CARD_SIZE[1] - 2106))
+        pygame.image.save(background, filepath)
+    if not path.exists("template-data/basic/nyx-border.png"):
+      nyx = pygame.Surface(CARD_SIZE, pygame.SRCALPHA, 32)
+      nyx.fill((0, 0, 0, 0))
+      pygame.draw.rect(nyx, (250, 250, 200, 120), (0, 0, CARD_SIZE[0], 80))
+      pygame.image.save(nyx, "template-data/basic/nyx-border.png")
+
+    for directory in ["data/scryfall/card-art", "data/scryfall/full-cards", "autofill"]:
+      os.makedirs(directory, exist_ok=True)
+
+    # The bulk file, written one card at a time the same way scryfall formats it
+    with open("data/all-cards.json", 'w', encoding='utf-8') as f:
+      f.write("[\n")
+      for i in range(cards):
+        f.write(json.dumps(generate_card(i, rng)) + (",\n" if i < cards - 1 else "\n"))
+      f.write("]\n")
+
+    # Art for every card in the decklist, so that nothing is downloaded
+    names = ["Synthetic Card " + str(i) for i in range(min(deck, cards))]
+    art = pygame.Surface(ART_SIZE)
+    for name in names:
+      art.fill((rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+      pygame.draw.circle(art, (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)), (313, 228), 180)
+      pygame.image.save(art, "data/scryfall/card-art/" + name.lower().replace(" ", "-") + ".png")
+
+    with open("decklist.txt", 'w', encoding='utf-8') as f:
+      for name in names:
+        f.write("1 " + name + "\n")
+
+    # A collection export, with repeated cards, loosely typed names and printings like a real one
+    with open("collection.csv", 'w', encoding='utf-8') as f:
+      f.write("Count,Name,Set code,Collector number\n")
+      for i in range(COLLECTION_LINES):
+        card = rng.randrange(cards)
+        name = "Synthetic Card " + str(card)
+        if rng.random() < 0.1:
+          name = name.lower()
+        printing = ",SYN," + str(card) if rng.random() < 0.5 else ",,"
+        f.write(str(rng.randint(1, 12)) + "," + name + printing + "\n")
+
+    image = pygame.Surface(AUTOFILL_SIZE)
+    for i in range(min(autofill, cards)):
+      image.fill((rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+      pygame.image.save(image, "autofill/Synthetic Card " + str(i) + ".png")
+  finally:
+    os.chdir(cwd)
+
+def peak_rss_mb():
+  """
+  RETURNS:
+   - The most memory this process has used so far in MB, or None where that cannot be measured
+  """
+  # On Linux the peak from getrusage carries over from the parent process, /proc only counts this one
+  if path.exists("/proc/self/status"):
+    with open("/proc/self/status") as f:
+      for line in f:
+        if line.startswith("VmHWM:"):
+          return round(int(line.split()[1]) / 1024, 1)
+  try:
+    import resource
+  except ImportError:
+    return None
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # macOS reports bytes, everything else kilobytes
+  if sys.platform == "darwin":
+    return round(peak / (1 << 20), 1)
+  return round(peak / 1024, 1)
+
+# The benchmarks themselves. Each one runs inside the workspace in a fresh process, does any setup
+# it needs, and then returns (seconds, items) for the part that is being measured. A benchmark can
+# also return a dictionary of extra measurements as a third value.
+def bench_serialize():
+  import Cards
+  count = sum(1 for _ in Cards.iter_bulk_cards("data/all-cards.json"))
+  start = time.perf_counter()
+  # The synthetic bulk file has one printing of each card like the oracle one, which is not indexed
+  Cards.serialize_all_cards(verbose=False, index_printings=False)
+  return time.perf_counter() - start, count
+
+def bench_deserialize():
+  import Cards
+  start = time.perf_counter()
+  d = Cards.deserialize_all_cards(verbose=False)
+  return time.perf_counter() - start, len(d)
+
+def bench_decklist():
+  import Decklist
+  start = time.perf_counter()
+  deck = Decklist.load_decklist_from_file("decklist.txt")
+  return time.perf_counter() - start, len(deck)
+
+def bench_collection():
+  import Cards, Decklist
+  d = Cards.load_card_database(verbose=False)
+  start = time.perf_counter()
+  deck, unresolved = Decklist.resolve_decklist("collection.csv", d, verbose=False)
+  return time.perf_counter() - start, COLLECTION_LINES, { "cards":len(deck), "unresolved":len(unresolved) }
+
+def render_setup():
+  """
+  RETURNS:
+   - The template and every card in the decklist, for the render benchmarks
+  """
+  import Cards, Decklist, Template
+  d = Cards.load_card_database(verbose=False)
+  deck = Decklist.load_decklist_from_file("decklist.txt")
+  template = Template.BasicModern(d, verbose=False)
+  # Load the symbol atlas up front, the first run in a workspace has to build it
+  template.icons.load()
+  return template, [d[name] for name in deck]
+
+def bench_format_card():
+  template, cards = render_setup()
+  start = time.perf_counter()
+  for card in cards:
+    template.format_card(card)
+  return time.perf_counter() - start, len(cards)
+
+def bench_execute():
+  template, cards = render_setup()
+  start = time.perf_counter()
+  for card in cards:
+    template.execute(card)
+  template.writer.close()
+  return time.perf_counter() - start, len(cards)
+
+def bench_execute_basic():
+  template, cards = render_setup()
+  start = time.perf_counter()
+  for card in cards:
+    template.executeBasic(card)
+  template.writer.close()
+  return time.perf_counter() - start, len(cards)
+
+def bench_write_wrapped():
+  import pygame, Template
+  template, cards = render_setup()
+  canvas = pygame.Surface((2982, 4044))
+  start = time.perf_counter()
+  for card in cards:
+    Template.write_wrapped(canvas, card["oracle_text"], (380, 2614, 2220, 956), icons=template.icons)
+  return time.perf_counter() - start, len(cards)
+
+def bench_autofill():
+  import Autofill
+  flags = Autofill.load_type_flags()
+  count = len([f for f in os.listdir("autofill") if f.endswith(".png")])
+  start = time.perf_counter()
+  Autofill.remove_autofill(flags, verbose=False, force=True)
+  return time.perf_counter() - start, count
+
+def import_times(args):
+  """
+  Runs python with -X importtime
+
+  PARAMETERS:
+   - args: The arguments to python after -X importtime
+
+  RETURNS:
+   - A dictionary of every module imported -> the milliseconds spent importing it, not counting
+     the modules it imported
+  """
+  env = dict(os.environ)
+  env["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+  p = subprocess.run([sys.executable, "-X", "importtime"] + args, env=env,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+  times = {}
+  for line in p.stderr.splitlines():
+    # Lines look like "import time:       931 |        931 | Decklist"
+    if line.startswith("import time:") and "|" in line:
+      own, cumulative, module = line[len("import time:"):].split("|")
+      if own.strip().isdigit():
+        times[module.strip()] = int(own) / 1000
+  return times
+
+def bench_startup():
+  interpreter = import_times(["-c", "pass"])
+  start = time.perf_counter()
+  engine = import_times([path.join(REPO_DIR, "Engine.py"), "-print_decklist", "decklist.txt"])
+  seconds = time.perf_counter() - start
+
+  # Only count what Engine.py imports on top of the interpreter starting up
+  imports = { module:ms for module, ms in engine.items() if module not in interpreter }
+  slowest = sorted(imports.items(), key=lambda m: -m[1])[:5]
+  return seconds, 1, {
+    "import_ms":round(sum(imports.values()), 2),
+    "slowest_imports":[ module + " " + str(round(ms, 2)) + "ms" for module, ms in slowest ],
+  }
+
+# In the order they are run, serialize has to come first as it builds the local database
+BENCHMARKS = {
+  "serialize":bench_serialize,
+  "deserialize":bench_deserialize,
+  "decklist":bench_decklist,
+  "collection":bench_collection,
+  "format_card":bench_format_card,
+  "execute":bench_execute,
+  "execute_basic":bench_execute_basic,
+  "write_wrapped":bench_write_wrapped,
+  "autofill":bench_autofill,
+  "startup":bench_startup,
+}
+
+def clear_caches(workspace):
+  """
+  Removes every cache in CACHE_DIRS from the workspace, so that the next run cannot reuse the work
+  of an earlier one
+  """
+  for directory in CACHE_DIRS:
+    shutil.rmtree(path.join(workspace, directory), ignore_errors=True)
+
+def run_benchmark(name, workspace):
+  """
+  Runs a single benchmark in a fresh python process, with every cache on disk cleared first
+
+  PARAMETERS:
+   - name: The benchmark to run, a key of BENCHMARKS
+   - workspace: The directory built by build_workspace
+
+  RETURNS:
+   - A dictionary of the seconds, items and peak_rss_mb of the run
+  """
+  clear_caches(workspace)
+  env = dict(os.environ)
+  env["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+  p = subprocess.run([sys.executable, path.abspath(__file__), "-run", name], cwd=workspace, env=env,
+                     stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+  lines = p.stdout.strip().splitlines()
+  if p.returncode != 0 or len(lines) == 0:
+    raise RuntimeError("Benchmark " + name + " failed:\n" + p.stdout + p.stderr)
+  # The engine still prints some things when not verbose, the result is always the last line
+  return json.loads(lines[-1])
+
+def run_all(names, workspace, repeat, verbose=True):
+  """
+  Runs every benchmark in names repeat times, and summarizes the runs
+
+  RETURNS:
+   - A dictionary of benchmark name -> summary
+  """
+  results = {}
+  for name in names:
+    runs = []
+    for i in range(repeat):
+      runs.append(run_benchmark(name, workspace))
+      if verbose:
+        print("[" + name + " " + str(i+1) + "/" + str(repeat) + "] " + str(round(runs[-1]["seconds"], 3)) + "s", file=sys.stderr)
+
+    seconds = sorted(run["seconds"] for run in runs)[len(runs) // 2]
+    items = runs[0]["items"]
+    peaks = [run["peak_rss_mb"] for run in runs if run["peak_rss_mb"] is not None]
+    results[name] = {
+      "seconds":round(seconds, 4),
+      "runs":[round(run["seconds"], 4) for run in runs],
+      "items":items,
+      "per_second":round(items / seconds, 1) if seconds > 0 else None,
+      "peak_rss_mb":max(peaks) if len(peaks) > 0 else None,
+    }
+
+    # Take the median of any extra measurements that are numbers, and the last run of the rest
+    for key, value in runs[-1]["extra"].items():
+      if isinstance(value, (int, float)):
+        value = sorted(run["extra"][key] for run in runs)[len(runs) // 2]
+      results[name][key] = value
+  return results
+
+def compare(results, baseline, threshold):
+  """
+  Compares results against a baseline, printing a line for every benchmark in both
+
+  PARAMETERS:
+   - results: The results of this run
+   - baseline: Earlier results, as written by -output
+   - threshold: How much slower or larger counts as a regression, 0.15 means 15%
+
+  RETURNS:
+   - A list of the regressions, as strings
+  """
+  regressions = []
+  if baseline.get("config") != results["config"]:
+    print("Warning: the baseline was run with a different configuration " + json.dumps(baseline.get("config")), file=sys.stderr)
+
+  for name, result in results["results"].items():
+    if name not in baseline.get("results", {}):
+      continue
+    before = baseline["results"][name]
+    line = name + ": " + str(before["seconds"]) + "s -> " + str(result["seconds"]) + "s"
+
+    for key, unit in [("seconds", "s"), ("peak_rss_mb", "MB")]:
+      if before.get(key) and result.get(key) is not None:
+        change = result[key] / before[key] - 1
+        if key == "peak_rss_mb":
+          line += ", " + str(before[key]) + "MB -> " + str(result[key]) + "MB"
+        line += " (" + key + " " + ("+" if change >= 0 else "") + str(round(change * 100, 1)) + "%)"
+        if change > threshold:
+          regressions.append(name + " " + key + " went from " + str(before[key]) + unit + " to " + str(result[key]) + unit)
+    print(line, file=sys.stderr)
+  return regressions
+
+def get_flag(args, flag, default, cast=str):
+  """
+  RETURNS:
+   - The value after flag in args, or default if the flag is not given
+  """
+  if flag not in args:
+    return default
+  i = args.index(flag)
+  if len(args) <= i+1:
+    raise ValueError("Missing value for " + flag)
+  return cast(args[i+1])
+
+if __name__ == "__main__":
+  def main():
+    args = sys.argv[1:]
+
+    if "-help" in args:
+      print_cmd_arguments()
+      return 0
+
+    # Inside a benchmark process, run it and print the result
+    if "-run" in args:
+      sys.path.insert(0, REPO_DIR)
+      result = BENCHMARKS[get_flag(args, "-run", None)]()
+      extra = result[2] if len(result) > 2 else {}
+      print(json.dumps({ "seconds":result[0], "items":result[1], "peak_rss_mb":peak_rss_mb(), "extra":extra }))
+      return 0
+
+    try:
+      cards = get_flag(args, "-cards", DEFAULT_CARDS, int)
+      deck = get_flag(args, "-deck", DEFAULT_DECK, int)
+      autofill = get_flag(args, "-autofill", DEFAULT_AUTOFILL, int)
+      repeat = get_flag(args, "-repeat", DEFAULT_REPEAT, int)
+      threshold = get_flag(args, "-threshold", DEFAULT_THRESHOLD, float)
+      only = get_flag(args, "-only", None)
+      output = get_flag(args, "-output", None)
+      baseline_path = get_flag(args, "-baseline", None)
+      workspace = get_flag(args, "-workspace", None)
+    except ValueError as e:
+      print(e)
+      print("Correct Function: python Benchmark.py -help")
+      return 2
+
+    names = list(BENCHMARKS)
+    if only is not None:
+      names = [name for name in only.split(",") if name != ""]
+      for name in names:
+        if name not in BENCHMARKS:
+          print("Unknown benchmark " + name)
+          print("Benchmarks: " + ", ".join(BENCHMARKS))
+          return 2
+      # Everything after serialize needs the local database to exist
+      if "serialize" not in names:
+        names.insert(0, "serialize")
+
+    baseline = None
+    if baseline_path is not None:
+      if not path.exists(baseline_path):
+        print("Cannot find " + baseline_path)
+        return 2
+      with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    keep = workspace is not None
+    if workspace is None:
+      workspace = tempfile.mkdtemp(prefix="proxyengine-benchmark-")
+    else:
+      os.makedirs(workspace, exist_ok=True)
+      workspace = path.abspath(workspace)
+
+    try:
+      print("Building workspace in " + workspace, file=sys.stderr)
+      os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+      build_workspace(workspace, cards, deck, autofill)
+      results = {
+        "version":RESULTS_VERSION,
+        "python":platform.python_version(),
+        "platform":platform.platform(),
+        "config":{ "cards":cards, "deck":deck, "autofill":autofill, "repeat":repeat },
+        "results":run_all(names, workspace, repeat),
+      }
+    finally:
+      if not keep:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+    if output is not None:
+      with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    failed = False
+    if "startup" in results["results"]:
+      startup = results["results"]["startup"]
+      if startup["import_ms"] > STARTUP_IMPORT_BUDGET_MS:
+        print("\nEngine.py spends " + str(startup["import_ms"]) + "ms importing modules for -print_decklist, over the budget of "
+              + str(STARTUP_IMPORT_BUDGET_MS) + "ms. Slowest: " + ", ".join(startup["slowest_imports"]), file=sys.stderr)
+        failed = True
+
+    if baseline is not None:
+      regressions = compare(results, baseline, threshold)
+      if len(regressions) > 0:
+        print("\nRegressions:", file=sys.stderr)
+        for regression in regressions:
+          print(regression, file=sys.stderr)
+        return 1
+      print("No regressions against " + baseline_path, file=sys.stderr)
+    return 1 if failed else 0
+
+  sys.exit(main())
@@ -1,60 +1,278 @@
-import pickle, json, pygame
+import pickle, json, gzip, io, os, sys, pygame
+import concurrent.futures
 import os.path as path
-import Updater
+import Updater, Database, Names, Autofill, Profiler
 # https://scryfall.com/docs/api/cards
 
 ALL_CARDS_SERIALIZED = "data/all-cards.ser"
+BULK_CHUNK_SIZE = 1 << 16   # Characters read from the bulk file at a time while parsing
+ART_FETCH_WORKERS = 8       # Downloads in flight at once, scryfall's rate limit still applies to all of them
 
-def serialize_all_cards(verbose=True):
+# Images that could not be downloaded in this process, so that a card missing its art is only
+# retried once per run rather than every time the art is asked for
+_failed_downloads = set()
+
+class CompactCard(tuple):
+  """
+  A lightweight, read only stand in for a scryfall card dictionary, storing only the fields
+  that the templates actually read. It is a tuple underneath, so it pickles and unpickles far
+  faster than the full nested dictionaries.
+
+  Can be used anywhere a card dictionary is used: card["name"], "power" in card, card.get("artist")
+  Fields the scryfall card did not have are stored as None and act as missing keys.
+  """
+  __slots__ = ()
+
+  FIELDS = ("name", "type_line", "colors", "mana_cost", "oracle_text", "power", "toughness",
+            "produced_mana", "artist", "image_uris", "set", "printing")
+  INDEX = { field:i for i, field in enumerate(FIELDS) }
+
+  # Fields that repeat across thousands of cards, these are interned so every card shares one copy
+  INTERNED_STRINGS = ("type_line", "mana_cost", "artist", "set")
+  INTERNED_LISTS = ("colors", "produced_mana")
+  IMAGE_URIS = ("art_crop", "png")
+
+  def __new__(cls, values):
+    return tuple.__new__(cls, values)
+
+  @classmethod
+  def from_scryfall(cls, card, interned=None):
+    """
+    Projects a full scryfall card dictionary down to a CompactCard
+
+    PARAMETERS:
+     - card: The card dictionary, as parsed from the bulk file
+     - interned: A dictionary shared between calls, used to intern the lists of colours
+
+    RETURNS:
+     - The CompactCard for that card
+    """
+    if interned is None:
+      interned = {}
+
+    values = []
+    for field in cls.FIELDS:
+      value = card.get(field)
+      if value is None:
+        pass
+      elif field in cls.INTERNED_STRINGS:
+        value = sys.intern(value)
+      elif field in cls.INTERNED_LISTS:
+        value = interned.setdefault(tuple(value), tuple(value))
+      elif field == "image_uris":
+        value = { key:value[key] for key in cls.IMAGE_URIS if key in value }
+      values.append(value)
+    return cls(values)
+
+  def __getitem__(self, key):
+    if not isinstance(key, str):
+      return tuple.__getitem__(self, key)
+    value = tuple.__getitem__(self, self.INDEX[key]) if key in self else None
+    if value is None:
+      raise KeyError(key)
+    return value
+
+  def __contains__(self, key):
+    # Cards serialized before a field was added are shorter, and do not have it
+    return key in self.INDEX and self.INDEX[key] < len(self) and tuple.__getitem__(self, self.INDEX[key]) is not None
+
+  def get(self, key, default=None):
+    if key in self:
+      return self[key]
+    return default
+
+  def keys(self):
+    return [field for field in self.FIELDS if field in self]
+
+  def to_dict(self):
+    return { field:self[field] for field in self.keys() }
+
+  def __repr__(self):
+    return "CompactCard(" + repr(self.to_dict()) + ")"
+
+def mark_printing(card, printing):
+  """
+  RETURNS:
+   - A copy of a card dictionary or CompactCard with its "printing" field set, such as "2xm-141"
+  """
+  if isinstance(card, CompactCard):
+    values = list(card) + [None] * (len(CompactCard.FIELDS) - len(card))
+    values[CompactCard.INDEX["printing"]] = printing
+    return CompactCard(values)
+  return dict(card, printing=printing)
+
+def printing_rank(card):
+  """
+  When the bulk file has several printings of a card, the one with the highest rank is
+  stored under its name, as close as we can get to the one the oracle cards file would pick:
+  English first, then paper over digital only, then not a promo, then the newest
+
+  RETURNS:
+   - A tuple that sorts better printings higher
+  """
+  return (card.get("lang", "en") == "en", not card.get("digital", False), not card.get("promo", False),
+          card.get("released_at", ""))
+
+def open_bulk_file(source):
+  """
+  Opens a scryfall bulk file for reading as text, transparently decompressing it if it is gzipped
+
+  PARAMETERS:
+   - source: Either a filepath or an already open binary stream (such as a download or a gzip file)
+
+  RETURNS:
+   - A text stream of the json contents
+  """
+  if isinstance(source, str):
+    source = open(source, 'rb')
+
+  # Gzip streams always start with these two magic bytes, peek at them without consuming anything
+  if hasattr(source, "peek") and source.peek(2)[:2] == b'\x1f\x8b':
+    source = gzip.GzipFile(fileobj=source)
+  return io.TextIOWrapper(source, encoding='utf-8')
+
+def iter_bulk_cards(source, chunk_size=BULK_CHUNK_SIZE):
+  """
+  Lazily parses a scryfall bulk file, yielding one card object at a time.
+  Only a single chunk of the file and the card currently being decoded are held in memory,
+  and it does not care how the objects in the top level json array are split across lines.
+
+  PARAMETERS:
+   - source: A filepath or binary stream of the bulk json file, optionally gzipped
+   - chunk_size: How many characters to read from the file at a time
+
+  RETURNS:
+   - A generator of card dictionaries, in the order they appear in the file
+  """
+  decoder = json.JSONDecoder()
+  f = open_bulk_file(source)
+  try:
+    buffer = ""
+    i = 0
+    eof = False
+    started = False
+    while True:
+      # Skip over whitespace and the separators of the top level array
+      while i < len(buffer) and (buffer[i].isspace() or buffer[i] == ','):
+        i += 1
+      if i < len(buffer) and not started:
+        if buffer[i] != '[':
+          raise ValueError("Scryfall bulk data should be a json array")
+        started = True
+        i += 1
+        continue
+      if i < len(buffer) and buffer[i] == ']':
+        return
+
+      # Try to decode the next card, if it is cut off by the end of the buffer then read some more
+      if i < len(buffer):
+        if buffer[i] != '{':
+          raise ValueError("Unexpected " + repr(buffer[i]) + " in scryfall bulk data")
+        try:
+          card, i = decoder.raw_decode(buffer, i)
+          yield card
+          continue
+        except ValueError:
+          if eof:
+            raise
+
+      if eof:
+        if started:
+          raise ValueError("Scryfall bulk data ended before the array was closed")
+        return
+
+      # Drop everything we have already parsed before reading the next chunk
+      chunk = f.read(chunk_size)
+      if not chunk:
+        eof = True
+      buffer = buffer[i:] + chunk
+      i = 0
+  finally:
+    f.close()
+
+def serialize_all_cards(verbose=True, filepath=None, compact=False, index_printings=None):
   """
   Loads data/all-cards.json in a more efficient format and then serializes it into
   a byte stream, writing the stream to data/all-cards.ser
 
+  The same cards are also written to the indexed database in data/all-cards.db,
+  which lets single cards be looked up without loading everything, and the names
+  are indexed in data/name-index.ser for loose lookups and suggestions. Autofill
+  gets its own small index of card types in data/type-flags.ser.
+
+  For bulk files other than oracle cards, every printing in the bulk file is written to
+  data/all-printings.db as it is parsed, so specific printings can be rendered. The bulk files
+  other than oracle cards have many printings of each card, only the best one by printing_rank
+  is kept under its name.
+
+  The bulk file is parsed one card at a time, so it is never fully read into memory.
+  It can also be gzipped.
+
   PARAMETERS:
    - verbose: If you would like to see all messages printed to the terminal
+   - filepath: The bulk file to read from, defaults to data/all-cards.json
+   - compact: Store every card as a CompactCard with only the fields the templates use,
+     rather than the full scryfall dictionary. Much smaller and faster to load
+   - index_printings: Write every printing to data/all-printings.db. An oracle bulk file has
+     just the one printing of each card, so it is not worth indexing. None decides by the type
+     of the last bulk file downloaded, see Updater.indexes_printings
   """
+  if filepath is None:
+    filepath = Updater.ALL_CARDS_FILE
+  if index_printings is None:
+    index_printings = Updater.indexes_printings(Updater.load_snapshot())
+
   if verbose:
-    print("Reading " + Updater.ALL_CARDS_FILE)
-  if not path.exists(Updater.ALL_CARDS_FILE):
+    print("Reading " + filepath)
+  if not path.exists(filepath):
     # Always print these regardless of verbose
-    print(Updater.ALL_CARDS_FILE + " does not exist!")
+    print(filepath + " does not exist!")
     print("Aborting!")
     return
 
-  # If it does exist, read the file line by line, storing each card line in the dictionary
-  f = open(Updater.ALL_CARDS_FILE, encoding='utf-8')
-  
   # Set up a new dictionary
   d = {}
-  
+  ranks = {}
+
   if verbose:
     print("Parsing...")
-  all_lines = f.readlines()
-  
-  # Read all lines in the scryfall file minus the first and last one
-  for i in range(1, len(all_lines)-1): 
-    line = all_lines[i]
-    
-    # The last line does not end with a , so we need to check the comma in every line
-    if line[-2] == ',':
-      line = line[:-2]
-    
-    card = json.loads(line)       # Need to cut off the extra scryfall data on the end
-    d[card["name"]] = card        # Store in the database under its name
-  
+
+  # Store the best printing of every card under its name as it gets parsed, while every
+  # printing is streamed on into the printing database
+  interned = {}
+  def printings():
+    for card in iter_bulk_cards(filepath):
+      stored = CompactCard.from_scryfall(card, interned) if compact else card
+      name = card["name"]
+      rank = printing_rank(card)
+      if name not in ranks or rank > ranks[name]:
+        ranks[name] = rank
+        d[name] = stored
+      yield card, mark_printing(stored, Database.printing_id(card))
+  if index_printings:
+    Database.write_printing_database(printings(), verbose=verbose)
+  else:
+    for _ in printings():
+      pass
+    # The printings of an earlier bulk file would no longer match the cards
+    if path.exists(Database.ALL_PRINTINGS_INDEXED):
+      os.remove(Database.ALL_PRINTINGS_INDEXED)
+
   if verbose:
     print("Done Reading!")
 
-  # Then close the data/all-cards.ser file
-  f.close()
-
   # Then serialize the dictionary via pythons Pickle
   if verbose:
     print("Serializing to " + ALL_CARDS_SERIALIZED + "...")
-  pickle.dump(d, open(ALL_CARDS_SERIALIZED, 'wb'))
+  with open(ALL_CARDS_SERIALIZED, 'wb') as f:
+    pickle.dump(d, f)
   if verbose:
     print("Done Serializing!")
 
+  Database.write_card_database(d.items(), verbose=verbose)
+  Names.write_name_index(d.keys(), verbose=verbose)
+  Autofill.write_type_flags(d.items(), verbose=verbose)
+
 def deserialize_all_cards(verbose=True):
   """
   Reads data/all-cards as a serialized dictionary and deserializes it
@@ -71,7 +289,44 @@ def deserialize_all_cards(verbose=True):
     print("   python Engine.py -update all")
     return {}
 
-  return pickle.load(open(ALL_CARDS_SERIALIZED, 'rb'))
+  with open(ALL_CARDS_SERIALIZED, 'rb') as f:
+    return pickle.load(f)
+
+def load_card_database(backend=None, verbose=True):
+  """
+  Opens the local database of all cards with the requested storage backend
+
+  PARAMETERS:
+   - backend: Either "index" for the indexed data/all-cards.db, where each card is only read
+     when it is looked up, or "pickle" to load all of data/all-cards.ser at once.
+     Defaults to the index if it exists, otherwise the pickle
+   - verbose: If you would like to see all messages printed to the terminal
+
+  RETURNS:
+   - A dictionary-like object of all cards with names as keys, or {} if it could not be found
+  """
+  if backend is None:
+    backend = "index" if path.exists(Database.ALL_CARDS_INDEXED) else "pickle"
+
+  if backend == "pickle":
+    return deserialize_all_cards(verbose=verbose)
+
+  if not path.exists(Database.ALL_CARDS_INDEXED):
+    print("Cannot find " + Database.ALL_CARDS_INDEXED)
+    print("Local database may be corrupted, try updating")
+    print("   python Engine.py -update all")
+    return {}
+  return Database.CardDatabase(Database.ALL_CARDS_INDEXED)
+
+def card_filename(card):
+  """
+  RETURNS:
+   - The name to save the art and output of a card under, such as "lightning-bolt", followed
+     by the set and collector number if it is a specific printing, such as "lightning-bolt-2xm-141"
+  """
+  if "printing" in card:
+    return parse_card_name(card["name"]) + "-" + card["printing"]
+  return parse_card_name(card["name"])
 
 def parse_card_name(name):
   """
@@ -85,26 +340,27 @@ def parse_card_name(name):
   """
   return name.lower().replace(", ", "-").replace(" ", "-")
 
-def get_card_art_crop(card, autoproxy_format=False):
+def get_card_art_crop(card, autoproxy_format=False, verbose=True):
   """
   Searches scryfall for the specified card art and saves it to data/scryfall/card-art/[card-name]
 
   PARAMETERS:
-   - card: the card dictionary from the main all-cards dictionary. Example: dictionary["Lightning Bolt"]
+   - card: the card dictionary (or CompactCard) from the main all-cards dictionary. Example: dictionary["Lightning Bolt"]
    - autoproxy_format: how the filename should be saved. Formats it to be <CardName> (<Artist>).png to comply
      with https://github.com/ndepaola/mtg-autoproxy
+   - verbose: Print a message if the art is already downloaded
 
   RETURNS:
    - Returns the filepath to the image if available
   """
-  assert type(card) == dict
+  assert isinstance(card, (dict, CompactCard))
 
   try:
     if autoproxy_format:
       name = card["name"] + " (" + card["artist"] + ")"
       extension = ".jpg"
     else:
-      name = parse_card_name(card["name"])
+      name = card_filename(card)
       extension = ".png"
   except:
     print("Could not get the name from card " + card)
@@ -113,7 +369,8 @@ def get_card_art_crop(card, autoproxy_format=False):
   if path.exists("data/scryfall/card-art/" + name + extension):
     # If the art exists, just return with a message
     # We can fix this protocol later
-    print("Card art already loaded for " + name)
+    if verbose:
+      print("Card art already loaded for " + name)
     return "data/scryfall/card-art/" + name + extension
   
   # Otherwise, download the cropped art from scryfall
@@ -123,7 +380,13 @@ def get_card_art_crop(card, autoproxy_format=False):
     print('Could not get ["image_uris"]["art_crop"] from card ' + name)
     return
   
-  Updater.request_scryfall_data(uri, 'data/scryfall/card-art/' + name + extension, verbose=False)
+  if uri in _failed_downloads:
+    return
+  with Profiler.stage("art_fetch", card["name"]):
+    if Updater.request_scryfall_data(uri, 'data/scryfall/card-art/' + name + extension, verbose=False, resume=False) is None:
+      _failed_downloads.add(uri)
+      return
+    Profiler.wrote_file("data/scryfall/card-art/" + name + extension)
   return "data/scryfall/card-art/" + name + extension
 
 def get_full_card_image(card):
@@ -132,15 +395,15 @@ def get_full_card_image(card):
   Nearly an identical function to get_card_art, can probably be condensed in the future
 
   PARAMETERS:
-   - card: the card dictionary from the main all-cards dictionary. Example: dictionary["Lightning Bolt"]
+   - card: the card dictionary (or CompactCard) from the main all-cards dictionary. Example: dictionary["Lightning Bolt"]
 
   RETURNS:
    - Returns the filepath to the image if available
   """
-  assert type(card) == dict
+  assert isinstance(card, (dict, CompactCard))
 
   try:
-    name = parse_card_name(card["name"])
+    name = card_filename(card)
   except:
     print("Could not get the name from card " + card)
     return
@@ -157,9 +420,74 @@ def get_full_card_image(card):
     print('Could not get ["image_uris"]["png"] from card ' + name)
     return
   
-  Updater.request_scryfall_data(uri, "data/scryfall/full-cards/" + name + ".png", verbose=False)
+  if uri in _failed_downloads:
+    return
+  if Updater.request_scryfall_data(uri, "data/scryfall/full-cards/" + name + ".png", verbose=False, resume=False) is None:
+    _failed_downloads.add(uri)
+    return
   return "data/scryfall/full-cards/" + name + ".png"
 
+def prefetch_images(cards, images=("art_crop",), autoproxy_format=False, workers=ART_FETCH_WORKERS, verbose=True):
+  """
+  Downloads the images for a list of cards concurrently, so that rendering them afterwards
+  does not wait on scryfall one card at a time. Every download still goes through the shared
+  rate limit in Updater, so the total time is bound by that rather than by the latency.
+
+  PARAMETERS:
+   - cards: A list of card dictionaries (or CompactCards)
+   - images: Which images to fetch for every card, any of "art_crop" and "png"
+   - autoproxy_format: Passed on to get_card_art_crop for the art crop filenames
+   - workers: How many downloads can be in flight at once
+   - verbose: If you would like to see all messages printed to the terminal
+
+  RETURNS:
+   - A dictionary of { (filename, image) : filepath }, with None for images that could not be fetched,
+     where filename is the card_filename of the card
+  """
+  fetch = {
+    "art_crop":lambda card: get_card_art_crop(card, autoproxy_format, verbose),
+    "png":get_full_card_image
+  }
+
+  # Only fetch each image once, even if a card shows up twice
+  jobs = {}
+  for card in cards:
+    for image in images:
+      jobs[(card_filename(card), image)] = card
+
+  if verbose:
+    print("Fetching " + str(len(jobs)) + " images...")
+  with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+    futures = { key:executor.submit(fetch[key[1]], card) for key, card in jobs.items() }
+    paths = { key:future.result() for key, future in futures.items() }
+
+  if verbose:
+    missing = [key[0] for key, filepath in paths.items() if filepath is None]
+    if len(missing) > 0:
+      print("Could not fetch images for " + ", ".join(missing))
+  return paths
+
+def convert_for_blit(image):
+  """
+  Converts an image to the same pixel layout as the surfaces it gets drawn onto, keeping its
+  alpha, which makes blitting it many times faster than blitting the decoded image
+
+  This does not need a display, so it works headless as well
+
+  PARAMETERS:
+   - image: The pygame Surface, as loaded from a file
+
+  RETURNS:
+   - The converted Surface
+  """
+  if pygame.display.get_surface() is not None:
+    return image.convert_alpha()
+
+  # Copy every channel exactly onto a blank surface with per pixel alpha, rather than blending
+  converted = pygame.Surface(image.get_size(), pygame.SRCALPHA, 32)
+  converted.blit(image, (0, 0), special_flags=pygame.BLEND_RGBA_MAX)
+  return converted
+
 def dynamically_scale_card(image, newsize):
   """
   Scales the card to the specified size without warping it.
@@ -0,0 +1,314 @@
+import pickle, sqlite3, threading, collections, os, re
+import os.path as path
+
+ALL_CARDS_INDEXED = "data/all-cards.db"
+
+# Every printing of every card in the bulk file, rather than one card per name
+ALL_PRINTINGS_INDEXED = "data/all-printings.db"
+
+# A specific printing written as "Lightning Bolt (2XM) 141", the name and collector number are optional
+PRINTING_PATTERN = re.compile(r"^\s*(.*?)\s*\(([A-Za-z0-9]{2,6})\)\s*([0-9A-Za-z\u2605\-]+)?\s*$")
+
+# How many cards are written to the index in a single transaction batch
+WRITE_BATCH_SIZE = 2000
+
+# How many decoded cards a CardDatabase keeps for repeated lookups, the least recently used are dropped
+CARD_CACHE_SIZE = 4096
+
+class CardDatabase:
+  """
+  A read only, dictionary-like view over the indexed local database in data/all-cards.db
+
+  Rather than unpickling every card at startup, the cards are stored one record per name
+  in an SQLite table keyed by name. Looking up database[name] only reads and decodes the
+  record for that name, the last CARD_CACHE_SIZE of which are kept for repeated lookups.
+
+  Supports the same operations the rest of the engine uses on the pickled dictionary:
+  name in database, database[name], database.get(name), len(database), iterating names
+  """
+  def __init__(self, filepath=ALL_CARDS_INDEXED):
+    # Rendering threads can share the database, so guard the connection with a lock
+    self.filepath = filepath
+    self.connection = sqlite3.connect(filepath, check_same_thread=False)
+    self.lock = threading.Lock()
+    self.cache = collections.OrderedDict()
+
+  def _fetch(self, name):
+    with self.lock:
+      card = self.cache.get(name)
+      if card is not None:
+        self.cache.move_to_end(name)
+        return card
+      row = self.connection.execute("SELECT data FROM cards WHERE name = ?", (name,)).fetchone()
+    if row is None:
+      return None
+    card = pickle.loads(row[0])
+    with self.lock:
+      self.cache[name] = card
+      if len(self.cache) > CARD_CACHE_SIZE:
+        self.cache.popitem(last=False)
+    return card
+
+  def __getitem__(self, name):
+    card = self._fetch(name)
+    if card is None:
+      raise KeyError(name)
+    return card
+
+  def __contains__(self, name):
+    if name in self.cache:
+      return True
+    with self.lock:
+      row = self.connection.execute("SELECT 1 FROM cards WHERE name = ?", (name,)).fetchone()
+    return row is not None
+
+  def get(self, name, default=None):
+    card = self._fetch(name)
+    if card is None:
+      return default
+    return card
+
+  def __len__(self):
+    with self.lock:
+      return self.connection.execute("SELECT COUNT(*) FROM cards").fetchone()[0]
+
+  def __iter__(self):
+    return iter(self.keys())
+
+  def keys(self):
+    with self.lock:
+      return [row[0] for row in self.connection.execute("SELECT name FROM cards")]
+
+  def close(self):
+    self.connection.close()
+
+def write_card_database(cards, filepath=ALL_CARDS_INDEXED, verbose=True):
+  """
+  Writes cards to an indexed database file that can be opened with CardDatabase.
+  The database is built in a temporary file and moved into place once it is complete,
+  so a failed update never leaves a half written database behind.
+
+  PARAMETERS:
+   - cards: An iterable of (name, card) pairs, later duplicates of a name replace earlier ones
+   - filepath: Where to write the database, defaults to data/all-cards.db
+   - verbose: If you would like to see all messages printed to the terminal
+  """
+  if verbose:
+    print("Indexing to " + filepath + "...")
+
+  temp = filepath + ".tmp"
+  if path.exists(temp):
+    os.remove(temp)
+
+  connection = sqlite3.connect(temp)
+  connection.execute("PRAGMA journal_mode = OFF")
+  connection.execute("PRAGMA synchronous = OFF")
+  connection.execute("CREATE TABLE cards (name TEXT PRIMARY KEY, data BLOB NOT NULL) WITHOUT ROWID")
+
+  # Insert in batches so an iterator of cards never has to be fully held in memory
+  batch = []
+  for name, card in cards:
+    batch.append((name, pickle.dumps(card, pickle.HIGHEST_PROTOCOL)))
+    if len(batch) >= WRITE_BATCH_SIZE:
+      connection.executemany("INSERT OR REPLACE INTO cards VALUES (?, ?)", batch)
+      batch = []
+  connection.executemany("INSERT OR REPLACE INTO cards VALUES (?, ?)", batch)
+  connection.commit()
+  connection.close()
+
+  os.replace(temp, filepath)
+  if verbose:
+    print("Done Indexing!")
+
+class PrintingDatabase:
+  """
+  A read only view over every printing in data/all-printings.db. Printings are stored one
+  record each, keyed by their scryfall id, with indexes on (set, collector_number), oracle_id,
+  illustration_id and name so that any of them can be looked up without reading the rest.
+
+  Every card it returns has a "printing" field such as "2xm-141", see Cards.card_filename
+  """
+  def __init__(self, filepath=ALL_PRINTINGS_INDEXED):
+    # Rendering threads can share the database, so guard the connection with a lock
+    self.filepath = filepath
+    self.connection = sqlite3.connect(filepath, check_same_thread=False)
+    self.lock = threading.Lock()
+
+  def _select(self, where, args):
+    # English printings first, then the newest
+    with self.lock:
+      rows = self.connection.execute("SELECT data FROM printings WHERE " + where +
+                                     " ORDER BY lang != 'en', released_at DESC", args).fetchall()
+    return [pickle.loads(row[0]) for row in rows]
+
+  def find(self, set_code, collector_number=None, name=None):
+    """
+    PARAMETERS:
+     - set_code: The set code, such as "2XM", case does not matter
+     - collector_number: The collector number within the set, or None for any
+     - name: The name of the card as stored in the local database, or None for any
+
+    RETURNS:
+     - The matching printing, or None if there is none
+    """
+    where = "set_code = ?"
+    args = [set_code.lower()]
+    if collector_number is not None:
+      where += " AND collector_number = ?"
+      args.append(collector_number)
+    if name is not None:
+      where += " AND name = ?"
+      args.append(name)
+    cards = self._select(where, args)
+    return cards[0] if len(cards) > 0 else None
+
+  def find_names(self, printings):
+    """
+    Looks up a lot of printings at once, such as every card of a collection, without reading
+    the cards themselves
+
+    PARAMETERS:
+     - printings: An iterable of (set_code, collector_number), with the set code in lower case
+
+    RETURNS:
+     - A dictionary of (set_code, collector_number) to the name of the card, for every printing found
+    """
+    with self.lock:
+      self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (set_code TEXT, collector_number TEXT)")
+      self.connection.execute("DELETE FROM wanted")
+      self.connection.executemany("INSERT INTO wanted VALUES (?, ?)", set(printings))
+      # English printings last, so that they win when a printing is in more than one language
+      rows = self.connection.execute("SELECT p.set_code, p.collector_number, p.name FROM wanted w "
+                                     "JOIN printings p ON p.set_code = w.set_code AND p.collector_number = w.collector_number "
+                                     "ORDER BY p.lang = 'en', p.released_at").fetchall()
+      self.connection.execute("DELETE FROM wanted")
+    return { (set_code, collector_number):name for set_code, collector_number, name in rows }
+
+  def printings(self, name):
+    """
+    RETURNS:
+     - Every printing of the card with this exact name, English and newest first
+    """
+    return self._select("name = ?", (name,))
+
+  def by_oracle_id(self, oracle_id):
+    """
+    RETURNS:
+     - Every printing of the card with this oracle id, English and newest first
+    """
+    return self._select("oracle_id = ?", (oracle_id,))
+
+  def by_illustration_id(self, illustration_id):
+    """
+    RETURNS:
+     - Every printing that uses this art, English and newest first
+    """
+    return self._select("illustration_id = ?", (illustration_id,))
+
+  def __len__(self):
+    with self.lock:
+      return self.connection.execute("SELECT COUNT(*) FROM printings").fetchone()[0]
+
+  def close(self):
+    self.connection.close()
+
+# The printing database is opened once per process, the first time a printing is looked up
+_printings = None
+
+def get_printing_database():
+  """
+  RETURNS:
+   - The PrintingDatabase, or None if data/all-printings.db has not been built yet
+  """
+  global _printings
+  if _printings is None and path.exists(ALL_PRINTINGS_INDEXED):
+    _printings = PrintingDatabase(ALL_PRINTINGS_INDEXED)
+  return _printings
+
+def parse_printing(text):
+  """
+  Splits a specific printing such as "Lightning Bolt (2XM) 141" into its parts
+
+  RETURNS:
+   - A tuple of (name, set_code, collector_number), where name is "" and collector_number is None
+     if they were not given, or None if the text does not name a set
+  """
+  match = PRINTING_PATTERN.match(text)
+  if match is None:
+    return None
+  return (match.group(1), match.group(2).lower(), match.group(3))
+
+def printing_id(card):
+  """
+  RETURNS:
+   - The set and collector number of a scryfall card, such as "2xm-141"
+  """
+  return card.get("set", "").lower() + "-" + card.get("collector_number", "")
+
+def illustration_id(card):
+  """
+  RETURNS:
+   - The illustration id of a scryfall card, from its front face if it has more than one
+  """
+  if "illustration_id" in card:
+    return card["illustration_id"]
+  faces = card.get("card_faces")
+  if faces:
+    return faces[0].get("illustration_id")
+  return None
+
+def write_printing_database(printings, filepath=ALL_PRINTINGS_INDEXED, verbose=True):
+  """
+  Writes every printing to an indexed database file that can be opened with PrintingDatabase.
+  Like write_card_database, it is built in a temporary file and moved into place once complete.
+
+  The printings are inserted as they come in batches, and the secondary indexes are only built
+  once everything is inserted, which is much faster than keeping them up to date on every insert
+
+  PARAMETERS:
+   - printings: An iterable of (card, stored) pairs, where card is the scryfall card dictionary
+     the indexed fields are read from, and stored is what gets saved for it
+   - filepath: Where to write the database, defaults to data/all-printings.db
+   - verbose: If you would like to see all messages printed to the terminal
+
+  RETURNS:
+   - How many printings were written
+  """
+  if verbose:
+    print("Indexing printings to " + filepath + "...")
+
+  temp = filepath + ".tmp"
+  if path.exists(temp):
+    os.remove(temp)
+
+  connection = sqlite3.connect(temp)
+  connection.execute("PRAGMA journal_mode = OFF")
+  connection.execute("PRAGMA synchronous = OFF")
+  connection.execute("CREATE TABLE printings (id TEXT PRIMARY KEY, name TEXT NOT NULL, set_code TEXT, "
+                     "collector_number TEXT, oracle_id TEXT, illustration_id TEXT, released_at TEXT, "
+                     "lang TEXT, data BLOB NOT NULL)")
+
+  count = 0
+  batch = []
+  for card, stored in printings:
+    batch.append((card.get("id", printing_id(card)), card["name"], card.get("set", "").lower(),
+                  card.get("collector_number"), card.get("oracle_id"), illustration_id(card),
+                  card.get("released_at"), card.get("lang"), pickle.dumps(stored, pickle.HIGHEST_PROTOCOL)))
+    if len(batch) >= WRITE_BATCH_SIZE:
+      connection.executemany("INSERT OR REPLACE INTO printings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+      count += len(batch)
+      batch = []
+  connection.executemany("INSERT OR REPLACE INTO printings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+  count += len(batch)
+
+  connection.execute("CREATE INDEX printings_set ON printings (set_code, collector_number)")
+  connection.execute("CREATE INDEX printings_oracle ON printings (oracle_id)")
+  connection.execute("CREATE INDEX printings_illustration ON printings (illustration_id)")
+  connection.execute("CREATE INDEX printings_name ON printings (name)")
+  connection.commit()
+  connection.close()
+
+  os.replace(temp, filepath)
+  if verbose:
+    print("Done Indexing " + str(count) + " printings!")
+  return count
@@ -1,27 +1,186 @@
+import re
 import os.path as path
 
-def load_decklist_from_file(filepath):
+# A line of a decklist, "4 Lightning Bolt", "4x Lightning Bolt" or just "Lightning Bolt", the name
+# can be followed by a printing such as "(2XM) 141" as exported by MTGA and Moxfield. A count has
+# to be followed by whitespace, optionally after an x, see resolve_decklist for names that start
+# with a number
+LINE_PATTERN = re.compile(r"^(?:(\d+)(?:\s*[xX])?\s+)?(.+?)$")
+
+# Markers some exports put after a printing, such as Moxfield's *F* for foils
+MARKER_PATTERN = re.compile(r"(\s+\*[A-Za-z]+\*)+$")
+
+# Section headers, as written by MTGA, MTGO, Moxfield and others, and the section they start
+SECTIONS = {
+  "deck":"deck", "main":"deck", "maindeck":"deck", "main deck":"deck", "mainboard":"deck",
+  "sideboard":"sideboard", "side":"sideboard", "sb":"sideboard",
+  "commander":"commander", "commanders":"commander",
+  "companion":"companion",
+  "maybeboard":"maybeboard", "maybe":"maybeboard", "considering":"maybeboard",
+  "about":"about",
+}
+
+# Sections that are not part of the deck, so are left out unless they are asked for
+SKIPPED_SECTIONS = ("maybeboard", "about")
+
+# The columns of a CSV collection export, by what they hold, the first one found is used
+CSV_QUANTITY = ("count", "quantity", "qty", "amount")
+CSV_NAME = ("name", "card name", "card")
+CSV_SET = ("set code", "set", "edition code", "edition")
+CSV_NUMBER = ("collector number", "card number", "collector_number", "number", "cn")
+CSV_SECTION = ("board", "section")
+
+# A set code, rather than the name of a set
+SET_CODE_PATTERN = re.compile(r"[A-Za-z0-9]{2,6}")
+
+# How many unresolved lines get name suggestions, each one searches every card name
+SUGGESTION_LINES = 20
+
+def parse_line(line):
+  """
+  Reads a single line of a text decklist
+
+  PARAMETERS:
+   - line: The line, such as "4 Lightning Bolt (2XM) 141 *F*" or "SB: 2 Duress"
+
+  RETURNS:
+   - A tuple of (quantity, name, section), where name keeps any printing and section is set only
+     when the line changes the section, such as "Sideboard" or "SB: 2 Duress". None for blank lines
+     and comments
+  """
+  line = line.strip()
+  if line == "":
+    return None
+
+  # Comments, some exports write section headers as comments, such as "// Sideboard"
+  if line[0] == '#' or line[:2] == "//":
+    header = line.lstrip("#/").strip().rstrip(":").lower()
+    if header in SECTIONS:
+      return (0, None, SECTIONS[header])
+    return None
+
+  # MTGA also has an about section, which only names the deck and is skipped, see SKIPPED_SECTIONS
+  header = line.rstrip(":").lower()
+  if header in SECTIONS:
+    return (0, None, SECTIONS[header])
+  section = None
+  if line[:3].lower() == "sb:":
+    section = "sideboard"
+    line = line[3:].strip()
+
+  match = LINE_PATTERN.match(line)
+  quantity = int(match.group(1)) if match.group(1) is not None else 1
+  name = MARKER_PATTERN.sub("", match.group(2)).strip()
+  return (quantity, name, section)
+
+def read_decklist(filepath):
+  """
+  Reads a decklist or collection one line at a time, without loading the whole file, so that it
+  works just as well for a 60 card deck as for a collection export of a hundred thousand lines
+
+  Text decklists are in the formats of parse_line, with sections started by headers such as
+  "Sideboard" or "Commander". Files ending in .csv are read as a collection export, with a
+  header row naming its columns, such as those of Moxfield, Deckbox or ManaBox
+
+  PARAMETERS:
+   - filepath: the filepath to the decklist, it has to exist
+
+  RETURNS:
+   - A generator of (line_number, quantity, name, section) for every card line, where name keeps
+     the printing if one was given, such as "Lightning Bolt (2XM) 141"
+  """
+  if filepath.lower().endswith(".csv"):
+    yield from read_collection_csv(filepath)
+    return
+
+  section = "deck"
+  with open(filepath, 'r', encoding='utf-8-sig') as f:
+    for number, line in enumerate(f, 1):
+      parsed = parse_line(line)
+      if parsed is None:
+        continue
+      quantity, name, line_section = parsed
+      if name is None:
+        section = line_section
+        continue
+      yield (number, quantity, name, line_section or section)
+
+def read_collection_csv(filepath):
+  """
+  Reads a CSV collection export, see read_decklist. A set code and collector number are kept as
+  the printing of the card, a set name (such as Deckbox's "Edition") is not a printing and is ignored
+  """
+  import csv
+  with open(filepath, 'r', encoding='utf-8-sig', newline='') as f:
+    reader = csv.reader(f)
+    header = [column.strip().lower() for column in next(reader, [])]
+    def column(names):
+      for name in names:
+        if name in header:
+          return header.index(name)
+      return None
+    quantity_column = column(CSV_QUANTITY)
+    name_column = column(CSV_NAME)
+    set_column = column(CSV_SET)
+    number_column = column(CSV_NUMBER)
+    section_column = column(CSV_SECTION)
+    if name_column is None:
+      print("Cannot find the name column of " + filepath)
+      return
+
+    # Whether each value of the set column is a set code, a collection only has so many sets
+    set_codes = {}
+
+    for row in reader:
+      if len(row) <= name_column or row[name_column].strip() == "":
+        continue
+      name = row[name_column].strip()
+      quantity = 1
+      if quantity_column is not None and quantity_column < len(row) and row[quantity_column].strip().isdigit():
+        quantity = int(row[quantity_column])
+      if set_column is not None and set_column < len(row):
+        set_code = row[set_column].strip()
+        if set_code not in set_codes:
+          set_codes[set_code] = SET_CODE_PATTERN.fullmatch(set_code) is not None
+        if set_codes[set_code]:
+          name += " (" + set_code.upper() + ")"
+          if number_column is not None and number_column < len(row) and row[number_column].strip() != "":
+            name += " " + row[number_column].strip()
+      section = "deck"
+      if section_column is not None and section_column < len(row):
+        section = SECTIONS.get(row[section_column].strip().lower(), section)
+      yield (reader.line_num, quantity, name, section)
+
+def in_sections(section, sections=None):
+  """
+  RETURNS:
+   - If a card in section should be loaded, when loading the given sections or None for the whole deck
+  """
+  if sections is None:
+    return section not in SKIPPED_SECTIONS
+  return section in sections
+
+def load_decklist_from_file(filepath, sections=None):
   """
-  Load a decklist from a text file. The decklist has to be in format:
+  Load a decklist from a text file or a CSV collection export, see read_decklist. The decklist
+  can be in formats such as:
     4 name
-    9 name
-    1 name
+    12 name
+    1x name
     name
+    4 name (SET) 123
+    SB: 2 name
   
   PARAMETERS:
    - filepath: the filepath to the requested file
+   - sections: the sections to load, such as ("sideboard",), or None for every section of the deck,
+     which leaves out the maybeboard
 
   RETURNS:
    - a dictionary of { "cardname" : quantity }
      The name of the card is just an unedited string, it can be passed into a
      card dictionary in the future.
-     No error handling of card names are done here, this simply counts
-
-  CURRENT RESTRICTIONS:
-   - The decklist can only be of the formats above
-   - You cannot have more than 9 of a card on one line. Simply make two lines like so
-        9 Shadowborn Apostle
-        8 Shadowborn Apostle
+     No error handling of card names are done here, this simply counts, see resolve_decklist
   """
 
   # First make sure the file even exists
@@ -29,37 +188,127 @@ def load_decklist_from_file(filepath):
     print("Cannot find " + filepath)
     return {}
 
-  # Open and read all lines of the decklist
-  f = open(filepath, 'r', encoding='utf-8')
-  dat = f.readlines()
-  f.close()
-
-  # Set up the dictionary to be returned
   d = {}
+  for number, quantity, name, section in read_decklist(filepath):
+    if not in_sections(section, sections):
+      continue
+    d[name] = d.get(name, 0) + quantity
+  return d
 
-  # Iterate over every line in the decklist
-  for line in dat:
-    if line[0] == '\n' or line[0] == '#':
+def resolve_decklist(filepath, database, sections=None, verbose=True):
+  """
+  Loads a decklist and finds every card of it in the local database at once. Each distinct name is
+  only resolved once, loosely typed names go through the name index, and printings are looked up in
+  the printing database together, so that even a whole collection resolves in well under a second
+
+  A printing that cannot be found falls back to the card's usual printing, as the oracle bulk
+  file only has one printing of each card
+
+  PARAMETERS:
+   - filepath: the filepath to the requested file
+   - database: the local database of all cards
+   - sections: the sections to load, see load_decklist_from_file
+   - verbose: print how many printings could not be found
+
+  RETURNS:
+   - A tuple of (deck, unresolved). deck is a dictionary of { "cardname" : quantity }, named as the
+     cards are stored in the local database, or as "Name (SET) 123" for a specific printing.
+     unresolved is a list of (line_number, name) for every line naming a card that cannot be found
+  """
+  import Names, Database
+  if not path.exists(filepath):
+    print("Cannot find " + filepath)
+    return {}, []
+
+  # Count every distinct name first, remembering the first line it is on, the quantity on that
+  # line and how many lines it is on
+  counts = {}
+  for number, quantity, name, section in read_decklist(filepath):
+    if not in_sections(section, sections):
       continue
+    if name in counts:
+      counts[name][0] += quantity
+      counts[name][3] += 1
+    else:
+      counts[name] = [quantity, number, quantity, 1]
 
-    # Base amount of a card is 1
-    n = 1
+  # Split off the printings, then resolve every card name at once
+  printings = {}
+  card_names = set()
+  for name in counts:
+    printing = Database.parse_printing(name) if "(" in name else None
+    if printing is None:
+      card_names.add(name)
+    else:
+      printings[name] = printing
+      if printing[0] != "":
+        card_names.add(printing[0])
+  names = Names.find_card_names(card_names, database)
 
-    # If the first char of the line is a digit, set the amount of that card to be the digit and cut it off
-    if line[0].isdigit():
-      n = int(line[0])
-      line = line[1:]
+  # A card whose name starts with a number, such as "1996 World Champion", reads as a count and
+  # a name, so names that cannot be found are tried again with their count put back in front
+  counted = { str(counts[name][2]) + " " + name:name for name in card_names
+              if name in counts and name not in printings and names.get(name) is None }
+  if len(counted) > 0:
+    for full, resolved in Names.find_card_names(counted, database).items():
+      if resolved is not None:
+        name = counted[full]
+        names[name] = resolved
+        counts[name][0] = counts[name][3]
 
-    # Then strip all the extra whitespace from the line
-    line = line.strip()
+  # Then every printing with a collector number at once, the rare ones without are looked up one by one
+  found = {}
+  printing_db = Database.get_printing_database()
+  if printing_db is not None:
+    found = printing_db.find_names((set_code, number) for name, set_code, number in printings.values() if number is not None)
 
-    # Now we check, if it is already in the dictionary, add n to its amount, otherwise add it to the dictionary
-    if line in d:
-      d[line] += n
+  deck = {}
+  unresolved = []
+  missing_printings = 0
+  for name, (quantity, number, first, lines) in counts.items():
+    if name not in printings:
+      resolved = names.get(name)
     else:
-      d[line] = n
+      card_name, set_code, collector_number = printings[name]
+      resolved = names.get(card_name) if card_name != "" else None
+      if card_name != "" and resolved is None:
+        # The printing of a card that cannot be found is not some other card
+        unresolved.append((number, name))
+        continue
+      if collector_number is not None:
+        printed = found.get((set_code, collector_number))
+      else:
+        card = printing_db.find(set_code, None, resolved) if printing_db is not None else None
+        printed = card["name"] if card is not None else None
+      if printed is not None and (resolved is None or resolved == printed):
+        resolved = printed + " (" + set_code.upper() + ")" + (" " + collector_number if collector_number is not None else "")
+      elif resolved is not None:
+        missing_printings += 1
+    if resolved is None:
+      unresolved.append((number, name))
+    else:
+      deck[resolved] = deck.get(resolved, 0) + quantity
 
-  return d
+  if verbose and missing_printings > 0:
+    print("Cannot find " + str(missing_printings) + " of the printings in " + filepath + ", using the usual printing of those cards instead")
+    if printing_db is None:
+      print("  Specific printings need " + Database.ALL_PRINTINGS_INDEXED + ", build it with python Engine.py -update all -printings default")
+  return deck, unresolved
+
+def print_unresolved(unresolved):
+  """
+  Prints every line of a decklist that names a card that cannot be found, see resolve_decklist,
+  suggesting the closest card names for the first few of them
+  """
+  import Names
+  print("Cannot find " + str(len(unresolved)) + " cards in the local database:")
+  for i, (number, name) in enumerate(unresolved):
+    message = "  Line " + str(number) + ": " + name
+    if i < SUGGESTION_LINES:
+      suggestions = Names.suggest_card_names(name)
+      if len(suggestions) > 0:
+        message += " (Did you mean: " + ", ".join(suggestions) + "?)"
+    print(message)
 
 def print_decklist(decklist, only_one_of_each=False):
   total = 0
@@ -1,17 +1,29 @@
-import json, sys, os
-import Updater, Cards, Decklist, Template, Autofill
+"""
+The command line of the engine, run python Engine.py -help for how to use it
 
+Each command imports only the modules it needs when it runs, so that quick commands such as
+-print_decklist do not pay for loading pygame, requests or the local database
+"""
+
+import sys
 
 def print_cmd_arguments():
   print("""Help:
 Functions:
   -help
   -update {all|bulk|cards|ser} (ex: -update all)
-  -decklist Filepath
-  -card [Card Name]
+  -decklist Filepath            (a decklist as exported by MTGA, MTGO or Moxfield, with counts,
+                                 printings such as 4 Lightning Bolt (2XM) 141 and a sideboard,
+                                 or a .csv collection export)
+  -decklist Filepath -export Filepath   (render a decklist straight into a single .zip for
+                                 makeplayingcards, with a manifest of quantities, or a .pdf
+                                 with a page for every copy, rather than into output)
+  -card [Card Name]             (or a specific printing, such as -card [Lightning Bolt (2XM) 141],
+                                 after an update with -printings default)
   -art [Card Name]              (just the card art)
   -artlist Filepath             (card art for the entire list)
-  -autofill                     (clear autofill text from all files in autofill dir)
+  -autofill                     (clear autofill text from all files in autofill dir,
+                                 images that were already cleared are skipped)
   -print_decklist Filepath true/false   (print condensed contents of a decklist in alphabetical order)
                                 (true means each card is printed as a 1 of)
 
@@ -20,6 +32,38 @@ Flags:
   -basic                        (not formatted for MPC)
   -autoproxy                    (Set a flag to format art output 
                                  titles for the autoproxy tool)
+  -serve [Port]                 (Start a render server that keeps the local database and
+                                 templates loaded, and renders cards sent with -remote.
+                                 Renders with -jobs workers, listens on port 8767 by default)
+  -remote [Port]                (Send -card, -art and -decklist to a running render
+                                 server rather than loading everything each time.
+                                 Not with -jobs or -nocache, give those to -serve)
+  -db {index|pickle}            (Which local database to read cards from, the index only
+                                 loads the cards that are used. Defaults to index)
+  -jobs N                       (Render a -decklist or clear -autofill images with
+                                 N worker processes, default 1)
+  -nocache                      (Render every card again, even if an earlier render of it
+                                 in data/render-cache is still up to date)
+  -printings {oracle|unique|default|all}
+                                (With -update, which scryfall bulk file to download. oracle
+                                 has one printing of each card, unique one of each art,
+                                 default every printing and all every language. Default oracle)
+  -compact                      (With -update, store only the card fields the templates
+                                 use, for a smaller and faster local database)
+  -force                        (With -update, download and rebuild the local database
+                                 even if scryfall has not published anything new.
+                                 With -autofill, clear every image again)
+  -format {png|jpg|webp}        (The image format of rendered cards, default png.
+                                 webp needs Pillow, "pip install pillow")
+  -quality N                    (The quality of jpg and webp cards from 1 to 100, default 95.
+                                 Needs Pillow)
+  -compression N                (The compression of png cards from 0 (fastest, largest)
+                                 to 9 (smallest), default 6. Needs Pillow)
+  -encoder {pygame|pillow}      (What saves rendered cards, by default pygame unless the
+                                 format or settings above need Pillow)
+  -profile [Filepath]           (Time every stage of rendering each card, print a summary
+                                 and write a trace to data/profile-trace.json or Filepath,
+                                 which can be opened in chrome://tracing)
 
 Examples:
   python Engine.py -update all
@@ -33,196 +77,490 @@ local database
 
 Art is saved to ProxyEngine/data/scryfall/card-art by default""")
 
-def construct_card(name, database, template, basic=False):
+class Options:
+  """
+  The flags given on the command line, along with the local database, template and render
+  cache, which are loaded the first time a command needs them and then shared between commands
   """
-  A helper function to actually construct the card by name and template
-  Will format the card and place it in output under its name
+  def __init__(self, args):
+    self.args = args
 
-  If the card cannot be found in the local database, will print an error message
+    # Where each flag first appears in args, so that looking up a flag does not search args again
+    self.flags = {}
+    for i, arg in enumerate(args):
+      if arg.startswith("-") and arg not in self.flags:
+        self.flags[arg] = i
 
-  PARAMETERS:
-   - name: the card name as a string, this is case and punctuation sensitive
-   - template: the template to use when formatting the card
-   - basic: if the card should be formatted for MPC or not (default to MPC formatting)
+    self.verbose = "-noverbose" not in self.flags         # Print everything to the terminal
+    self.basic = "-basic" in self.flags                   # Format for MPC or basic
+    self.autoproxy_format = "-autoproxy" in self.flags    # Format art filenames as <CardName> (<ArtistName>).png
+    self.compact = "-compact" in self.flags               # Build the local database out of compact card records
+    self.force = "-force" in self.flags                   # Update even if the scryfall snapshot has not changed
+    self.use_cache = "-nocache" not in self.flags         # Reuse earlier renders of cards that have not changed
+    self.backend = None
+    self.printings = None         # Which scryfall bulk file to update from
+    self.jobs = 1
+    self.output = {}
+    self.remote = None          # The port of the render server to send commands to
+    self.export = None          # The .zip or .pdf to render the decklist into
 
-  RETURNS:
-   - True if the card could be constructed and placed in output, False if the card
-     name could not be found in the local database
-  """
-  if name not in database:
-    print("Cannot find " + name + " in local database")
-    return False
-  
-  if basic:
-    template.executeBasic(database[name])
-  else:
-    template.execute(database[name])
-  return True
+    self.database = None
+    self.template = None
+    self.cache = None
 
-if __name__ == "__main__":
-  def main():
-    # Get cmd arguments
-    args = sys.argv[1:]
-    
-    if len(args) == 0 or "-help" in args:
-      print_cmd_arguments()
-      return
-
-    # Set a verbose tag to pass into other functions
-    verbose = True
-    if "-noverbose" in args:
-      verbose = False
-
-    # Set a tag to format for MPC or basic
-    basic = False
-    if "-basic" in args:
-      basic = True
-
-    # Set a tag to format art filenames as <CardName> (<ArtistName>).png
-    autoproxy_format = False
-    if "-autoproxy" in args:
-      autoproxy_format = True
-
-    # Handle updating
-    if "-update" in args:
-      i = args.index("-update")
-      if len(args) <= i+1:
-        print("Missing type of update")
-        print("Correct Function: -update {all|bulk|cards|ser}")
-        return
-      if args[i+1] == "all":
-        Updater.update(bulk=True,cards=True,cards_finalize=True, verbose=verbose)
-      elif args[i+1] == "bulk":
-        Updater.update(bulk=True,cards=False,cards_finalize=False, verbose=verbose)
-      elif args[i+1] == "cards":
-        Updater.update(bulk=False,cards=True,cards_finalize=False, verbose=verbose)
-      elif args[i+1] == "ser":
-        Updater.update(bulk=False,cards=False,cards_finalize=True, verbose=verbose)
+  def value(self, flag, offset=1):
+    """
+    RETURNS:
+     - The argument offset places after flag, or None if there are not that many
+    """
+    i = self.flags[flag] + offset
+    if i < len(self.args):
+      return self.args[i]
+    return None
+
+  def port(self, flag):
+    """
+    RETURNS:
+     - The port given after flag, the default port of the render server if there is none,
+       or None if it is not a port
+    """
+    value = self.value(flag)
+    if value is None or value.startswith("-"):
+      import Server
+      return Server.SERVER_PORT
+    if not value.isdigit() or not 0 < int(value) < 65536:
+      return None
+    return int(value)
+
+  def card_name(self, flag):
+    """
+    Does some rudimentary handling of a card name given after a flag as [Card Name], this probably sucks
+
+    RETURNS:
+     - The card name without the brackets
+    """
+    i = self.flags[flag]
+    name = self.args[i+1][1:]
+    if name[-1] == "]":
+      # Account with names that only have 1 word
+      return name[:-1]
+    for n in range(i+2, len(self.args)):
+      if "]" in self.args[n]:
+        name += " " + self.args[n][:-1]
+        break
+      name += " " + self.args[n]
+    return name
+
+  def parse(self):
+    """
+    Reads the flags that take a value, printing what is wrong if one is not correct
+
+    RETURNS:
+     - True if every flag is correct
+    """
+    # Set which storage backend to read the local database from
+    if "-db" in self.flags:
+      if self.value("-db") not in ["index", "pickle"]:
+        print("Incorrect database backend")
+        print("Correct Function: -db {index|pickle}")
+        return False
+      self.backend = self.value("-db")
+
+    # Set which scryfall bulk file to update from
+    if "-printings" in self.flags:
+      import Updater
+      if self.value("-printings") not in Updater.BULK_TYPES:
+        print("Incorrect printings")
+        print("Correct Function: -printings {" + "|".join(Updater.BULK_TYPES) + "}")
+        return False
+      self.printings = self.value("-printings")
+
+    # Set how many processes to render decklists with
+    if "-jobs" in self.flags:
+      jobs = self.value("-jobs")
+      if jobs is None or not jobs.isdigit() or int(jobs) < 1:
+        print("Incorrect number of jobs")
+        print("Correct Function: -jobs N")
+        return False
+      self.jobs = int(jobs)
+
+    # Set how rendered cards are encoded and saved, these are checked when the template is loaded
+    for flag in ["format", "encoder"]:
+      if "-" + flag in self.flags:
+        self.output[flag] = self.value("-" + flag)
+    for flag, low, high in [("quality", 1, 100), ("compression", 0, 9)]:
+      if "-" + flag in self.flags:
+        value = self.value("-" + flag)
+        if value is None or not value.isdigit() or not low <= int(value) <= high:
+          print("Incorrect " + flag)
+          print("Correct Function: -" + flag + " N, from " + str(low) + " to " + str(high))
+          return False
+        self.output[flag] = int(value)
+
+    # Set a tag to render the decklist into a single package
+    if "-export" in self.flags:
+      filepath = self.value("-export")
+      if filepath is None or filepath.startswith("-") or filepath.lower()[-4:] not in [".zip", ".pdf"]:
+        print("Incorrect export")
+        print("Correct Function: -decklist decklist.txt -export filepath/proxies.zip (or .pdf)")
+        return False
+      self.export = filepath
+
+    # Set which port to serve on, or to send -card, -art and -decklist to
+    for flag in ["-serve", "-remote"]:
+      if flag in self.flags:
+        port = self.port(flag)
+        if port is None:
+          print("Incorrect port")
+          print("Correct Function: " + flag + " [Port]")
+          return False
+        if flag == "-remote":
+          self.remote = port
+
+    # The render server is started with its own workers and render cache, and saves cards into output
+    if self.remote is not None:
+      for flag, reason in [("-jobs", "start the server with -serve -jobs N instead"),
+                           ("-nocache", "start the server with -serve -nocache instead"),
+                           ("-export", "render the decklist without -remote to export it")]:
+        if flag in self.flags:
+          print(flag + " cannot be sent to a render server, " + reason)
+          return False
+
+    # Set a tag to time each stage of rendering, optionally followed by where to write the trace
+    if "-profile" in self.flags:
+      import Profiler
+      filepath = self.value("-profile")
+      if filepath is not None and not filepath.startswith("-"):
+        Profiler.enable(filepath)
       else:
-        print("Incorrect type of update")
-        print("Correct Function: -update {all|bulk|cards|ser}")
-        return
-
-    d = {}
-    # Fix this ugly if condition later
-    if "-decklist" in args or "-card" in args or "-art" in args or "-artlist" in args or "-autofill" in args:
-      d = Cards.deserialize_all_cards()
+        Profiler.enable()
+    return True
+
+  def load_database(self):
+    """
+    RETURNS:
+     - The local database, or None if it cannot be found
+    """
+    if self.database is None:
+      import Cards, Profiler
+      with Profiler.stage("load_database"):
+        d = Cards.load_card_database(self.backend, verbose=self.verbose)
       if d == {}:
-        print("Cannot find all-cards.ser")
-        return
-      
+        print("Cannot find the local database")
+        return None
+      self.database = d
+    return self.database
+
+  def load_template(self):
+    """
+    Loads the local database, the template to render cards with, and the render cache
+
+    RETURNS:
+     - The template, or None if the local database or the output settings are not right
+    """
+    if self.template is None:
+      if self.load_database() is None:
+        return None
+      import Template, Output, RenderCache
+
       # Later allow the user to select a template
-      t = Template.BasicModern(d)
-
-    if "-decklist" in args:
-      i = args.index("-decklist")
-      if len(args) <= i+1:
-        print("Missing filepath to decklist")
-        print("Correct Function: -decklist filepath/filename.txt")
-        return
-
-      # Find that decklist, load it, and then execute on every card
-      path = args[i+1]
-      deck = Decklist.load_decklist_from_file(path)
-      if deck == {}:
-        # Could not find the decklist
-        return
-      for key in deck:
-        construct_card(key, d, t, basic=basic)
-
-    if "-card" in args:
-      i = args.index("-card")
-      if len(args) <= i+1:
-        print("Missing card to generate")
-        print("Correct Function: -card [Card Name]")
-        return
-
-      # Do some rudimentary handling of a card name, this probably sucks
-      name = args[i+1][1:]
-      if name[-1] == "]":
-        # Account with names that only have 1 word
-        name = name[:-1]
-      else:
-        for n in range(i+2, len(args)):
-          if "]" in args[n]:
-            name += " " + args[n][:-1]
-            break
-          name += " " + args[n]
-      
-      # Then construct the card given in the command line
-      construct_card(name, d, t, basic=basic)
-    
-    if "-art" in args:
-      i = args.index("-art")
-      if len(args) <= i+1:
-        print("Missing card art to fetch")
-        print("Correct Function: -art [Card Name]")
-        return
-
-      # Do some rudimentary handling of a card name
-      name = args[i+1][1:]
-      if name[-1] == "]":
-        # Account with names that only have 1 word
-        name = name[:-1]
-      else:
-        for n in range(i+2, len(args)):
-          if "]" in args[n]:
-            name += " " + args[n][:-1]
-            break
-          name += " " + args[n]
-      Cards.get_card_art_crop(d[name], autoproxy_format)
-
-    if "-artlist" in args:
-      i = args.index("-artlist")
-      if len(args) <= i+1:
-        print("Missing filepath to list")
-        print("Correct Function: -artlist filepath/filename.txt")
-        return
-
-      # Find that decklist, load it, and then execute on every card
-      path = args[i+1]
-      deck = Decklist.load_decklist_from_file(path)
-      if deck == {}:
-        # Could not find the decklist
-        return
-      for key in deck:
-        Cards.get_card_art_crop(d[key], autoproxy_format)
-
-    if "-autofill" in args:
-      # Go over every image in the autofill directory and remove the mpcautofill text
-      Autofill.remove_autofill(d, verbose)
-
-    if "-print_decklist" in args:
-      i = args.index("-print_decklist")
-      if len(args) <= i+1:
-        print("Missing filepath to decklist")
-        print("Correct Function: -print_decklist filepath/filename.txt [true/false]")
-        return
-
-      only_one_of_each = False
-      if len(args) > i+2:
-        if args[i+2] == "true":
-          only_one_of_each = True
-
-      # Find that decklist, load it, and then execute on every card
-      path = args[i+1]
-      deck = Decklist.load_decklist_from_file(path)
-      if deck == {}:
-        # Could not find the decklist
-        return
-      Decklist.print_decklist(deck, only_one_of_each)
-
-    if "-compare_decklist" in args:
-      i = args.index("-compare_decklist")
-      if len(args) <= i+2:
-        print("Missing filepath to decklists")
-        print("Correct Function: -compare_decklist decklist.txt compare.txt")
-        return
-
-      deck1 = Decklist.load_decklist_from_file(args[i+1])
-      deck2 = Decklist.load_decklist_from_file(args[i+2])
-      Decklist.compare_decklist(deck1, deck2)
-      
-
-  main()
-    
\ No newline at end of file
+      try:
+        if self.export is not None:
+          import Export
+          writer = Export.open_export(self.export, **self.output)
+        else:
+          writer = Output.Writer(**self.output)
+        self.template = Template.BasicModern(self.database, writer=writer)
+      except ValueError as e:
+        print(e)
+        return None
+
+      # Reuse earlier renders of cards that have not changed, unless told not to
+      if self.use_cache:
+        self.cache = RenderCache.RenderCache()
+    return self.template
+
+# The commands. Each one gets the Options, and returns False if the commands after it should
+# not be run.
+def command_update(options):
+  updates = {
+    "all":(True, True, True),
+    "bulk":(True, False, False),
+    "cards":(False, True, False),
+    "ser":(False, False, True)
+  }
+  kind = options.value("-update")
+  if kind is None:
+    print("Missing type of update")
+    print("Correct Function: -update {all|bulk|cards|ser}")
+    return False
+  if kind not in updates:
+    print("Incorrect type of update")
+    print("Correct Function: -update {all|bulk|cards|ser}")
+    return False
+
+  import Updater
+  bulk, cards, cards_finalize = updates[kind]
+  Updater.update(bulk=bulk, cards=cards, cards_finalize=cards_finalize, verbose=options.verbose,
+                 compact=options.compact, force=options.force,
+                 printings=options.printings or Updater.DEFAULT_BULK_TYPE)
+
+def command_decklist(options):
+  path = options.value("-decklist")
+  if path is None:
+    print("Missing filepath to decklist")
+    print("Correct Function: -decklist filepath/filename.txt")
+    return False
+  if options.remote is not None:
+    return remote_decklist(options, path)
+  d = options.load_database()
+  if d is None:
+    return False
+
+  # Find that decklist, load it and find every card of it, and then execute on every card
+  import Decklist, Profiler
+  with Profiler.stage("resolve_decklist"):
+    deck, unresolved = Decklist.resolve_decklist(path, d, verbose=options.verbose)
+  if len(unresolved) > 0:
+    Decklist.print_unresolved(unresolved)
+  if deck == {}:
+    # Could not find the decklist, or any card of it
+    return False
+
+  # Only start an export once there is something to put in it
+  t = options.load_template()
+  if t is None:
+    return False
+  try:
+    render_deck(options, t, deck)
+  except BaseException:
+    # Do not leave half an export behind
+    if options.export is not None:
+      t.writer.discard()
+    raise
+  t.writer.close()
+  if options.cache is not None:
+    print(options.cache.summary())
+
+def render_deck(options, t, deck):
+  """
+  Renders every card of a resolved decklist with the template, see command_decklist
+  """
+  import Cards, Names, Profiler, Render
+  d = options.database
+
+  # Download all the art the template needs at once before rendering anything
+  found = [Names.lookup_card(key, d, verbose=False) for key in deck]
+  with Profiler.stage("prefetch"):
+    Cards.prefetch_images([card for card in found if card is not None], t.IMAGES, verbose=options.verbose)
+
+  # An export needs to know how many of each card to print
+  export = None
+  if options.export is not None:
+    export = t.writer
+    quantities = {}
+    for key, card in zip(deck, found):
+      if card is not None:
+        filepath = t.output_path(card)
+        quantities[filepath] = (quantities.get(filepath, (0,))[0] + deck[key], card["name"])
+    for filepath, (quantity, name) in quantities.items():
+      export.set_quantity(filepath, quantity, name)
+
+  if options.jobs > 1:
+    Render.render_decklist(deck, options.jobs, backend=options.backend, basic=options.basic,
+                           verbose=options.verbose, cache=options.cache, output=options.output, export=export)
+  else:
+    failures = [key for key in deck if not Render.construct_card(key, d, t, basic=options.basic, cache=options.cache)]
+    print("Rendered " + str(len(deck) - len(failures)) + " of " + str(len(deck)) + " cards")
+    if len(failures) > 0:
+      print("\nFailed Cards:")
+      for key in failures:
+        print(key)
+
+def command_card(options):
+  if options.value("-card") is None:
+    print("Missing card to generate")
+    print("Correct Function: -card [Card Name]")
+    return False
+  if options.remote is not None:
+    return remote_card(options)
+  t = options.load_template()
+  if t is None:
+    return False
+
+  # Then construct the card given in the command line
+  import Render
+  Render.construct_card(options.card_name("-card"), options.database, t, basic=options.basic, cache=options.cache)
+  t.writer.close()
+
+def command_art(options):
+  if options.value("-art") is None:
+    print("Missing card art to fetch")
+    print("Correct Function: -art [Card Name]")
+    return False
+  if options.remote is not None:
+    return remote_art(options)
+  d = options.load_database()
+  if d is None:
+    return False
+
+  import Cards, Names
+  card = Names.lookup_card(options.card_name("-art"), d)
+  if card is not None:
+    Cards.get_card_art_crop(card, options.autoproxy_format)
+
+def command_artlist(options):
+  path = options.value("-artlist")
+  if path is None:
+    print("Missing filepath to list")
+    print("Correct Function: -artlist filepath/filename.txt")
+    return False
+  d = options.load_database()
+  if d is None:
+    return False
+
+  # Find that decklist, load it and find every card of it, and then download the art of every card
+  import Cards, Decklist, Names
+  deck, unresolved = Decklist.resolve_decklist(path, d, verbose=options.verbose)
+  if len(unresolved) > 0:
+    Decklist.print_unresolved(unresolved)
+  if deck == {}:
+    # Could not find the decklist, or any card of it
+    return False
+  found = [Names.lookup_card(key, d) for key in deck]
+  Cards.prefetch_images([card for card in found if card is not None], ("art_crop",), options.autoproxy_format, verbose=options.verbose)
+
+def command_autofill(options):
+  # Go over every image in the autofill directory and remove the mpcautofill text
+  # Only the card types are needed, so read them from their own index rather than the database
+  import Autofill
+  flags = Autofill.load_type_flags()
+  if flags is None:
+    d = options.load_database()
+    if d is None:
+      return False
+    flags = Autofill.write_type_flags(((name, d[name]) for name in d.keys()), verbose=options.verbose)
+  Autofill.remove_autofill(flags, options.verbose, jobs=options.jobs, force=options.force)
+
+def command_print_decklist(options):
+  path = options.value("-print_decklist")
+  if path is None:
+    print("Missing filepath to decklist")
+    print("Correct Function: -print_decklist filepath/filename.txt [true/false]")
+    return False
+  only_one_of_each = options.value("-print_decklist", 2) == "true"
+
+  # Find that decklist, load it, and then execute on every card
+  import Decklist
+  deck = Decklist.load_decklist_from_file(path)
+  if deck == {}:
+    # Could not find the decklist
+    return False
+  Decklist.print_decklist(deck, only_one_of_each)
+
+def command_compare_decklist(options):
+  if options.value("-compare_decklist", 2) is None:
+    print("Missing filepath to decklists")
+    print("Correct Function: -compare_decklist decklist.txt compare.txt")
+    return False
+
+  import Decklist
+  deck1 = Decklist.load_decklist_from_file(options.value("-compare_decklist"))
+  deck2 = Decklist.load_decklist_from_file(options.value("-compare_decklist", 2))
+  Decklist.compare_decklist(deck1, deck2)
+
+def command_serve(options):
+  # Keeps running until it is stopped, so nothing after it is run
+  import Server
+  Server.serve(options.port("-serve"), jobs=options.jobs, backend=options.backend, output=options.output,
+               use_cache=options.use_cache, verbose=options.verbose)
+  return False
+
+# The commands as sent to a render server started with -serve, used instead of the commands
+# above when -remote is given
+def remote_card(options):
+  import Server
+  result = Server.send("/render", { "name":options.card_name("-card"), "basic":options.basic }, port=options.remote)
+  if not result["ok"]:
+    print(result["error"].strip())
+    return False
+  if options.verbose:
+    print(("Using cached render of " if result["cached"] else "Rendered ") + result["name"] + " to " + result["path"])
+
+def remote_art(options):
+  import Server
+  result = Server.send("/art", { "name":options.card_name("-art"), "autoproxy":options.autoproxy_format }, port=options.remote)
+  if not result["ok"]:
+    print(result["error"].strip())
+    return False
+  if options.verbose:
+    print("Art of " + result["name"] + " is at " + result["path"])
+
+def remote_decklist(options, path):
+  # Only the names are sent, the server resolves them with its own local database
+  import Decklist, Server
+  deck = Decklist.load_decklist_from_file(path)
+  if deck == {}:
+    # Could not find the decklist
+    return False
+  result = Server.send("/decklist", { "cards":list(deck), "basic":options.basic }, port=options.remote)
+  if "cards" not in result:
+    print(result["error"].strip())
+    return False
+
+  # Report the cards the server could not find by their line, like a local -decklist does
+  missing = set(card["name"] for card in result["cards"] if card.get("unresolved"))
+  if len(missing) > 0:
+    unresolved = {}
+    for number, quantity, name, section in Decklist.read_decklist(path):
+      if name in missing and name not in unresolved:
+        unresolved[name] = number
+    Decklist.print_unresolved([(number, name) for name, number in unresolved.items()])
+  cards = [card for card in result["cards"] if not card.get("unresolved")]
+  if len(cards) == 0:
+    return False
+
+  failures = [card for card in cards if not card["ok"]]
+  if options.verbose:
+    for card in cards:
+      if card["ok"]:
+        print(card["name"] + (" (cached)" if card["cached"] else ""))
+  print("Rendered " + str(len(cards) - len(failures)) + " of " + str(len(cards)) + " cards")
+  if len(failures) > 0:
+    print("\nFailed Cards:")
+    for card in failures:
+      print(card["name"] + ": " + card["error"].strip())
+
+# Every command, in the order they are run when several are given at once
+COMMANDS = [
+  ("-update", command_update),
+  ("-decklist", command_decklist),
+  ("-card", command_card),
+  ("-art", command_art),
+  ("-artlist", command_artlist),
+  ("-autofill", command_autofill),
+  ("-print_decklist", command_print_decklist),
+  ("-compare_decklist", command_compare_decklist),
+  ("-serve", command_serve),
+]
+
+def main(args):
+  if len(args) == 0 or "-help" in args:
+    print_cmd_arguments()
+    return
+
+  options = Options(args)
+  if not options.parse():
+    return
+
+  for flag, command in COMMANDS:
+    if flag in options.flags:
+      if command(options) == False:
+        break
+
+  if "-profile" in options.flags:
+    import Profiler
+    Profiler.report()
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
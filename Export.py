@@ -0,0 +1,356 @@
+"""
+Exports a whole decklist as a single print package, with python Engine.py -decklist deck.txt -export proxies.zip
+
+Rather than saving every card to output and then reading them all back to zip them up or lay
+them out for printing, each card is encoded in memory and streamed straight into the package
+as soon as it is finished. Only the cards waiting to be written are ever held in memory.
+
+ - .zip: Every card once, as it would have been saved to output, along with manifest.csv of
+   how many of each card the decklist has. Ready to upload to makeplayingcards
+ - .pdf: One page per copy of every card, at print size. Copies of a card share one image
+"""
+
+import io, os, csv, zlib, struct, zipfile, threading, pygame
+import os.path as path
+import Output, Profiler
+
+MANIFEST_FILE = "manifest.csv"
+
+# The card without its bleed is 2682 pixels across, which is printed 2.5 inches wide
+PDF_DPI = 1072.8
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+JPEG_SIGNATURE = b'\xff\xd8'
+
+class ExportWriter(Output.Writer):
+  """
+  An Output.Writer that hands every encoded card to add() rather than writing it to output.
+  Cards are still encoded on the background threads, but added to the package one at a time.
+
+  Nothing is written to output, so the render cache is only read from while exporting
+  """
+  SAVES_TO_OUTPUT = False
+
+  def __init__(self, **settings):
+    """
+    PARAMETERS:
+     - settings: The settings of the Output.Writer, such as format and quality
+    """
+    Output.Writer.__init__(self, **settings)
+    self.filepath = None
+    self.package_lock = threading.Lock()
+    self.quantities = {}
+    self.names = {}
+    self.added = set()
+    self.files = []
+    self.closed = False
+
+  def set_quantity(self, filepath, quantity, name=None):
+    """
+    Sets how many copies of the card saved to filepath the decklist has, 1 if it is never set
+    """
+    self.quantities[path.basename(filepath)] = quantity
+    if name is not None:
+      self.names[path.basename(filepath)] = name
+
+  def write(self, surface, filepath, name=None):
+    with Profiler.stage("encode", name):
+      try:
+        data = io.BytesIO()
+        self.encode(surface, data)
+      except Exception as e:
+        self.failed(filepath, name, e)
+        return
+    self.deliver(filepath, data.getvalue(), name)
+
+  def copy(self, source, filepath, name=None):
+    with open(source, 'rb') as f:
+      data = f.read()
+    Profiler.read_file(source)
+    self.deliver(filepath, data, name)
+
+  def deliver(self, filepath, data, name=None):
+    """
+    Adds an encoded card to the package, unless a card was already added under the same filename
+    """
+    with Profiler.stage("export", name):
+      try:
+        with self.package_lock:
+          if self.closed:
+            raise ValueError("the export is already closed")
+          filename = path.basename(filepath)
+          if filename not in self.added:
+            self.added.add(filename)
+            if name is not None:
+              self.names[filename] = name
+            self.add(filename, data, name)
+      except Exception as e:
+        self.failed(filepath, name, e)
+        return
+
+    # Nothing was written to output, so there is nothing for the render cache to keep
+    with self.lock:
+      self.callbacks.pop(filepath, None)
+
+  def failed(self, filepath, name, error):
+    with self.lock:
+      self.failures.append((name if name is not None else filepath, str(error)))
+      self.callbacks.pop(filepath, None)
+
+  def add(self, filename, data, name):
+    """
+    Adds a single encoded card to the package, called with the package lock held. The cards
+    are kept in memory until they are taken, packages override this to write them out instead
+    """
+    self.files.append((filename, data))
+
+  def take(self):
+    """
+    RETURNS:
+     - Every (filename, data) added since the last take
+    """
+    with self.package_lock:
+      files = self.files
+      self.files = []
+    return files
+
+  def discard(self):
+    """
+    Stops exporting without completing the package, removing anything written so far
+    """
+    with self.package_lock:
+      self.closed = True
+
+  def finish(self):
+    """
+    Completes the package once every card has been added
+    """
+    return
+
+  def close(self):
+    """
+    Waits for every card to be added, then completes the package and prints any cards that failed
+    """
+    failures = Output.Writer.close(self)
+    with self.package_lock:
+      if not self.closed:
+        self.closed = True
+        self.finish()
+        # Cards of the decklist that never made it into the package, such as ones that could not be rendered
+        missing = [self.names.get(filename, filename) for filename in self.quantities if filename not in self.added]
+        if len(missing) > 0:
+          print("Missing " + str(len(missing)) + " cards from " + self.filepath + ": " + ", ".join(sorted(missing)))
+    return failures
+
+class CollectWriter(ExportWriter):
+  """
+  Keeps encoded cards in memory until they are taken, so that the render workers of
+  Render.render_decklist can send them back to the process writing the package. Every card
+  is kept, even one already taken, as the package itself leaves out any repeats
+  """
+  def deliver(self, filepath, data, name=None):
+    with self.package_lock:
+      self.add(path.basename(filepath), data, name)
+    with self.lock:
+      self.callbacks.pop(filepath, None)
+
+class ZipExport(ExportWriter):
+  """
+  Streams every card into a zip file, followed by manifest.csv of the quantity of each card.
+  The images are already compressed, so they are stored as they are
+  """
+  def __init__(self, filepath, **settings):
+    ExportWriter.__init__(self, **settings)
+    self.filepath = filepath
+    self.temp = filepath + ".tmp"
+    self.zip = zipfile.ZipFile(self.temp, 'w', zipfile.ZIP_STORED, allowZip64=True)
+
+  def add(self, filename, data, name):
+    self.zip.writestr(filename, data)
+
+  def discard(self):
+    ExportWriter.discard(self)
+    self.zip.close()
+    if path.exists(self.temp):
+      os.remove(self.temp)
+
+  def finish(self):
+    manifest = io.StringIO()
+    writer = csv.writer(manifest, lineterminator="\n")
+    writer.writerow(["quantity", "filename", "name"])
+    for filename in sorted(self.added):
+      writer.writerow([self.quantities.get(filename, 1), filename, self.names.get(filename, "")])
+    self.zip.writestr(MANIFEST_FILE, manifest.getvalue(), zipfile.ZIP_DEFLATED)
+    self.zip.close()
+    os.replace(self.temp, self.filepath)
+    print("Exported " + str(len(self.added)) + " cards to " + self.filepath)
+
+class PdfExport(ExportWriter):
+  """
+  Streams every card into a pdf, one page per copy. The pdf is written by hand as it goes:
+  each card's image is written once, with a page for every copy pointing at it, and the page
+  tree and cross reference table are written at the end
+
+  PNG and JPEG cards are embedded as they are, without being decoded again
+  """
+  def __init__(self, filepath, **settings):
+    ExportWriter.__init__(self, **settings)
+    self.filepath = filepath
+    self.temp = filepath + ".tmp"
+    self.file = open(self.temp, 'wb')
+    self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    self.offsets = {}
+    self.pages = []
+    self.cards = 0
+    self.next_id = 3    # 1 and 2 are the catalog and page tree, written last
+
+  def object(self, dictionary, stream=None, id=None):
+    """
+    Writes a pdf object, along with its stream if it has one
+
+    RETURNS:
+     - The id of the object
+    """
+    if id is None:
+      id = self.next_id
+      self.next_id += 1
+    self.offsets[id] = self.file.tell()
+    self.file.write((str(id) + " 0 obj\n").encode('ascii'))
+    if stream is None:
+      self.file.write(dictionary.encode('ascii'))
+    else:
+      self.file.write(("<< " + dictionary + " /Length " + str(len(stream)) + " >>\nstream\n").encode('ascii'))
+      self.file.write(stream)
+      self.file.write(b"\nendstream")
+    self.file.write(b"\nendobj\n")
+    return id
+
+  def add(self, filename, data, name):
+    width, height, dictionary, stream = pdf_image(data)
+    image = self.object(dictionary, stream)
+
+    # Every copy of the card shares the image and what draws it
+    w = round(width * 72 / PDF_DPI, 3)
+    h = round(height * 72 / PDF_DPI, 3)
+    contents = self.object("", ("q " + str(w) + " 0 0 " + str(h) + " 0 0 cm /Card Do Q").encode('ascii'))
+    for _ in range(self.quantities.get(filename, 1)):
+      self.pages.append(self.object("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 " + str(w) + " " + str(h) + "]"
+                                    " /Resources << /XObject << /Card " + str(image) + " 0 R >> >>"
+                                    " /Contents " + str(contents) + " 0 R >>"))
+    self.cards += 1
+
+  def discard(self):
+    ExportWriter.discard(self)
+    self.file.close()
+    if path.exists(self.temp):
+      os.remove(self.temp)
+
+  def finish(self):
+    kids = " ".join(str(page) + " 0 R" for page in self.pages)
+    self.object("<< /Type /Pages /Kids [" + kids + "] /Count " + str(len(self.pages)) + " >>", id=2)
+    self.object("<< /Type /Catalog /Pages 2 0 R >>", id=1)
+
+    xref = self.file.tell()
+    self.file.write(("xref\n0 " + str(self.next_id) + "\n0000000000 65535 f \n").encode('ascii'))
+    for id in range(1, self.next_id):
+      self.file.write(("%010d 00000 n \n" % self.offsets[id]).encode('ascii'))
+    self.file.write(("trailer\n<< /Size " + str(self.next_id) + " /Root 1 0 R >>\nstartxref\n" + str(xref) + "\n%%EOF\n").encode('ascii'))
+    self.file.close()
+    os.replace(self.temp, self.filepath)
+    print("Exported " + str(self.cards) + " cards on " + str(len(self.pages)) + " pages to " + self.filepath)
+
+def pdf_image(data):
+  """
+  Turns an encoded card into a pdf image. JPEG is embedded as it is, and so is the compressed
+  data of an 8 bit RGB PNG, since pdf decodes both the same way. Anything else is decoded and
+  compressed again
+
+  RETURNS:
+   - A tuple of (width, height, dictionary, stream) of the pdf image object
+  """
+  if data.startswith(JPEG_SIGNATURE):
+    size = jpeg_size(data)
+    if size is not None:
+      width, height, components = size
+      colours = { 1:"/DeviceGray", 3:"/DeviceRGB", 4:"/DeviceCMYK" }[components]
+      return (width, height, "/Type /XObject /Subtype /Image /Width " + str(width) + " /Height " + str(height) +
+              " /ColorSpace " + colours + " /BitsPerComponent 8 /Filter /DCTDecode", data)
+
+  if data.startswith(PNG_SIGNATURE):
+    header, compressed = png_chunks(data)
+    width, height, depth, colour_type, compression, filter, interlace = struct.unpack(">IIBBBBB", header)
+    if depth == 8 and colour_type == 2 and interlace == 0:
+      return (width, height, "/Type /XObject /Subtype /Image /Width " + str(width) + " /Height " + str(height) +
+              " /ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode"
+              " /DecodeParms << /Predictor 15 /Colors 3 /BitsPerComponent 8 /Columns " + str(width) + " >>", compressed)
+
+  # Such as webp or png with transparency
+  surface = pygame.image.load(io.BytesIO(data))
+  width, height = surface.get_size()
+  return (width, height, "/Type /XObject /Subtype /Image /Width " + str(width) + " /Height " + str(height) +
+          " /ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode",
+          zlib.compress(pygame.image.tobytes(surface, "RGB"), 6))
+
+def png_chunks(data):
+  """
+  RETURNS:
+   - A tuple of the IHDR chunk of a png and all of its IDAT chunks joined together
+  """
+  header = None
+  compressed = []
+  i = len(PNG_SIGNATURE)
+  while i < len(data):
+    length, kind = struct.unpack(">I4s", data[i:i+8])
+    if kind == b'IHDR':
+      header = data[i+8:i+8+length]
+    elif kind == b'IDAT':
+      compressed.append(data[i+8:i+8+length])
+    elif kind == b'IEND':
+      break
+    i += 12 + length
+  return header, b"".join(compressed)
+
+def jpeg_size(data):
+  """
+  RETURNS:
+   - A tuple of (width, height, components) of a jpeg, read from its frame header, or None
+     if it does not have one
+  """
+  i = 2
+  while i + 4 <= len(data):
+    if data[i] != 0xFF:
+      return None
+    marker = data[i+1]
+    # Start of frame markers, other than the ones for huffman tables, arithmetic coding and restarts
+    if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+      height, width = struct.unpack(">HH", data[i+5:i+9])
+      return (width, height, data[i+9])
+    i += 2 + struct.unpack(">H", data[i+2:i+4])[0]
+  return None
+
+# The package formats, by file extension
+EXPORTS = {
+  ".zip":ZipExport,
+  ".pdf":PdfExport
+}
+
+def open_export(filepath, **settings):
+  """
+  Starts exporting to filepath, as a zip or pdf depending on its extension
+
+  PARAMETERS:
+   - filepath: Where to write the package, such as proxies.zip or proxies.pdf
+   - settings: The settings of the Output.Writer to encode cards with, such as format and quality
+
+  RETURNS:
+   - The ExportWriter, to render cards with in place of an Output.Writer
+  """
+  extension = path.splitext(filepath)[1].lower()
+  if extension not in EXPORTS:
+    raise ValueError("Cannot export to " + filepath + ", use one of " + ", ".join(EXPORTS))
+  if extension == ".pdf" and settings.get("format") == "webp":
+    raise ValueError("Cannot put webp cards in a pdf, use png or jpg")
+  directory = path.dirname(filepath)
+  if directory != "" and not path.exists(directory):
+    os.makedirs(directory)
+  return EXPORTS[extension](filepath, **settings)
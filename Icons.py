@@ -1,4 +1,16 @@
-import pygame, Cards
+import pygame, json, os, Cards
+import os.path as path
+
+# Every symbol is scaled once and packed into a single atlas image, which is saved here along with
+# an index of where each symbol is. Later runs load the atlas rather than every symbol image.
+ATLAS_IMAGE = "data/symbol-atlas.png"
+ATLAS_INDEX = "data/symbol-atlas.json"
+ATLAS_VERSION = 1
+ATLAS_WIDTH = 2048
+
+TITLE_SIZE = (150, 150)   # The minimum size of symbols in the mana cost
+TEXT_SIZE = 104           # The height of symbols in rules text at the largest font size
+TEXT_SCALE = 0.8          # The height of symbols in rules text, as a fraction of the font size
 
 class Icons:
   """
@@ -8,11 +20,13 @@ class Icons:
   def __init__(self):
     """
     Loads a bunch of images from template-data/symbols and stores them in dictionaries
-    To prevent slow initializing, start by storing paths in dictionaries. Whenever an
-    icon is needed, load the icon image by path and store the image in a cache.
+    To prevent slow initializing, start by storing paths in dictionaries. The first time an
+    icon is needed, every icon is loaded at once from the symbol atlas, which is built from
+    those paths if it does not exist yet.
 
     self.title_cache: loaded icons to be used in the title box (mana costs for the card)
     self.text_cache: loaded icons to be used in the text box (tap symbols, smaller mana symbols, etc)
+                     by (symbol, height)
     self.title_path: icons by path, to be loaded from and stored in the cache when needed
     self.text_path: same thing
     """
@@ -20,32 +34,128 @@ class Icons:
     self.text_path = {}
     self.title_cache = {}
     self.text_cache = {}
+    self.loaded = False
 
     # Start with numbers
     for i in range(16):
       self.title_path[str(i)] = "template-data/symbols/title/" + str(i) + ".png"
-    
+
     # Coloured mana symbols
     for c in ['W', 'U', 'B', 'R', 'G', 'C', 'S', 'X']:
       self.title_path[c] = "template-data/symbols/title/mana_" + c.lower() + ".png"
 
     # Dual costs of 2/C (mostly for reaper king)
     for c in ['2/B', '2/G', '2/R', '2/W', '2/U']:
-      self.title_path[c] = "template-data/symbols/title/" + c + ".png"
+      self.title_path[c] = "template-data/symbols/title/" + c.replace("/", "") + ".png"
 
     # Two colour costs, in the form of U/R, for stuff like Guttural Response
     for c in ['B/G', 'B/R', 'G/U', 'G/W', 'R/G', 'R/W', 'U/B', 'U/R', 'W/B', 'W/U']:
       self.title_path[c] = "template-data/symbols/title/mana_" + (c[0] + c[2]).lower() + ".png"
-    
+
     # Phyraxian mana costs, in the form of R/P, for stuff like Gut Shot
     for c in ['W/P', 'U/P', 'B/P', 'R/P', 'G/P']:
       self.title_path[c] = "template-data/symbols/title/mana_phy" + c[0].lower() + ".png"
 
+    # Rules text uses the same symbols, just smaller
+    self.text_path = dict(self.title_path)
+
+  def load(self):
+    """
+    Fills the caches from the symbol atlas, rebuilding the atlas first if it is missing
+    or any of the symbol images have changed since it was built
+    """
+    self.loaded = True
+    signature = self.get_signature()
+
+    index = None
+    if path.exists(ATLAS_INDEX) and path.exists(ATLAS_IMAGE):
+      with open(ATLAS_INDEX) as f:
+        index = json.load(f)
+      if index.get("signature") != signature:
+        index = None
+
+    if index is None:
+      atlas, index = self.build_atlas(signature)
+    else:
+      atlas = pygame.image.load(ATLAS_IMAGE)
+
+    # Match the pixel layout of the cards the symbols are drawn on, like Template.load_asset does
+    atlas = Cards.convert_for_blit(atlas)
+
+    for symbol, rect in index["title"].items():
+      self.title_cache[symbol] = atlas.subsurface(rect)
+    for symbol, rect in index["text"].items():
+      self.text_cache[(symbol, TEXT_SIZE)] = atlas.subsurface(rect)
+
+  def get_signature(self):
+    """
+    RETURNS:
+     - A list that changes whenever the symbol images or the way they are scaled changes
+    """
+    signature = [ATLAS_VERSION, TITLE_SIZE[0], TITLE_SIZE[1], TEXT_SIZE]
+    for symbol in sorted(self.title_path):
+      filepath = self.title_path[symbol]
+      if path.exists(filepath):
+        stat = os.stat(filepath)
+        signature.append([symbol, stat.st_size, stat.st_mtime_ns])
+    return signature
+
+  def build_atlas(self, signature):
+    """
+    Loads and scales every symbol, and packs them in rows onto a single image. The atlas is
+    saved to data so that it only has to be built once.
+
+    PARAMETERS:
+     - signature: The signature of the symbol images, stored with the index
+
+    RETURNS:
+     - A tuple of (atlas, index), where index holds the rectangle of each symbol in the atlas
+    """
+    glyphs = []
+    for symbol in sorted(self.title_path):
+      if not path.exists(self.title_path[symbol]):
+        continue
+      i = pygame.image.load(self.title_path[symbol])
+      glyphs.append(("title", symbol, Cards.dynamically_scale_card(i, TITLE_SIZE)))
+      glyphs.append(("text", symbol, Cards.dynamically_scale_card(i, (1, TEXT_SIZE))))
+
+    # Simple shelf packing, fill each row left to right and start a new one when it is full
+    index = { "signature":signature, "title":{}, "text":{} }
+    x = y = row = 0
+    for kind, symbol, glyph in glyphs:
+      w, h = glyph.get_size()
+      if x + w > ATLAS_WIDTH:
+        x, y, row = 0, y + row, 0
+      index[kind][symbol] = [x, y, w, h]
+      x += w
+      row = max(row, h)
+
+    atlas = pygame.Surface((ATLAS_WIDTH, max(y + row, 1)), pygame.SRCALPHA, 32)
+    atlas.fill((0, 0, 0, 0))
+    for kind, symbol, glyph in glyphs:
+      atlas.blit(glyph, index[kind][symbol][:2])
+
+    if path.exists(path.dirname(ATLAS_IMAGE)):
+      pygame.image.save(atlas, ATLAS_IMAGE + ".tmp.png")
+      os.replace(ATLAS_IMAGE + ".tmp.png", ATLAS_IMAGE)
+      with open(ATLAS_INDEX, 'w') as f:
+        json.dump(index, f)
+    return atlas, index
+
+  def has_symbol(self, symbol):
+    """
+    RETURNS:
+     - True if there is an icon for the symbol, in format either "{W}" or "W"
+    """
+    if symbol[:1] == "{":
+      symbol = symbol[1:-1]
+    return symbol in self.title_path and path.exists(self.title_path[symbol])
+
   def get_title(self, symbol):
     """
-    If the image for the symbol is not already in cache, load it and store it in cache
+    Gets the image for the symbol from the symbol atlas
     Title size, so used for the mana cost of the card in the top right corner
-    
+
     PARAMETERS:
      - symbol: can be in format either "{W}" or "W"
 
@@ -53,18 +163,51 @@ class Icons:
      - The image as a pygame Surface
     """
     # If the symbol requested is formatted as {W}, cut off the head and end
-    if symbol[0] == "{":
+    if symbol[:1] == "{":
       symbol = symbol[1:-1]
 
-    # Check if the symbol exists in the title cache, if it does not, try to load it
+    if not self.loaded:
+      self.load()
     if symbol in self.title_cache:
       return self.title_cache[symbol]
-    
-    if symbol in self.title_path:
-      i = pygame.image.load(self.title_path[symbol])
-      i = Cards.dynamically_scale_card(i,(150,150))
-      self.title_cache[symbol] = i
-      return i
-    
+
     print('Cannot find symbol "' + symbol + '"')
     return
+
+  def get_text(self, symbol, size):
+    """
+    Gets the image for the symbol to be drawn inline with rules text of the given font size.
+    Symbols are stored in the atlas for the largest font size, other sizes are scaled from
+    those the first time they are needed.
+
+    PARAMETERS:
+     - symbol: can be in format either "{W}" or "W"
+     - size: The font size of the rules text
+
+    RETURNS:
+     - The image as a pygame Surface, or None if there is no icon for the symbol
+    """
+    if symbol[:1] == "{":
+      symbol = symbol[1:-1]
+
+    if not self.loaded:
+      self.load()
+    height = int(size * TEXT_SCALE)
+    if (symbol, height) in self.text_cache:
+      return self.text_cache[(symbol, height)]
+    if (symbol, TEXT_SIZE) not in self.text_cache:
+      return None
+
+    i = Cards.dynamically_scale_card(self.text_cache[(symbol, TEXT_SIZE)], (1, height))
+    self.text_cache[(symbol, height)] = i
+    return i
+
+  def get_text_width(self, symbol, size):
+    """
+    RETURNS:
+     - The width of the symbol drawn inline with rules text of the given font size
+    """
+    i = self.get_text(symbol, size)
+    if i is None:
+      return 0
+    return i.get_width()
@@ -0,0 +1,269 @@
+import pickle, unicodedata, re
+import os.path as path
+from array import array
+import Database
+
+NAME_INDEX_FILE = "data/name-index.ser"
+
+SUGGESTION_LIMIT = 5
+SUGGESTION_MIN_SCORE = 0.3    # How similar a name has to be to be suggested, from 0 to 1
+
+# From how many names find_card_names reads every name in the database, rather than looking each one up
+BATCH_LOOKUP_MIN = 500
+
+# The index loaded by get_name_index, so it is only read once per process
+_index = None
+
+def normalize_name(name):
+  """
+  Reduces a card name to a loose form for lookups, so that case, accents and punctuation do
+  not matter. Example: "Lim-Dûl's Vault" -> "lim duls vault"
+
+  PARAMETERS:
+   - name: The card name as typed
+
+  RETURNS:
+   - The normalized name
+  """
+  name = unicodedata.normalize("NFKD", name)
+  name = "".join(c for c in name if not unicodedata.combining(c)).casefold()
+  name = name.replace("'", "").replace("’", "")
+  return " ".join(re.sub(r"[^0-9a-z]+", " ", name).split())
+
+def trigrams(key):
+  """
+  RETURNS:
+   - The set of three letter pieces of a normalized name, padded so that the start and end
+     of the name count too
+  """
+  key = "  " + key + " "
+  return { key[i:i+3] for i in range(len(key) - 2) }
+
+class NameIndex:
+  """
+  An index of every card name in the local database, built when the database is serialized
+
+  Holds a map of normalized names to card names, where each face of a split or double faced
+  card (such as "Fire // Ice") is also an alias of the full name, as well as a trigram index
+  for suggesting names that are close to a name that could not be found
+  """
+  def __init__(self, names):
+    """
+    PARAMETERS:
+     - names: Every card name in the local database
+    """
+    self.names = sorted(names)
+    self.keys = {}
+
+    # Full names first, so that they always win over a face of another card with the same name
+    for i, name in enumerate(self.names):
+      self.keys[normalize_name(name)] = i
+    for i, name in enumerate(self.names):
+      if " // " in name:
+        for face in name.split(" // "):
+          self.keys.setdefault(normalize_name(face), i)
+
+    postings = {}
+    self.sizes = array('H')
+    for i, name in enumerate(self.names):
+      grams = trigrams(normalize_name(name))
+      self.sizes.append(len(grams))
+      for gram in grams:
+        postings.setdefault(gram, []).append(i)
+    self.trigrams = { gram:array('I', ids) for gram, ids in postings.items() }
+
+  def resolve(self, name):
+    """
+    Finds the card a loosely typed name refers to, ignoring case, accents and punctuation,
+    or matching a single face of a split or double faced card
+
+    PARAMETERS:
+     - name: The name as typed, such as "lightning bolt" or "Fire"
+
+    RETURNS:
+     - The name as stored in the local database, or None if there is no such card
+    """
+    i = self.keys.get(normalize_name(name))
+    if i is None:
+      return None
+    return self.names[i]
+
+  def suggest(self, name, limit=SUGGESTION_LIMIT):
+    """
+    Ranks the card names that look the most like name, by how many trigrams they share
+
+    PARAMETERS:
+     - name: The name that could not be found
+     - limit: The most suggestions to return
+
+    RETURNS:
+     - A list of card names, most similar first
+    """
+    query = trigrams(normalize_name(name))
+    shared = {}
+    for gram in query:
+      for i in self.trigrams.get(gram, ()):
+        shared[i] = shared.get(i, 0) + 1
+
+    # Score by the overlap of the two sets of trigrams, so long names are not favoured
+    scored = []
+    for i, count in shared.items():
+      score = count / (len(query) + self.sizes[i] - count)
+      if score >= SUGGESTION_MIN_SCORE:
+        scored.append((-score, self.names[i]))
+    scored.sort()
+    return [name for score, name in scored[:limit]]
+
+def write_name_index(names, filepath=NAME_INDEX_FILE, verbose=True):
+  """
+  Builds the name index for a list of card names and serializes it to data/name-index.ser
+
+  PARAMETERS:
+   - names: Every card name in the local database
+   - filepath: Where to write the index
+   - verbose: If you would like to see all messages printed to the terminal
+  """
+  if verbose:
+    print("Indexing names to " + filepath + "...")
+  with open(filepath, 'wb') as f:
+    pickle.dump(NameIndex(names), f, pickle.HIGHEST_PROTOCOL)
+
+def get_name_index():
+  """
+  Loads the name index the first time it is needed
+
+  RETURNS:
+   - The NameIndex, or None if it has not been built yet
+  """
+  global _index
+  if _index is None and path.exists(NAME_INDEX_FILE):
+    with open(NAME_INDEX_FILE, 'rb') as f:
+      _index = pickle.load(f)
+  return _index
+
+def find_card_name(name, database):
+  """
+  Finds the name a card is stored under in the database. Exact names are looked up directly,
+  only names that are not found exactly go through the name index
+
+  PARAMETERS:
+   - name: The card name as typed
+   - database: The local database of all cards
+
+  RETURNS:
+   - The name of the card in the database, or None if it cannot be found
+  """
+  if name in database:
+    return name
+  index = get_name_index()
+  if index is None:
+    return None
+  resolved = index.resolve(name)
+  if resolved is None or resolved not in database:
+    return None
+  return resolved
+
+def find_card_names(names, database):
+  """
+  Finds the names a lot of cards are stored under at once, such as every card of a collection.
+  Works like find_card_name, but with enough names every name in the database is read at once
+
+  PARAMETERS:
+   - names: The card names as typed
+   - database: The local database of all cards
+
+  RETURNS:
+   - A dictionary of each name as typed to its name in the database, or None if it cannot be found
+  """
+  index = get_name_index()
+  if index is None or len(names) < BATCH_LOOKUP_MIN:
+    return { name:find_card_name(name, database) for name in names }
+
+  # Read every name in the database once, rather than asking it about each name
+  stored = set(database.keys())
+  found = {}
+  for name in names:
+    resolved = name if name in stored else index.resolve(name)
+    found[name] = resolved if resolved in stored else None
+  return found
+
+def suggest_card_names(name):
+  """
+  RETURNS:
+   - A list of names close to the name that could not be found, empty if there is no name index
+  """
+  index = get_name_index()
+  if index is None:
+    return []
+  return index.suggest(name)
+
+def find_card(name, database, verbose=True):
+  """
+  Finds the name a card is stored under in the local database, see find_card_name.
+  If it cannot be found, prints an error message along with the closest card names
+
+  PARAMETERS:
+   - name: the card name as typed, case, accents and punctuation do not matter
+   - database: the local database of all cards
+   - verbose: if the error message should be printed
+
+  RETURNS:
+   - The name of the card in the database, or None if it cannot be found
+  """
+  resolved = find_card_name(name, database)
+  if resolved is None and verbose:
+    print(missing_card_message(name))
+  return resolved
+
+def lookup_card(name, database, verbose=True):
+  """
+  Finds a card by name, or a specific printing of it written as "Lightning Bolt (2XM) 141",
+  which is looked up in the printing database. The name can be left out of a printing, and
+  so can the collector number, which picks the first English printing in that set.
+
+  PARAMETERS:
+   - name: the card name or printing as typed
+   - database: the local database of all cards
+   - verbose: if an error message should be printed when it cannot be found
+
+  RETURNS:
+   - The card, or None if it cannot be found
+  """
+  printing = Database.parse_printing(name)
+  if printing is None:
+    resolved = find_card(name, database, verbose)
+    return database[resolved] if resolved is not None else None
+
+  card_name, set_code, collector_number = printing
+  resolved = None
+  if card_name != "":
+    resolved = find_card(card_name, database, verbose)
+    if resolved is None:
+      return None
+  card = None
+  printings = Database.get_printing_database()
+  if printings is not None:
+    card = printings.find(set_code, collector_number, resolved)
+  if card is None and verbose:
+    print(missing_card_message(name))
+  return card
+
+def missing_card_message(name):
+  """
+  RETURNS:
+   - The error message for a card that is not in the local database, with suggestions if there are any
+  """
+  printing = Database.parse_printing(name)
+  if printing is not None and Database.get_printing_database() is None:
+    return "Cannot find " + name + ", specific printings need " + Database.ALL_PRINTINGS_INDEXED + \
+      "\n  Build it with python Engine.py -update all -printings default"
+  if printing is not None:
+    index = get_name_index()
+    if printing[0] == "" or (index is not None and index.resolve(printing[0]) is not None):
+      return "Cannot find the printing " + name + " in the local database"
+    name = printing[0]
+  message = "Cannot find " + name + " in local database"
+  suggestions = suggest_card_names(name)
+  if len(suggestions) > 0:
+    message += "\n  Did you mean: " + ", ".join(suggestions) + "?"
+  return message
@@ -0,0 +1,227 @@
+import os, shutil, threading, pygame
+import os.path as path
+from concurrent.futures import ThreadPoolExecutor
+import Profiler
+
+# Pillow is optional. It is needed for WebP and to choose the PNG compression or JPEG quality,
+# otherwise cards are saved with pygame at its default settings, which is also faster for PNG
+try:
+  from PIL import Image
+except ImportError:
+  Image = None
+
+FORMATS = {
+  "png":".png",
+  "jpg":".jpg",
+  "webp":".webp"
+}
+ENCODERS = ["pygame", "pillow"]
+DEFAULT_FORMAT = "png"
+DEFAULT_QUALITY = 95      # For jpg and webp with Pillow, from 1 to 100
+DEFAULT_COMPRESSION = 6   # For png with Pillow, from 0 (fastest, largest) to 9 (slowest, smallest)
+
+SAVE_WORKERS = 2          # Threads that encode and write cards in the background, 0 saves before returning
+SAVE_QUEUE = 2            # Most finished cards that can wait to be saved, each full card is around 55 MB
+
+class Writer:
+  """
+  Encodes and saves finished cards to output on a pool of background threads, so that the
+  next card can be drawn while the last one is being written. At most SAVE_QUEUE cards wait
+  to be written at once, saving another one blocks until there is room.
+
+  Call close() when done, to wait for every card to be written and report any that failed
+  """
+  SAVES_TO_OUTPUT = True    # If finished cards end up in output, where the render cache can keep them
+
+  def __init__(self, format=DEFAULT_FORMAT, quality=None, compression=None, encoder=None,
+               workers=SAVE_WORKERS, queue=SAVE_QUEUE):
+    """
+    PARAMETERS:
+     - format: The image format of the cards, one of FORMATS
+     - quality: The quality of jpg and webp cards, None for the default
+     - compression: The compression level of png cards, None for the default
+     - encoder: "pygame" or "pillow", None to use pygame unless the format or settings need Pillow
+     - workers: How many threads to save cards on, 0 to save each card before save() returns
+     - queue: How many cards can wait to be saved at once
+    """
+    if format not in FORMATS:
+      raise ValueError("Unknown output format " + str(format) + ", use one of " + ", ".join(FORMATS))
+    if encoder is None:
+      encoder = "pygame"
+      if format == "webp" or quality is not None or compression is not None:
+        encoder = "pillow"
+    if encoder not in ENCODERS:
+      raise ValueError("Unknown encoder " + str(encoder) + ", use one of " + ", ".join(ENCODERS))
+    if encoder == "pillow" and Image is None:
+      raise ValueError("Saving webp or choosing the quality or compression needs Pillow, install it with \"pip install pillow\"")
+    if encoder == "pygame" and format == "webp":
+      raise ValueError("pygame cannot save webp, use the pillow encoder")
+
+    self.format = format
+    self.encoder = encoder
+    self.quality = quality if quality is not None else DEFAULT_QUALITY
+    self.compression = compression if compression is not None else DEFAULT_COMPRESSION
+    self.extension = FORMATS[format]
+
+    self.pool = None
+    if workers > 0:
+      self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Writer")
+    self.room = threading.BoundedSemaphore(max(queue, 1))
+    self.lock = threading.Lock()
+    self.futures = set()
+    self.callbacks = {}
+    self.failures = []
+
+  def settings(self):
+    """
+    RETURNS:
+     - Everything about the writer that changes the saved file, for Template.render_key
+    """
+    if self.encoder == "pygame":
+      return { "format":self.format, "encoder":self.encoder }
+    return { "format":self.format, "encoder":self.encoder, "quality":self.quality, "compression":self.compression }
+
+  def save(self, surface, filepath, name=None):
+    """
+    Saves a surface to filepath, in the background if the writer has threads
+
+    PARAMETERS:
+     - surface: The finished card. It is not copied, so do not draw on it after saving
+     - filepath: Where to save the card, which should end in the writer's extension
+     - name: The name of the card, for the profiler and error messages
+    """
+    if self.pool is None:
+      self.write(surface, filepath, name)
+      return
+
+    # Wait for room in the queue before handing the card over
+    self.room.acquire()
+    with self.lock:
+      waiting = filepath in self.callbacks
+      self.callbacks.setdefault(filepath, [])
+    try:
+      future = self.pool.submit(self.write, surface, filepath, name)
+    except BaseException:
+      # Such as after the pool was shut down, give the room back so later saves do not hang
+      with self.lock:
+        if not waiting:
+          self.callbacks.pop(filepath, None)
+      self.room.release()
+      raise
+    with self.lock:
+      self.futures.add(future)
+    future.add_done_callback(self.done)
+
+  def done(self, future):
+    """
+    Runs once a card has been written, making room for the next one
+    """
+    with self.lock:
+      self.futures.discard(future)
+    self.room.release()
+
+  def write(self, surface, filepath, name=None):
+    """
+    Encodes and writes a single card. The card is written to a temporary file of its own next
+    to filepath and then moved into place, so that output never holds a half written card, even
+    when the same card is saved twice at once
+    """
+    with Profiler.stage("encode", name):
+      # Named for this process and thread, mkstemp would leave the card readable only by its owner
+      temp = path.splitext(filepath)[0] + "." + str(os.getpid()) + "-" + str(threading.get_ident()) + ".tmp" + self.extension
+      try:
+        self.encode(surface, temp)
+        os.replace(temp, filepath)
+        Profiler.wrote_file(filepath)
+      except Exception as e:
+        # Do not leave the temporary file in output, where it would look like a card
+        if path.exists(temp):
+          os.remove(temp)
+        with self.lock:
+          self.failures.append((name if name is not None else filepath, str(e)))
+          self.callbacks.pop(filepath, None)
+        return
+
+    with self.lock:
+      callbacks = self.callbacks.pop(filepath, [])
+    for callback in callbacks:
+      callback()
+
+  def encode(self, surface, target):
+    """
+    Encodes a card in the writer's format and settings
+
+    PARAMETERS:
+     - surface: The finished card
+     - target: A filepath, or a binary file object such as io.BytesIO
+    """
+    if self.encoder == "pillow":
+      image = Image.frombytes("RGB", surface.get_size(), pygame.image.tobytes(surface, "RGB"))
+      if self.format == "png":
+        image.save(target, "PNG", compress_level=self.compression)
+      elif self.format == "jpg":
+        image.save(target, "JPEG", quality=self.quality, subsampling=0 if self.quality >= 90 else 2)
+      else:
+        image.save(target, "WEBP", quality=self.quality)
+    elif isinstance(target, str):
+      pygame.image.save(surface, target)
+    else:
+      # pygame picks the format from the name hint when saving to a file object
+      pygame.image.save(surface, target, "card" + self.extension)
+
+  def copy(self, source, filepath, name=None):
+    """
+    Puts a card that is already encoded, such as a cached render, where save() would have
+    saved it
+
+    PARAMETERS:
+     - source: The encoded card, in the writer's format
+     - filepath: Where the card should end up, such as output/lightning-bolt.png
+     - name: The name of the card, for error messages
+    """
+    shutil.copyfile(source, filepath)
+
+  def when_written(self, filepath, callback):
+    """
+    Calls callback once the card being saved to filepath is written, or straight away if it
+    is not waiting to be saved. The callback may run on a writer thread, and is dropped if
+    the card cannot be saved.
+    """
+    with self.lock:
+      if filepath in self.callbacks:
+        self.callbacks[filepath].append(callback)
+        return
+    callback()
+
+  def wait(self):
+    """
+    Waits for every card handed to save() so far to be written
+
+    RETURNS:
+     - A list of (name, error) for every card that could not be saved, since the last wait
+    """
+    while True:
+      with self.lock:
+        futures = list(self.futures)
+      if len(futures) == 0:
+        break
+      for future in futures:
+        future.result()
+
+    with self.lock:
+      failures = self.failures
+      self.failures = []
+    return failures
+
+  def close(self):
+    """
+    Waits for every card to be written, then prints any that could not be saved. Cards saved
+    after closing are written before save() returns
+    """
+    failures = self.wait()
+    if self.pool is not None:
+      self.pool.shutdown()
+      self.pool = None
+    for name, error in failures:
+      print("Could not save " + name + ": " + error)
+    return failures
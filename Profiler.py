@@ -0,0 +1,248 @@
+"""
+A small profiler for rendering cards, turned on with the -profile flag of Engine.py
+
+The engine marks the stages of rendering a card with Profiler.stage(name), such as loading
+template images, fetching art, scaling, blitting, text and saving. While profiling, every
+stage is timed and tagged with the card it belongs to and the bytes it read and wrote.
+At the end the stages are summed up into a table, and written out as a trace that can be
+opened in chrome://tracing or https://ui.perfetto.dev
+
+When profiling is off, stage() hands back a shared object that does nothing, so the marks
+cost next to nothing.
+"""
+
+import os, json, time, threading
+
+PROFILE_FILE = "data/profile-trace.json"
+
+ENABLED = False
+trace_file = PROFILE_FILE
+
+# Every finished stage, as tuples of
+# (card, stage, start, duration, self_duration, bytes_read, bytes_written, pid, thread)
+_records = []
+
+# The stages currently running on each thread, and the card each thread is working on
+_local = threading.local()
+
+class Stage:
+  """
+  A single timed stage, used as a context manager. Time spent in stages nested inside of it
+  is counted towards it, and also kept track of so that its own time can be told apart.
+  """
+  __slots__ = ("name", "card", "start", "nested", "bytes_read", "bytes_written")
+
+  def __init__(self, name, card=None):
+    self.name = name
+    self.card = card
+    self.nested = 0.0
+    self.bytes_read = 0
+    self.bytes_written = 0
+
+  def __enter__(self):
+    stack = get_stack()
+    if self.card is None:
+      self.card = stack[-1].card if len(stack) > 0 else getattr(_local, "card", None)
+    stack.append(self)
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    duration = time.perf_counter() - self.start
+    stack = get_stack()
+    stack.pop()
+    if len(stack) > 0:
+      stack[-1].nested += duration
+    _records.append((self.card, self.name, self.start, duration, duration - self.nested,
+                     self.bytes_read, self.bytes_written, os.getpid(), threading.get_ident()))
+    return False
+
+class NullStage:
+  """
+  Stands in for a Stage while profiling is off
+  """
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+NULL_STAGE = NullStage()
+
+def get_stack():
+  """
+  RETURNS:
+   - The list of stages currently running on this thread, innermost last
+  """
+  stack = getattr(_local, "stack", None)
+  if stack is None:
+    stack = _local.stack = []
+  return stack
+
+def enable(filepath=PROFILE_FILE):
+  """
+  Turns profiling on for this process
+
+  PARAMETERS:
+   - filepath: Where report() writes the trace
+  """
+  global ENABLED, trace_file
+  ENABLED = True
+  trace_file = filepath
+
+def stage(name, card=None):
+  """
+  Marks a stage of work, use as "with Profiler.stage("save"):"
+
+  PARAMETERS:
+   - name: The name of the stage, stages with the same name are summed up together
+   - card: The name of the card the stage is for, defaults to the card of the stage it is
+     nested in, or the card set by set_card
+
+  RETURNS:
+   - A context manager that times the stage, or one that does nothing if profiling is off
+  """
+  if not ENABLED:
+    return NULL_STAGE
+  return Stage(name, card)
+
+def set_card(name):
+  """
+  Sets the card that stages on this thread belong to, until it is set again
+  """
+  if ENABLED:
+    _local.card = name
+
+def read_file(filepath):
+  """
+  Counts the size of a file that was just read towards the innermost running stage
+  """
+  if ENABLED:
+    stack = get_stack()
+    if len(stack) > 0 and os.path.exists(filepath):
+      stack[-1].bytes_read += os.path.getsize(filepath)
+
+def wrote_file(filepath):
+  """
+  Counts the size of a file that was just written towards the innermost running stage
+  """
+  if ENABLED:
+    stack = get_stack()
+    if len(stack) > 0 and os.path.exists(filepath):
+      stack[-1].bytes_written += os.path.getsize(filepath)
+
+def take():
+  """
+  Removes and returns every record so far, so that worker processes can send theirs back
+  to be reported along with the main process
+  """
+  records = list(_records)
+  del _records[:len(records)]
+  return records
+
+def extend(records):
+  """
+  Adds records that were taken from another process
+  """
+  _records.extend(records)
+
+def summarize(records=None):
+  """
+  Sums up the records by stage
+
+  RETURNS:
+   - A list of dictionaries, one per stage, with the number of calls, the total and own time
+     in seconds, the longest call, and the bytes read and written. Sorted by own time, longest first
+  """
+  if records is None:
+    records = _records
+  stages = {}
+  for card, name, start, duration, own, read, written, pid, thread in records:
+    if name not in stages:
+      stages[name] = { "stage":name, "calls":0, "total":0.0, "self":0.0, "max":0.0, "bytes_read":0, "bytes_written":0 }
+    s = stages[name]
+    s["calls"] += 1
+    s["total"] += duration
+    s["self"] += own
+    s["max"] = max(s["max"], duration)
+    s["bytes_read"] += read
+    s["bytes_written"] += written
+  return sorted(stages.values(), key=lambda s: -s["self"])
+
+def format_bytes(n):
+  """
+  RETURNS:
+   - A number of bytes in a readable form, such as "12.3 MB"
+  """
+  for unit in ["B", "KB", "MB"]:
+    if n < 1024:
+      return str(round(n, 1)) + " " + unit
+    n /= 1024
+  return str(round(n, 1)) + " GB"
+
+def print_summary(records=None):
+  """
+  Prints a table of the time spent in each stage, followed by the slowest cards
+  """
+  if records is None:
+    records = _records
+  stages = summarize(records)
+  own_time = sum(s["self"] for s in stages)
+
+  print("\nProfile:")
+  print("{:<16}{:>7}{:>11}{:>11}{:>7}{:>11}{:>12}{:>12}".format(
+    "Stage", "Calls", "Total s", "Self s", "Self%", "Max ms", "Read", "Written"))
+  for s in stages:
+    print("{:<16}{:>7}{:>11.3f}{:>11.3f}{:>6.1f}%{:>11.1f}{:>12}{:>12}".format(
+      s["stage"], s["calls"], s["total"], s["self"], 100 * s["self"] / own_time if own_time > 0 else 0,
+      s["max"] * 1000, format_bytes(s["bytes_read"]), format_bytes(s["bytes_written"])))
+
+  # The cards that took the longest from start to finish
+  cards = {}
+  for card, name, start, duration, own, read, written, pid, thread in records:
+    if card is not None and name == "execute":
+      cards[card] = cards.get(card, 0.0) + duration
+  if len(cards) > 1:
+    print("\nSlowest Cards:")
+    for card, duration in sorted(cards.items(), key=lambda c: -c[1])[:5]:
+      print("{:>9.3f}s  {}".format(duration, card))
+
+def write_trace(filepath, records=None):
+  """
+  Writes the records in the chrome trace event format, one bar per stage, nested by time
+
+  PARAMETERS:
+   - filepath: Where to write the trace, such as data/profile-trace.json
+  """
+  if records is None:
+    records = _records
+  if len(records) == 0:
+    return
+  origin = min(r[2] for r in records)
+  events = []
+  for card, name, start, duration, own, read, written, pid, thread in records:
+    events.append({
+      "name":name, "cat":"render", "ph":"X", "pid":pid, "tid":thread,
+      "ts":round((start - origin) * 1e6, 1), "dur":round(duration * 1e6, 1),
+      "args":{ "card":card, "bytes_read":read, "bytes_written":written },
+    })
+  # Draw enclosing stages before the ones nested inside them
+  events.sort(key=lambda e: (e["pid"], e["tid"], e["ts"], -e["dur"]))
+
+  directory = os.path.dirname(filepath)
+  if directory != "" and not os.path.exists(directory):
+    os.makedirs(directory)
+  with open(filepath, 'w') as f:
+    json.dump({ "traceEvents":events, "displayTimeUnit":"ms" }, f)
+
+def report():
+  """
+  Prints the summary and writes the trace to the file given to enable(), or says that nothing
+  was profiled if no stages were recorded
+  """
+  if len(_records) == 0:
+    print("\nNothing was profiled, no stages were recorded")
+    return
+  print_summary()
+  write_trace(trace_file)
+  print("\nWrote profile trace to " + trace_file)
@@ -0,0 +1,180 @@
+"""
+Rendering cards by name, for Engine.py and the worker processes it renders decklists with
+
+Kept apart from Engine.py so that commands which do not render anything never have to load
+pygame and the templates
+"""
+
+import os, traceback, multiprocessing
+import Cards, Template, RenderCache, Names, Profiler, Output
+
+def construct_card(name, database, template, basic=False, cache=None, reuse=True):
+  """
+  A helper function to actually construct the card by name and template
+  Will format the card and place it in output under its name, along with its set and
+  collector number if a specific printing was asked for, see Names.lookup_card
+
+  If the card cannot be found in the local database, will print an error message
+
+  PARAMETERS:
+   - name: the card name as a string, a loosely typed name or a single face is also found
+   - template: the template to use when formatting the card
+   - basic: if the card should be formatted for MPC or not (default to MPC formatting)
+   - cache: a RenderCache to reuse earlier renders of the card from, if nothing about it changed,
+     and to store the new render in
+   - reuse: if False the card is always rendered and only stored in the cache, for callers that
+     have already looked for it there, such as the render server
+
+  RETURNS:
+   - True if the card could be constructed and placed in output, False if the card
+     name could not be found in the local database or the template could not render it,
+     such as when its art cannot be found
+  """
+  card = Names.lookup_card(name, database)
+  if card is None:
+    return False
+  name = card["name"]
+  Profiler.set_card(name)
+
+  # Skip rendering entirely if this exact card has been rendered before
+  key = None
+  if cache is not None:
+    with Profiler.stage("render_cache"):
+      key = template.render_key(card, basic)
+      hit = False
+      if key is not None and reuse:
+        os.makedirs("output", exist_ok=True)
+        hit = cache.fetch(key, template.output_path(card), template.writer)
+    if hit:
+      if template.verbose:
+        print("Using cached render of " + name)
+      return True
+
+  with Profiler.stage("execute"):
+    if basic:
+      rendered = template.executeBasic(card)
+    else:
+      rendered = template.execute(card)
+
+  # Cards are saved in the background, so only cache the render once it is written
+  if key is not None and rendered != False and template.writer.SAVES_TO_OUTPUT:
+    output_path = template.output_path(card)
+    template.writer.when_written(output_path, lambda: cache.store(key, output_path))
+  return rendered != False
+
+# The database and template loaded once by each render worker process
+_worker = {}
+
+def init_render_worker(backend, use_cache=True, profile=False, output=None, warm=False, collect=False):
+  """
+  Runs once in every worker process of render_decklist, loading the local database
+  and the template so that they are reused for every card the worker renders
+
+  PARAMETERS:
+   - backend: Which local database backend to load, see Cards.load_card_database
+   - use_cache: If the worker should reuse and store renders in the render cache
+   - profile: If the worker should profile each card, see Profiler
+   - output: The settings of the Output.Writer to save cards with
+   - warm: Decode every template asset and symbol up front, for long running workers such as
+     the ones of the render server
+   - collect: Send finished cards back to the main process rather than saving them to output,
+     for exports, see Export.CollectWriter
+  """
+  if profile:
+    Profiler.enable()
+  _worker["database"] = Cards.load_card_database(backend, verbose=False)
+  if collect:
+    import Export
+    writer = Export.CollectWriter(**(output or {}))
+  else:
+    writer = Output.Writer(**(output or {}))
+  _worker["template"] = Template.BasicModern(_worker["database"], verbose=False, writer=writer)
+  _worker["cache"] = RenderCache.RenderCache() if use_cache else None
+  if warm:
+    _worker["template"].warm_up()
+    _worker["template"].icons.load()
+
+def render_card_worker(job):
+  """
+  Renders a single card inside a worker process
+
+  PARAMETERS:
+   - job: A tuple of (name, basic), or (name, basic, reuse), see construct_card
+
+  RETURNS:
+   - A tuple of (name, error, cached, profile, files), where error is None if the card was
+     rendered, cached is True if the render came from the render cache, profile holds the
+     Profiler records of the card if profiling, and files holds the (filename, data) of
+     the finished card if the worker collects them
+  """
+  name, basic = job[:2]
+  reuse = job[2] if len(job) > 2 else True
+  if Names.lookup_card(name, _worker["database"], verbose=False) is None:
+    return (name, Names.missing_card_message(name), False, [], [])
+  cache = _worker["cache"]
+  writer = _worker["template"].writer
+  hits = cache.hits if cache is not None else 0
+  try:
+    if construct_card(name, _worker["database"], _worker["template"], basic=basic, cache=cache, reuse=reuse) == False:
+      return (name, "Could not render " + name, False, Profiler.take(), [])
+    # Make sure the card is written before reporting it as done
+    failures = writer.wait()
+    if len(failures) > 0:
+      return (name, "Could not save " + name + ": " + failures[0][1], False, Profiler.take(), [])
+  except Exception:
+    return (name, traceback.format_exc(), False, Profiler.take(), [])
+  files = writer.take() if hasattr(writer, "take") else []
+  return (name, None, cache is not None and cache.hits > hits, Profiler.take(), files)
+
+def render_decklist(deck, jobs, backend=None, basic=False, verbose=True, cache=None, output=None, export=None):
+  """
+  Renders every card of a decklist, spread across a pool of worker processes.
+  Failures are collected and reported once every card is done.
+
+  PARAMETERS:
+   - deck: The decklist dictionary, as loaded by Decklist.load_decklist_from_file
+   - jobs: How many worker processes to render with
+   - backend: Which local database backend the workers should load
+   - basic: If the cards should be formatted for MPC or not
+   - verbose: Print progress as each card finishes
+   - cache: The RenderCache to tally hits and misses in, the workers use the render cache
+     if this is given
+   - output: The settings of the Output.Writer the workers save cards with
+   - export: The Export.ExportWriter to add every card to, rather than the workers saving them to output
+
+  RETURNS:
+   - A list of (name, error) for every card that could not be rendered
+  """
+  failures = []
+  names = list(deck)
+
+  # Spawn fresh workers rather than forking, so they do not inherit this process' pygame state
+  context = multiprocessing.get_context("spawn")
+  initargs = (backend, cache is not None, Profiler.ENABLED, output, False, export is not None)
+  with context.Pool(jobs, initializer=init_render_worker, initargs=initargs) as pool:
+    done = 0
+    for name, error, cached, profile, files in pool.imap_unordered(render_card_worker, [(name, basic) for name in names]):
+      done += 1
+      Profiler.extend(profile)
+      for filename, data in files:
+        export.deliver(filename, data, name)
+      if error is not None:
+        failures.append((name, error))
+      elif cache is not None:
+        if cached:
+          cache.hits += 1
+        else:
+          cache.misses += 1
+      if verbose:
+        print("[" + str(done) + "/" + str(len(names)) + "] " + name + (" (failed)" if error else "") + (" (cached)" if cached else ""))
+
+    # Let the workers exit on their own, pygame catches the SIGTERM that terminating them would send
+    pool.close()
+    pool.join()
+
+  print("Rendered " + str(len(names) - len(failures)) + " of " + str(len(names)) + " cards")
+  if len(failures) > 0:
+    print("\nFailed Cards:")
+    for name, error in failures:
+      print(name + ": " + error.strip())
+  return failures
@@ -0,0 +1,129 @@
+import os, shutil, tempfile, threading
+import os.path as path
+
+RENDER_CACHE_DIR = "data/render-cache"
+RENDER_CACHE_LIMIT = 4 << 30  # Bytes, a full card is a few MB as png
+
+class RenderCache:
+  """
+  A cache of finished card images in data/render-cache, stored under a hash of everything
+  that went into rendering them (see Template.render_key). If a card is rendered again
+  with the same key, the cached image is copied to output instead of rendering it again.
+
+  Keeps count of hits and misses so that a summary can be printed after a run. Once the
+  cache is over RENDER_CACHE_LIMIT, the renders used least recently are removed. The size of
+  the cache is only scanned for on the first store, and then kept up to date as renders are
+  stored, so the cache is only scanned again when it needs pruning
+  """
+  def __init__(self, directory=RENDER_CACHE_DIR):
+    self.directory = directory
+    self.hits = 0
+    self.misses = 0
+    self.size = None
+    self.lock = threading.Lock()
+    if not path.exists(directory):
+      os.makedirs(directory)
+
+  def path(self, key, output_path):
+    """
+    RETURNS:
+     - Where the cached image for that key is stored, with the same extension as output_path
+    """
+    return path.join(self.directory, key + path.splitext(output_path)[1])
+
+  def fetch(self, key, output_path, writer=None):
+    """
+    Copies the cached render for key to output_path, if there is one
+
+    PARAMETERS:
+     - key: The render key of the card
+     - output_path: Where the card should end up, such as output/lightning-bolt.png
+     - writer: The Output.Writer to hand the cached render to, such as an export, rather
+       than copying it straight to output_path
+
+    RETURNS:
+     - True if the cached image was used, False if the card needs to be rendered
+    """
+    cached = self.path(key, output_path)
+    try:
+      # Copy rather than link, otherwise overwriting the output later would change the cache too
+      if writer is not None:
+        writer.copy(cached, output_path)
+      else:
+        shutil.copyfile(cached, output_path)
+      # Mark the render as recently used, so it is the last to be pruned
+      os.utime(cached)
+    except FileNotFoundError:
+      # Not rendered yet, or pruned by another process
+      self.misses += 1
+      return False
+    self.hits += 1
+    return True
+
+  def store(self, key, output_path):
+    """
+    Saves a freshly rendered image to the cache under its key
+
+    PARAMETERS:
+     - key: The render key of the card
+     - output_path: The rendered image
+    """
+    if not path.exists(output_path):
+      return
+    cached = self.path(key, output_path)
+
+    # Write to a temporary file of its own first, so that a cache entry is never half written,
+    # even when several workers store the same card at once
+    handle, temp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+    try:
+      with os.fdopen(handle, 'wb') as f, open(output_path, 'rb') as source:
+        shutil.copyfileobj(source, f)
+      os.replace(temp, cached)
+    except BaseException:
+      if path.exists(temp):
+        os.remove(temp)
+      raise
+
+    # Other processes store renders too, so the size is only an estimate until the next prune
+    with self.lock:
+      if self.size is None:
+        self.size = prune(self.directory)
+      else:
+        self.size += path.getsize(cached)
+        if self.size > RENDER_CACHE_LIMIT:
+          self.size = prune(self.directory)
+
+  def summary(self):
+    """
+    RETURNS:
+     - A one line summary of the cache hits and misses, such as "Render cache: 40 hits, 3 misses"
+    """
+    return "Render cache: " + str(self.hits) + " hits, " + str(self.misses) + " misses"
+
+def prune(directory=RENDER_CACHE_DIR, limit=RENDER_CACHE_LIMIT):
+  """
+  Removes the renders used least recently until the cache fits in limit bytes
+
+  RETURNS:
+   - The size of the cache afterwards, in bytes
+  """
+  entries = []
+  total = 0
+  for entry in os.scandir(directory):
+    if not entry.name.endswith(".tmp"):
+      try:
+        stat = entry.stat()
+      except OSError:
+        # Pruned by another process in the meantime
+        continue
+      entries.append((stat.st_mtime, stat.st_size, entry.path))
+      total += stat.st_size
+  for mtime, size, filepath in sorted(entries):
+    if total <= limit:
+      break
+    try:
+      os.remove(filepath)
+    except OSError:
+      continue
+    total -= size
+  return total
@@ -0,0 +1,287 @@
+"""
+A long running render server, started with python Engine.py -serve
+
+Loads the local database and the template once, and keeps a pool of worker processes that
+each have their own copy of the database and template already loaded, with the template
+assets and symbols decoded. Cards are then rendered on request without any of the start up
+cost of running Engine.py, and cards that are already in the render cache are answered
+straight away without going to a worker at all.
+
+Jobs are sent as JSON over HTTP on localhost, python Engine.py -remote sends the -card, -art
+and -decklist commands here rather than running them itself. The endpoints are:
+  GET  /status      How many cards have been rendered, and the render cache hits and misses
+  POST /render      {"name":"Lightning Bolt", "basic":false}, or a printing such as "Lightning Bolt (2XM) 141"
+  POST /art         {"name":"Lightning Bolt", "autoproxy":false}
+  POST /decklist    {"cards":["Lightning Bolt", ...], "basic":false}
+  POST /shutdown    Stops the server once the jobs it is working on are done
+"""
+
+import json, os, time, threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8767
+SERVER_QUEUE = 4          # How many cards can wait for each worker before new jobs have to wait
+CLIENT_TIMEOUT = 600      # How long the client waits for an answer, in seconds, a whole decklist can take a while
+
+class RenderServer(ThreadingHTTPServer):
+  """
+  The HTTP server, along with everything the request handlers share. Each request is handled
+  on its own thread, the rendering itself happens in the worker pool.
+  """
+  daemon_threads = True
+
+  def __init__(self, port, jobs=1, backend=None, output=None, use_cache=True, warm=True, verbose=True):
+    """
+    PARAMETERS:
+     - port: The port to listen on, on localhost only
+     - jobs: How many worker processes to render with
+     - backend: Which local database backend to load, see Cards.load_card_database
+     - output: The settings of the Output.Writer to save cards with
+     - use_cache: If renders should be reused from and stored in the render cache
+     - warm: If each worker should decode every template asset before taking any jobs
+     - verbose: Print every job as it finishes
+    """
+    import multiprocessing
+    import Cards, Template, Output, RenderCache, Render
+
+    self.verbose = verbose
+    self.started = time.time()
+    self.rendered = 0
+    self.lock = threading.Lock()
+    # A [lock, requests] for every output path being rendered, so one card is only rendered once at a time
+    self.renders = {}
+
+    # The server keeps its own copy of the database and template, to resolve names and check
+    # the render cache without having to ask a worker
+    self.database = Cards.load_card_database(backend, verbose=verbose)
+    if self.database == {}:
+      raise ValueError("Cannot find the local database")
+    self.template = Template.BasicModern(self.database, verbose=False, writer=Output.Writer(workers=0, **(output or {})))
+    self.cache = RenderCache.RenderCache() if use_cache else None
+
+    if verbose:
+      print("Starting " + str(jobs) + " render workers...")
+    context = multiprocessing.get_context("spawn")
+    self.jobs = jobs
+    self.pool = context.Pool(jobs, initializer=Render.init_render_worker, initargs=(backend, use_cache, False, output, warm))
+    self.room = threading.BoundedSemaphore(jobs * SERVER_QUEUE)
+
+    ThreadingHTTPServer.__init__(self, (SERVER_HOST, port), RenderHandler)
+
+  def render(self, name, basic=False):
+    """
+    Renders a single card, from the render cache if it is there or else on a worker
+
+    PARAMETERS:
+     - name: The card name as typed
+     - basic: If the card should be formatted for MPC or not
+
+    RETURNS:
+     - A dictionary describing how it went, see RenderHandler
+    """
+    import Names
+    start = time.perf_counter()
+    card = Names.lookup_card(name, self.database, verbose=False)
+    if card is None:
+      return { "name":name, "ok":False, "unresolved":True, "error":Names.missing_card_message(name) }
+    resolved = card["name"]
+    output_path = self.template.output_path(card)
+
+    # Requests for the same card wait for each other, then the later ones find it in the render cache
+    with self.lock:
+      render = self.renders.setdefault(output_path, [threading.Lock(), 0])
+      render[1] += 1
+    try:
+      with render[0]:
+        cached, error = self.render_once(name, card, basic, output_path)
+    finally:
+      with self.lock:
+        render[1] -= 1
+        if render[1] == 0:
+          del self.renders[output_path]
+
+    with self.lock:
+      self.rendered += 1
+    result = { "name":resolved, "ok":error is None, "cached":cached,
+               "path":os.path.abspath(output_path), "seconds":round(time.perf_counter() - start, 4) }
+    if error is not None:
+      result["error"] = error
+    if self.verbose:
+      print(resolved + (" (cached)" if cached else "") + (" (failed)" if error else "") + " " + str(result["seconds"]) + "s")
+    return result
+
+  def render_once(self, name, card, basic, output_path):
+    """
+    Renders a card from the render cache if it is there or else on a worker, which then only
+    stores it in the cache, so every card is looked for in the cache once
+
+    RETURNS:
+     - A tuple of (cached, error), where error is None if the card was rendered
+    """
+    import Render
+    if self.cache is not None:
+      key = self.template.render_key(card, basic)
+      if key is not None:
+        os.makedirs("output", exist_ok=True)
+        with self.lock:
+          if self.cache.fetch(key, output_path):
+            return True, None
+
+    # Wait for room in the queue, so that a flood of jobs does not pile up in memory
+    with self.room:
+      resolved, error, cached, profile, files = self.pool.apply(Render.render_card_worker, ((name, basic, False),))
+    return False, error
+
+  def art(self, name, autoproxy=False):
+    """
+    Downloads the art of a single card, if it is not downloaded yet
+
+    RETURNS:
+     - A dictionary describing how it went, see RenderHandler
+    """
+    import Cards, Names
+    card = Names.lookup_card(name, self.database, verbose=False)
+    if card is None:
+      return { "name":name, "ok":False, "error":Names.missing_card_message(name) }
+    resolved = card["name"]
+    filepath = Cards.get_card_art_crop(card, autoproxy, verbose=False)
+    if filepath is None:
+      return { "name":resolved, "ok":False, "error":"Could not download the art of " + resolved }
+    return { "name":resolved, "ok":True, "path":os.path.abspath(filepath) }
+
+  def decklist(self, names, basic=False):
+    """
+    Renders every card of a decklist, spread across the workers
+
+    RETURNS:
+     - A dictionary with the result of every card, in the order they were given
+    """
+    import Cards, Names
+    # Download all the art at once before rendering anything, like Engine.py -decklist does
+    found = [Names.lookup_card(name, self.database, verbose=False) for name in names]
+    Cards.prefetch_images([card for card in found if card is not None], self.template.IMAGES, verbose=False)
+
+    # Only as many threads as there is room for in the queue, a collection can have thousands of cards
+    with ThreadPoolExecutor(max_workers=self.jobs * SERVER_QUEUE, thread_name_prefix="Decklist") as pool:
+      results = list(pool.map(lambda name: self.render(name, basic), names))
+    return { "ok":all(result["ok"] for result in results), "cards":results }
+
+  def status(self):
+    """
+    RETURNS:
+     - A dictionary of how long the server has been up and what it has done
+    """
+    return {
+      "ok":True,
+      "uptime":round(time.time() - self.started, 1),
+      "jobs":self.jobs,
+      "cards":len(self.database),
+      "rendered":self.rendered,
+      "cache":self.cache.summary() if self.cache is not None else None,
+    }
+
+  def server_close(self):
+    # Let the workers exit on their own, pygame catches the SIGTERM that terminating them would send
+    self.pool.close()
+    self.pool.join()
+    ThreadingHTTPServer.server_close(self)
+
+class RenderHandler(BaseHTTPRequestHandler):
+  """
+  Handles a single request, every answer is a JSON dictionary with "ok" set to whether it worked
+  """
+  def do_GET(self):
+    if self.path == "/status":
+      self.reply(200, self.server.status())
+    else:
+      self.reply(404, { "ok":False, "error":"Unknown endpoint " + self.path })
+
+  def do_POST(self):
+    try:
+      length = int(self.headers.get("Content-Length", 0))
+      job = json.loads(self.rfile.read(length) or b"{}")
+    except ValueError:
+      self.reply(400, { "ok":False, "error":"Could not read the job, it should be JSON" })
+      return
+
+    try:
+      if self.path == "/render" and "name" in job:
+        result = self.server.render(job["name"], job.get("basic", False))
+      elif self.path == "/art" and "name" in job:
+        result = self.server.art(job["name"], job.get("autoproxy", False))
+      elif self.path == "/decklist" and "cards" in job:
+        result = self.server.decklist(list(job["cards"]), job.get("basic", False))
+      elif self.path == "/shutdown":
+        self.reply(200, { "ok":True })
+        threading.Thread(target=self.server.shutdown).start()
+        return
+      else:
+        self.reply(404, { "ok":False, "error":"Unknown endpoint " + self.path + " or missing fields" })
+        return
+    except Exception as e:
+      self.reply(500, { "ok":False, "error":repr(e) })
+      return
+    self.reply(200, result)
+
+  def reply(self, code, result):
+    body = json.dumps(result).encode('utf-8')
+    self.send_response(code)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    # Jobs are printed by the server when verbose, not every request
+    return
+
+def serve(port=SERVER_PORT, jobs=1, backend=None, output=None, use_cache=True, warm=True, verbose=True):
+  """
+  Starts the render server and handles jobs until it is shut down or interrupted
+
+  PARAMETERS:
+   - See RenderServer
+  """
+  try:
+    server = RenderServer(port, jobs, backend, output, use_cache, warm, verbose)
+  except (ValueError, OSError) as e:
+    print("Could not start the render server: " + str(e))
+    return False
+
+  print("Render server listening on http://" + SERVER_HOST + ":" + str(port) + ", stop it with Ctrl+C")
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    print("Stopping the render server...")
+    server.server_close()
+  return True
+
+def send(endpoint, job=None, port=SERVER_PORT):
+  """
+  Sends a job to a running render server, this is all the client side needs
+
+  PARAMETERS:
+   - endpoint: Such as "/render"
+   - job: The JSON dictionary to post, or None to GET the endpoint
+   - port: The port the server listens on
+
+  RETURNS:
+   - The answer of the server as a dictionary, with "ok" set to False if the server could not be reached
+  """
+  import urllib.request, urllib.error
+  url = "http://" + SERVER_HOST + ":" + str(port) + endpoint
+  data = None
+  if job is not None:
+    data = json.dumps(job).encode('utf-8')
+  request = urllib.request.Request(url, data=data, headers={ "Content-Type":"application/json" })
+  try:
+    with urllib.request.urlopen(request, timeout=CLIENT_TIMEOUT) as r:
+      return json.loads(r.read())
+  except urllib.error.HTTPError as e:
+    return json.loads(e.read())
+  except (urllib.error.URLError, OSError) as e:
+    return { "ok":False, "error":"Cannot reach the render server on port " + str(port) + ", start it with python Engine.py -serve (" + str(e) + ")" }
@@ -1,5 +1,5 @@
-import os, pygame
-import Cards, Icons
+import os, re, json, hashlib, functools, collections, pygame
+import Cards, Icons, Profiler, Output, ArtCache
 
 # Some constants regarding card dimensions
 BLEED_WIDTH = 1632
@@ -14,24 +14,415 @@ SAFE_HEIGHT = 1932
 CUT_START = 72
 SAFE_START = 144
 
-# A few dictionaries of fonts, with keys as sizes and values as the font object
-pygame.init()
-FONTS_BOLD = {
-  150:pygame.font.Font('template-data/fonts/JaceBeleren-Bold.ttf', 150),
-  140:pygame.font.Font('template-data/fonts/JaceBeleren-Bold.ttf', 140),
-  120:pygame.font.Font('template-data/fonts/JaceBeleren-Bold.ttf', 120)
+# The font files for each face, fonts are opened at whatever size they are first needed in
+FONT_FILES = {
+  "bold":'template-data/fonts/JaceBeleren-Bold.ttf',
+  "basic":'template-data/fonts/MPlantin.ttf',
+  "ital":'template-data/fonts/MPlantin-Italic.ttf'
 }
-FONTS_BASIC = {   # Stores a tuple of the font and how many chars can fit on a line in the text box
-  140:(pygame.font.Font('template-data/fonts/MPlantin.ttf', 140),38),
-  130:(pygame.font.Font('template-data/fonts/MPlantin.ttf', 130),40),
-  120:(pygame.font.Font('template-data/fonts/MPlantin.ttf', 120),44),
-  110:(pygame.font.Font('template-data/fonts/MPlantin.ttf', 110),46)
-}
-FONTS_ITAL = {
-  120:pygame.font.Font('template-data/fonts/MPlantin-Italic.ttf', 120)
+FONT_CACHE = {}
+
+# Rules text is drawn at the largest of these sizes that fits in its box
+TEXT_MAX_SIZE = 130
+TEXT_MIN_SIZE = 80
+TEXT_SIZE_STEP = 5
+PARAGRAPH_SPACING = 0.3   # Extra space after each paragraph of rules text, as a fraction of the font size
+
+# Symbols such as {T} or {R} in rules text, which get drawn as icons if there is one for them
+SYMBOL_PATTERN = re.compile(r"(\{[^{}]+\})")
+SYMBOL_SPACING = 4        # Pixels of space on either side of an inline symbol
+
+# How many text layouts to remember, and how much memory rendered pieces of text can take up.
+# A layout is only a few lines of text, while a rendered line of rules text can take over a MB
+LAYOUT_CACHE_SIZE = 4096
+TEXT_CACHE_LIMIT = 64 << 20
+
+class SurfaceCache:
+  """
+  Remembers surfaces by key, forgetting the least recently used ones once they take up more
+  than a limit of bytes. Surfaces vary too much in size for a count of them to bound memory
+  """
+  def __init__(self, limit):
+    """
+    PARAMETERS:
+     - limit: The most bytes of pixels to keep, the last surface stored is always kept
+    """
+    self.limit = limit
+    self.size = 0
+    self.surfaces = collections.OrderedDict()
+
+  def get(self, key):
+    """
+    RETURNS:
+     - The surface stored under key, or None if it is not remembered
+    """
+    surface = self.surfaces.get(key)
+    if surface is not None:
+      self.surfaces.move_to_end(key)
+    return surface
+
+  def put(self, key, surface):
+    """
+    Stores a surface under key, then forgets the oldest surfaces until there is room for it
+    """
+    if key in self.surfaces:
+      self.size -= surface_bytes(self.surfaces.pop(key))
+    self.surfaces[key] = surface
+    self.size += surface_bytes(surface)
+    while self.size > self.limit and len(self.surfaces) > 1:
+      key, oldest = self.surfaces.popitem(last=False)
+      self.size -= surface_bytes(oldest)
+
+  def __len__(self):
+    return len(self.surfaces)
+
+def surface_bytes(surface):
+  """
+  RETURNS:
+   - How many bytes the pixels of a surface take up
+  """
+  return surface.get_pitch() * surface.get_height()
+
+# Every template asset that has been loaded in this process, by filepath
+ASSET_CACHE = {}
+
+def load_asset(filepath):
+  """
+  Loads a template image, such as a background or a text box. Each image is only decoded
+  once per process and then shared between every card and every template.
+
+  The image is converted to the same pixel layout as the canvases it gets drawn to, see
+  Cards.convert_for_blit.
+
+  PARAMETERS:
+   - filepath: The path to the image, such as "template-data/basic/border-extend.png"
+
+  RETURNS:
+   - The image as a pygame Surface. It is shared, so do not draw onto it
+  """
+  if filepath in ASSET_CACHE:
+    return ASSET_CACHE[filepath]
+
+  with Profiler.stage("load_asset"):
+    image = pygame.image.load(filepath)
+    Profiler.read_file(filepath)
+    image = Cards.convert_for_blit(image)
+  ASSET_CACHE[filepath] = image
+  return image
+
+# Frames composited out of template layers, by their size and layers, see composite_frame
+FRAME_CACHE_LIMIT = 256 << 20 # Bytes of frames kept in memory, a full frame takes around 48 MB
+FRAME_CACHE = SurfaceCache(FRAME_CACHE_LIMIT)
+FRAME_CACHE_DIR = "data/frame-cache"
+FRAME_CACHE_TO_DISK = True    # Keep frames in FRAME_CACHE_DIR too, so later runs map them rather than compositing again
+
+def composite_frame(size, layers):
+  """
+  Composites template layers, such as the background, text box and title box, into a single
+  frame so that each card draws one frame over its art rather than every layer. There are
+  only so many combinations of layers, so each frame is composited once and then reused.
+
+  The layers are composited with premultiplied alpha, which stacks transparent layers
+  correctly, so the frame has to be drawn with special_flags=pygame.BLEND_PREMULTIPLIED
+
+  PARAMETERS:
+   - size: The (width, height) of the frame, which is the size of the canvas it gets drawn to
+   - layers: A list of (filepath, (x, y)) of every template layer, bottom first
+
+  RETURNS:
+   - The frame as a pygame Surface with premultiplied alpha. It is shared, so do not draw onto it
+  """
+  key = (tuple(size), tuple((filepath, tuple(position)) for filepath, position in layers))
+  frame = FRAME_CACHE.get(key)
+  if frame is not None:
+    return frame
+
+  with Profiler.stage("composite_frame"):
+    frame = None
+    entry = None
+    if FRAME_CACHE_TO_DISK:
+      # Named by the layers and their files, so that changing a layer never picks up a stale frame
+      signature = [key[0]] + [[filepath, position, os.path.getsize(filepath), os.stat(filepath).st_mtime_ns]
+                              for filepath, position in key[1]]
+      entry = os.path.join(FRAME_CACHE_DIR, hashlib.sha1(json.dumps(signature).encode('utf-8')).hexdigest() + ".raw")
+      if os.path.exists(entry):
+        frame = ArtCache.load_entry(entry)
+
+    if frame is None:
+      frame = pygame.Surface(size, pygame.SRCALPHA, 32)
+      for filepath, position in key[1]:
+        frame.blit(load_asset(filepath).premul_alpha(), position, special_flags=pygame.BLEND_PREMULTIPLIED)
+      if entry is not None:
+        try:
+          # Stored in the byte order of the canvas, mapped RGBA frames blit over ten times slower
+          ArtCache.store_entry(entry, frame, FRAME_CACHE_DIR, format="BGRA")
+          Profiler.wrote_file(entry)
+          # Use the mapped copy, which the operating system can share and page out
+          frame = ArtCache.load_entry(entry) or frame
+        except OSError as e:
+          print("Could not save the frame to " + entry + ": " + str(e))
+
+  FRAME_CACHE.put(key, frame)
+  return frame
+
+def get_font(face, size):
+  """
+  Gets a font object, opening it the first time that face and size is asked for
+
+  PARAMETERS:
+   - face: One of "bold", "basic" or "ital", see FONT_FILES
+   - size: The font size
+
+  RETURNS:
+   - The pygame Font
+  """
+  if (face, size) not in FONT_CACHE:
+    # Only the font module needs to be initialized to render, not the display or audio
+    if not pygame.font.get_init():
+      pygame.font.init()
+    FONT_CACHE[(face, size)] = pygame.font.Font(FONT_FILES[face], size)
+  return FONT_CACHE[(face, size)]
+
+# Rendered pieces of text, by everything passed to render_text
+TEXT_CACHE = SurfaceCache(TEXT_CACHE_LIMIT)
+
+def render_text(text, face, size, color=(0,0,0), antialias=True):
+  """
+  Renders a piece of text to a surface. Text like type lines and reminder text repeats across
+  a lot of cards, so the most recently rendered pieces are kept and reused, up to TEXT_CACHE_LIMIT bytes.
+
+  PARAMETERS:
+   - text: The text to render
+   - face: One of "bold", "basic" or "ital"
+   - size: The font size
+   - color: Colour of the text, defaults to black
+   - antialias: If the text should be antialiased
+
+  RETURNS:
+   - The rendered text as a pygame Surface. It is shared, so do not draw onto it
+  """
+  key = (text, face, size, tuple(color), antialias)
+  surface = TEXT_CACHE.get(key)
+  if surface is None:
+    surface = get_font(face, size).render(text, antialias, color)
+    TEXT_CACHE.put(key, surface)
+  return surface
+
+def split_symbols(text, icons=None):
+  """
+  Splits text into runs of plain text and symbols that have an icon
+
+  PARAMETERS:
+   - text: The text to split, such as "{T}: Add {R}."
+   - icons: The Icons to check symbols against, if None the text is never split
+
+  RETURNS:
+   - A list of (is_symbol, run), such as [(True, "{T}"), (False, ": Add "), (True, "{R}"), (False, ".")]
+  """
+  if icons is None:
+    return [(False, text)]
+  runs = []
+  for run in SYMBOL_PATTERN.split(text):
+    if run == "":
+      continue
+    is_symbol = SYMBOL_PATTERN.fullmatch(run) is not None and icons.has_symbol(run)
+    runs.append((is_symbol, run))
+  return runs
+
+def text_width(text, face, size, icons=None):
+  """
+  RETURNS:
+   - The width in pixels of the text, with any symbols drawn as icons
+  """
+  width = 0
+  font = get_font(face, size)
+  for is_symbol, run in split_symbols(text, icons):
+    if is_symbol:
+      width += icons.get_text_width(run, size) + 2 * SYMBOL_SPACING
+    else:
+      width += font.size(run)[0]
+  return width
+
+def wrap_text(text, face, size, width, icons=None):
+  """
+  Splits text into lines that fit in the given width, measuring the actual width of the text
+  in that font. Lines are only broken at spaces or newlines.
+
+  PARAMETERS:
+   - text: The text to wrap
+   - face: One of "bold", "basic" or "ital"
+   - size: The font size
+   - width: The width of the box in pixels
+   - icons: The Icons to draw symbols with, if None they are measured as plain text
+
+  RETURNS:
+   - A list of paragraphs, each a list of its lines
+  """
+  paragraphs = []
+  for paragraph in text.split("\n"):
+    lines = []
+    line = ""
+    for word in paragraph.split(" "):
+      candidate = word if line == "" else line + " " + word
+      if line != "" and text_width(candidate, face, size, icons) > width:
+        lines.append(line)
+        line = word
+      else:
+        line = candidate
+    lines.append(line)
+    paragraphs.append(lines)
+  return paragraphs
+
+@functools.lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def layout_text(text, face, width, height, max_size=TEXT_MAX_SIZE, min_size=TEXT_MIN_SIZE, icons=None):
+  """
+  Works out how to fit a block of text in a box: picks the largest font size that fits the
+  whole text in the box, then wraps it at that size. Layouts are remembered, so common texts
+  are only ever laid out once.
+
+  PARAMETERS:
+   - text: The text to lay out, with newlines separating paragraphs
+   - face: One of "bold", "basic" or "ital"
+   - width, height: The size of the box in pixels
+   - max_size, min_size: The range of font sizes to pick from
+   - icons: The Icons that symbols in the text will be drawn with
+
+  RETURNS:
+   - A tuple of (size, lines), where lines is a tuple of (line, y) and y is the offset of the
+     line from the top of the box. If nothing fits, the text is laid out at min_size
+  """
+  size = max_size
+  while True:
+    font = get_font(face, size)
+    line_height = font.size("Tg")[1]
+    spacing = int(size * PARAGRAPH_SPACING)
+
+    lines = []
+    y = 0
+    for paragraph in wrap_text(text, face, size, width, icons):
+      for line in paragraph:
+        lines.append((line, y))
+        y += line_height
+      y += spacing
+
+    # Don't count the spacing after the last paragraph
+    if y - spacing <= height or size - TEXT_SIZE_STEP < min_size:
+      return (size, tuple(lines))
+    size -= TEXT_SIZE_STEP
+
+def load_source(source, icons=None):
+  """
+  Loads what a draw op draws, see RenderPlan
+
+  PARAMETERS:
+   - source: The source of the op, such as ("text", "Lightning Bolt", "bold", 140, (0,0,0), True)
+   - icons: The Icons to draw symbols with
+
+  RETURNS:
+   - The pygame Surface to draw, or None if there is nothing to draw. It is shared, so do not draw onto it
+  """
+  kind = source[0]
+  if kind == "text":
+    return render_text(*source[1:])
+  if kind == "art":
+    return ArtCache.load_scaled_art(source[1], source[2])
+  if kind == "frame":
+    return composite_frame(source[1], source[2])
+  if kind == "symbol":
+    return icons.get_text(source[1], source[2])
+  if kind == "mana":
+    return icons.get_title(source[1])
+  if kind == "asset":
+    return load_asset(source[1])
+  raise ValueError("Unknown draw op " + repr(source))
+
+# The profiler stage each kind of draw op is counted towards
+DRAW_STAGES = {
+  "fill":"blit", "art":"blit", "frame":"blit", "asset":"blit",
+  "text":"add_text", "symbol":"add_text",
+  "mana":"add_mana_cost"
 }
 
-def write(surface, text, x, y, size, bold=False, ital=False, symbol=False):
+def draw_ops(surface, ops, icons=None):
+  """
+  Draws a list of draw ops to a surface, in order, see RenderPlan
+
+  PARAMETERS:
+   - surface: The surface to draw on
+   - ops: A list of (source, position, anchor)
+   - icons: The Icons to draw symbols with
+  """
+  for source, position, anchor in ops:
+    kind = source[0]
+    with Profiler.stage(DRAW_STAGES.get(kind, "blit")):
+      if kind == "fill":
+        surface.fill(source[1])
+        continue
+      image = load_source(source, icons)
+      if image is None:
+        continue
+      rect = image.get_rect(**{ anchor:position })
+      # Frames are composited with premultiplied alpha, see composite_frame
+      surface.blit(image, rect, special_flags=pygame.BLEND_PREMULTIPLIED if kind == "frame" else 0)
+
+def line_ops(line, x, y, face, size, color=(0,0,0), antialias=True, icons=None):
+  """
+  Lays out a single line of text, with symbols such as {T} drawn inline as icons
+
+  PARAMETERS:
+   - line: The line of text
+   - x,y: The top left of the line
+   - face, size, color, antialias: How to render the text, see render_text
+   - icons: The Icons to draw symbols with, if None symbols are drawn as plain text
+
+  RETURNS:
+   - The draw ops of the line, see RenderPlan
+  """
+  ops = []
+  font = get_font(face, size)
+  line_height = font.size("Tg")[1]
+  for is_symbol, run in split_symbols(line, icons):
+    if is_symbol:
+      symbol = icons.get_text(run, size)
+      ops.append((("symbol", run, size), (x + SYMBOL_SPACING, y + (line_height - symbol.get_height()) // 2), "topleft"))
+      x += symbol.get_width() + 2 * SYMBOL_SPACING
+    else:
+      ops.append((("text", run, face, size, tuple(color), antialias), (x, y), "topleft"))
+      x += font.size(run)[0]
+  return ops
+
+def wrapped_ops(text, rect, size=TEXT_MAX_SIZE, color=(0,0,0), icons=None):
+  """
+  Lays out wrapped text in a block, at the largest size (up to size) that fits in the rectangle
+
+  PARAMETERS:
+   - See write_wrapped
+
+  RETURNS:
+   - The draw ops of the text, see RenderPlan
+  """
+  rect = pygame.Rect(rect)
+  size, lines = layout_text(text, "basic", rect.width, rect.height, size, icons=icons)
+  ops = []
+  for line, y in lines:
+    if line:
+      ops += line_ops(line, rect.left, rect.top + y, "basic", size, color, False, icons)
+  return ops
+
+def write_line(surface, line, x, y, face, size, color=(0,0,0), antialias=True, icons=None):
+  """
+  Draws a single line of text, with symbols such as {T} drawn inline as icons
+
+  PARAMETERS:
+   - surface: The surface to draw on
+   - line: The line of text
+   - x,y: The top left of the line
+   - face, size, color, antialias: How to render the text, see render_text
+   - icons: The Icons to draw symbols with, if None symbols are drawn as plain text
+  """
+  draw_ops(surface, line_ops(line, x, y, face, size, color, antialias, icons), icons)
+
+def write(surface, text, x, y, size, bold=False, ital=False):
   """
   A basic helper function to write to the surface
 
@@ -39,79 +430,148 @@ def write(surface, text, x, y, size, bold=False, ital=False, symbol=False):
    - surface: The pygame Surface object we want to write to
    - text: The text to write
    - x,y: The starting x,y coordinates of the text
-   - size: The font size in { 72, 100, 150 }
+   - size: The font size
    - bold: If the text is to be bolded
    - ital: If the text is to be italicized. Cannot be both bolded and italicized
   """
+  surface.blit(render_text(text, text_face(bold, ital), size), (x,y))
+
+def text_face(bold=False, ital=False):
+  """
+  RETURNS:
+   - The face to write text in, see write
+  """
   if bold:
-    font = FONTS_BOLD[size]
+    return "bold"
   elif ital:
-    font = FONTS_ITAL[size]
-  elif symbol:
-    font = FONTS_ICONS[size]
-  else:
-    font = FONTS_BASIC[size]
-  label = font.render(text, 1, (0,0,0))
-  surface.blit(label, (x,y))
+    return "ital"
+  return "basic"
 
-def write_wrapped(surface, text, rect, size, color=(0,0,0)):
+def write_wrapped(surface, text, rect, size=TEXT_MAX_SIZE, color=(0,0,0), icons=None):
   """
   A basic function to write wrapped text in a block as Pygame doesnt come with this functionality
+  The text is drawn at the largest size (up to size) that fits in the rectangle.
 
   PARAMETERS: 
    - surface: The card to draw on
    - text: The text to write
-   - rect: The rectangle the text will be written in
-   - size: The font size to use
+   - rect: The rectangle the text will be written in, as (x, y, width, height)
+   - size: The largest font size to use
    - color: Colour of the text, defaults to black
+   - icons: The Icons to draw symbols such as {T} with. If None, they are written out as text
   """
+  draw_ops(surface, wrapped_ops(text, rect, size, color, icons), icons)
 
-  rect = pygame.Rect(rect)
-  y = rect.top
-  lineSpacing = 40 # The space between lines after \n
-
-  # This is a poor way to do it but it works for now
-  newlines = 10 * text.count("\n")   # Count newlines as 10 characters since they take up a lot of space
-  if (len(text) + newlines > 300):
-    size = 110
-    y -= 60
-    lineSpacing -= 20
-  elif (len(text) + newlines > 230):
-    size = 120
-    y -= 50
-    lineSpacing -= 15
-  else:
-    size = 130
-
-  font, max_chars = FONTS_BASIC[size]
-  
-  # get the height of the font
-  fontHeight = font.size("Tg")[1]
-
-  # Get a temporary list of all lines, split at newline characters
-  lines = text.split("\n")
-
-  # Then iterate over each line
-  for line in lines:
-    while line:
-      # If the length of this line is greater than the max chars allowed, wrap to the last word
-      if len(line) > max_chars:
-        i = line.rfind(" ", 0, max_chars) + 1
-      else:
-        i = len(line)
-      
-      # Render and draw the text
-      l = font.render(line[:i], False, color)
-      surface.blit(l, (rect.left, y))
-
-      # Chop off the stuff we just drew
-      line = line[i:]
-
-      # If this line is now empty, increase y a little more to account for the newline, otherwise increase y normally
-      if line:
-        y += fontHeight
-      else:
-        y += fontHeight + lineSpacing
+class RenderPlan:
+  """
+  A card compiled into the list of draw operations that render it, without drawing anything.
+  Templates build a plan for a card, and then draw it to a canvas in one pass.
+
+  Every op is a tuple of (source, position, anchor), made only of strings, numbers and tuples
+  so that plans can be compared, hashed, pickled and inspected without drawing them:
+   - source: What to draw, a tuple starting with its kind, see load_source
+       ("fill", colour)                                  fills the whole canvas
+       ("art", filepath, (width, height))                art scaled to cover the size, see ArtCache.load_scaled_art
+       ("frame", size, layers)                           template layers composited together, see composite_frame
+       ("asset", filepath)                               a template image, see load_asset
+       ("text", text, face, size, colour, antialias)     a piece of text, see render_text
+       ("symbol", symbol, size)                          a symbol in rules text, see Icons.get_text
+       ("mana", symbol)                                  a symbol of the mana cost, see Icons.get_title
+   - position: Where the anchor of the source goes on the canvas, as (x, y)
+   - anchor: Which point of the source is placed at position, such as "topleft" or "center"
+  """
+  # Ops that draw over everything under them, see dedupe
+  BACKDROPS = ("fill", "art", "frame", "asset")
+
+  def __init__(self, size):
+    """
+    PARAMETERS:
+     - size: The (width, height) of the canvas the plan draws to
+    """
+    self.size = tuple(size)
+    self.ops = []
+
+  def add(self, source, position=(0,0), anchor="topleft"):
+    """
+    Adds a draw op to the end of the plan, so it is drawn over every op before it
+    """
+    self.ops.append((tuple(source), tuple(position), anchor))
+
+  def extend(self, ops):
+    """
+    Adds a list of draw ops, such as from line_ops, to the end of the plan
+    """
+    for op in ops:
+      self.add(*op)
+
+  def dedupe(self):
+    """
+    Removes ops that draw exactly the same thing in the same place as an earlier op, with only
+    text and symbols drawn in between. Drawing them twice only darkens their antialiased edges.
+
+    RETURNS:
+     - How many ops were removed
+    """
+    ops = []
+    seen = set()
+    for op in self.ops:
+      if op[0][0] in self.BACKDROPS:
+        # Anything drawn before a backdrop may be covered by it, so drawing it again is not a duplicate
+        seen = set()
+      elif op in seen:
+        continue
+      seen.add(op)
+      ops.append(op)
+    removed = len(self.ops) - len(ops)
+    self.ops = ops
+    return removed
+
+  def sources(self):
+    """
+    RETURNS:
+     - Every distinct source the plan draws, such as its frame and art, to group cards that share them
+    """
+    return set(op[0] for op in self.ops)
+
+  def key(self):
+    """
+    RETURNS:
+     - A hash of the whole plan as a hex string, plans with the same key draw the same canvas
+       as long as the files they draw from are unchanged
+    """
+    return hashlib.sha1(json.dumps([self.size, self.ops]).encode('utf-8')).hexdigest()
+
+  def draw(self, icons=None):
+    """
+    Draws the plan to a new canvas
+
+    PARAMETERS:
+     - icons: The Icons to draw symbols with
+
+    RETURNS:
+     - The canvas as a pygame Surface
+    """
+    canvas = pygame.Surface(self.size)
+    draw_ops(canvas, self.ops, icons)
+    return canvas
+
+  def __len__(self):
+    return len(self.ops)
+
+  def __iter__(self):
+    return iter(self.ops)
+
+  def __eq__(self, other):
+    return isinstance(other, RenderPlan) and self.size == other.size and self.ops == other.ops
+
+  def __hash__(self):
+    return hash((self.size, tuple(self.ops)))
+
+  def __repr__(self):
+    lines = ["RenderPlan " + str(self.size[0]) + "x" + str(self.size[1]) + ", " + str(len(self.ops)) + " ops"]
+    for source, position, anchor in self.ops:
+      lines.append("  " + anchor + " " + str(position) + " " + repr(source))
+    return "\n".join(lines)
 
 class Template:
   """
@@ -119,10 +579,27 @@ class Template:
 
   Most importantly has an execute(card) function, that will take a card:dictionary as input
   and save the processed card to the output folder
+
+  IMAGES lists the scryfall images ("art_crop", "png") the template needs for each card,
+  so that they can be downloaded ahead of time with Cards.prefetch_images
+
+  CARD_FIELDS lists the card fields the template reads and VERSION should be increased whenever
+  the template changes how it draws, these both go into the render key of a card
   """
-  def __init__(self, all_cards):
-    pygame.init()
+  IMAGES = ()
+  CARD_FIELDS = ("name",)
+  VERSION = 1
+
+  def __init__(self, all_cards, verbose=True, writer=None):
+    """
+    PARAMETERS:
+     - all_cards: The local database of all cards
+     - verbose: If you would like to see all messages printed to the terminal
+     - writer: The Output.Writer that saves finished cards, defaults to png in the background
+    """
     self.all_cards = all_cards
+    self.verbose = verbose
+    self.writer = writer if writer is not None else Output.Writer()
 
   def execute(self, card):
     """
@@ -134,8 +611,7 @@ class Template:
     """
 
     # Make sure the output file exists
-    if not os.path.exists("output"):
-      os.mkdir("output")
+    os.makedirs("output", exist_ok=True)
 
     # Then make sure the card name is actually a card in the dictionary
     if "name" not in card:
@@ -146,8 +622,91 @@ class Template:
       print("Error: " + card["name"] + " not in all_cards")
       return False
 
-    print("Processing " + card["name"])
+    if self.verbose:
+      print("Processing " + card["name"])
     # Then be overridden by a subclass
+
+  def output_path(self, card):
+    """
+    RETURNS:
+     - Where the finished card gets saved, such as output/lightning-bolt.png, with the
+       extension of the output format. Specific printings also have their set and number
+    """
+    return "output/" + Cards.card_filename(card) + self.writer.extension
+
+  def image_path(self, card):
+    """
+    Gets the scryfall image the template draws the card from, downloading it if needed
+
+    RETURNS:
+     - The filepath to the image, or None if the template does not use one or it cannot be found
+    """
+    return None
+
+  def plan_card(self, card, basic=False):
+    """
+    Compiles the card into a RenderPlan of the draw ops that render it, without drawing anything
+
+    RETURNS:
+     - The RenderPlan, or None if the template does not draw with plans or the card cannot be planned
+    """
+    return None
+
+  def render_key(self, card, basic=False):
+    """
+    Hashes everything that decides what the finished card looks like: the card fields the
+    template reads, the image file it draws from, the template and its version, whether
+    it is being formatted for MPC or not, and the format and settings it is saved with
+
+    PARAMETERS:
+     - card: The card to be rendered
+     - basic: If the card will be rendered with executeBasic rather than execute
+
+    RETURNS:
+     - The key as a hex string, or None if the card cannot be cached (such as missing art)
+    """
+    image = None
+    if len(self.IMAGES) > 0:
+      image_path = self.image_path(card)
+      if image_path is None or not os.path.exists(image_path):
+        return None
+      stat = os.stat(image_path)
+      image = [image_path, stat.st_size, stat.st_mtime_ns]
+
+    key = {
+      "template":type(self).__name__,
+      "version":self.VERSION,
+      "mode":"executeBasic" if basic else "execute",
+      "card":{ field:card.get(field) for field in self.CARD_FIELDS },
+      "image":image,
+      "output":self.writer.settings()
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+  def save(self, canvas, card):
+    """
+    Hands the finished card to the writer to be saved to output, see output_path. It is saved
+    in the background, so do not draw on the canvas afterwards.
+    """
+    with Profiler.stage("save"):
+      self.writer.save(canvas, self.output_path(card), card["name"])
+
+  def asset_paths(self):
+    """
+    RETURNS:
+     - A list of the filepaths of every asset this template can load with load_asset
+    """
+    return []
+
+  def warm_up(self):
+    """
+    Loads every asset the template can use into the asset cache ahead of time, so that no
+    card has to wait on decoding them. Full size frames take around 40 MB each once loaded,
+    so this is meant for long running processes that render many different cards.
+    """
+    for filepath in self.asset_paths():
+      if os.path.exists(filepath):
+        load_asset(filepath)
   
 class BlackBorderExtension(Template):
   """
@@ -156,6 +715,13 @@ class BlackBorderExtension(Template):
 
   It isn't very good, this was just a test
   """
+  IMAGES = ("png",)
+
+  def image_path(self, card):
+    return Cards.get_full_card_image(card)
+
+  def asset_paths(self):
+    return ["template-data/black-border-extension.png"]
 
   def execute(self, card):
     """
@@ -176,7 +742,7 @@ class BlackBorderExtension(Template):
 
     output = pygame.Surface((BLEED_WIDTH, BLEED_HEIGHT))
     card_image = pygame.image.load(path)
-    border = pygame.image.load("template-data/black-border-extension.png")
+    border = load_asset("template-data/black-border-extension.png")
 
     # First scale the card image by 2, to (1490, 2080)
     card_image = pygame.transform.scale(card_image, (1490, 2080))
@@ -186,7 +752,7 @@ class BlackBorderExtension(Template):
     output.blit(border, (0,0))
 
     # Then save the image
-    pygame.image.save(output, "output/" + Cards.parse_card_name(card["name"]) + ".png")
+    self.save(output, card)
 
     return True
 
@@ -195,6 +761,10 @@ class WhiteLined(Template):
   A simple template, a white back with extended art and some coloured lines
   Unfinished, a future project
   """
+  IMAGES = ("art_crop",)
+
+  def image_path(self, card):
+    return Cards.get_card_art_crop(card, verbose=False)
 
   def execute(self, card):
     super().execute(card)
@@ -211,7 +781,7 @@ class WhiteLined(Template):
     # pt_box = (0,0,0,0)
 
     # Load the art
-    card_art_path = Cards.get_card_art_crop(card)
+    card_art_path = Cards.get_card_art_crop(card, verbose=self.verbose)
     if card_art_path == None:
       return False
     card_art = pygame.image.load(card_art_path)
@@ -231,7 +801,7 @@ class WhiteLined(Template):
     pygame.draw.lines(canvas, color, False, [(0,1184), (BLEED_WIDTH, 1184)], linesize)
 
     # Then save the image
-    pygame.image.save(canvas, "output/" + Cards.parse_card_name(card["name"]) + ".png")
+    self.save(canvas, card)
 
     return True
 
@@ -249,10 +819,25 @@ class BasicModern(Template):
 
   Loaded template should be placed at (150,150)
   """
-  def __init__(self, all_cards):
-    Template.__init__(self, all_cards)
+  IMAGES = ("art_crop",)
+  CARD_FIELDS = ("name", "type_line", "colors", "mana_cost", "oracle_text", "power", "toughness", "produced_mana")
+  VERSION = 5
+
+  def __init__(self, all_cards, verbose=True, writer=None):
+    Template.__init__(self, all_cards, verbose, writer)
     self.icons = Icons.Icons()
 
+  def image_path(self, card):
+    return Cards.get_card_art_crop(card, verbose=False)
+
+  def asset_paths(self):
+    paths = []
+    for root, dirs, files in os.walk("template-data/basic"):
+      for filename in files:
+        if filename.endswith(".png"):
+          paths.append(os.path.join(root, filename).replace(os.sep, "/"))
+    return paths
+
   def execute(self, card):
     """
     Creates a full MPC ready proxy utilizing the template files and local database
@@ -260,14 +845,7 @@ class BasicModern(Template):
     Use executeBasic(card) for generating a proxy formatted as a regular card
     """
     super().execute(card)
-    canvas = self.format_card(card)
-
-    # Add the MPC extended border and save the image
-    border = pygame.image.load("template-data/basic/border-extend.png")
-    canvas.blit(border, (0,0))
-    self.add_text(canvas, card)
-    pygame.image.save(canvas, "output/" + Cards.parse_card_name(card["name"]) + ".png")
-    return True
+    return self.render(card)
 
   def executeBasic(self, card):
     """
@@ -276,19 +854,53 @@ class BasicModern(Template):
     Use execute(card) instead for generating a proxy formatted for printing with MPC
     """
     super().execute(card)
-    pygame.image.save(self.format_card(card, base=0), "output/" + Cards.parse_card_name(card["name"]) + ".png")
+    return self.render(card, basic=True)
 
-  def format_card(self, card, base=150):
+  def render(self, card, basic=False):
     """
-    Format the entire card, does not add text. Just the template and the card art and returns it
+    Plans the card, draws the plan in one pass and saves it
+
+    RETURNS:
+     - A bool if the card could be rendered or not
+    """
+    with Profiler.stage("plan_card"):
+      plan = self.plan_card(card, basic)
+    if plan is None:
+      return False
+    with Profiler.stage("format_card"):
+      canvas = plan.draw(self.icons)
+    self.save(canvas, card)
+    return True
+
+  def format_card(self, card, basic=False):
+    """
+    Format the entire card, the template, the card art and the text, and returns it
 
     PARAMETERS:
      - card: The card to be formatted and returned
-     - base: Where the card should be placed on the returned canvas. Do either 150 (for MPC) or 0 (for regular)
+     - basic: Format it as a regular card, rather than centered with the extended border for MPC
 
     RETURNS
-     - A pygame Surface of the card, centered if set for MPC
+     - A pygame Surface of the card, or False if it cannot be formatted
+    """
+    plan = self.plan_card(card, basic)
+    if plan is None:
+      return False
+    return plan.draw(self.icons)
+
+  def plan_card(self, card, basic=False):
     """
+    Compiles the card into the draw ops that render it, without drawing anything
+
+    PARAMETERS:
+     - card: The card to be planned
+     - basic: Plan it as a regular card, rather than centered with the extended border for MPC
+
+    RETURNS
+     - The RenderPlan of the card, or None if its art cannot be found
+    """
+    # Where the card should be placed on the canvas, 150 for MPC or 0 for regular
+    base = 0 if basic else 150
     card_type = card["type_line"]
     colours = card["colors"]
 
@@ -311,8 +923,8 @@ class BasicModern(Template):
     
     # First get the main background, either land or nonland
     if land == True:
-      background = pygame.image.load("template-data/basic/background/land.png")
-      title_box = pygame.image.load("template-data/basic/title-boxes/land.png")
+      background = "template-data/basic/background/land.png"
+      title_box = "template-data/basic/title-boxes/land.png"
 
       # Determine land text colours by the mana they produce, or if they are an artifact
       if "Artifact" in card_type:
@@ -323,7 +935,7 @@ class BasicModern(Template):
       # Default to land
       else:
         text_t = "land"
-      text_box = pygame.image.load("template-data/basic/land-textboxes/" + text_t + ".png")
+      text_box = "template-data/basic/land-textboxes/" + text_t + ".png"
 
     else:
       # Determine the background, text-boxes, and title-boxes from the colours and types
@@ -337,71 +949,63 @@ class BasicModern(Template):
         else:
           back_t = self.get_file_name_colour(colours, 2)
       text_t = self.get_file_name_colour(colours, 3)
-      background = pygame.image.load("template-data/basic/background/" + back_t + ".png")
-      title_box = pygame.image.load("template-data/basic/title-boxes/" + title_t + ".png")
-      text_box = pygame.image.load("template-data/basic/nonland-textboxes/" + text_t + ".png")
+      background = "template-data/basic/background/" + back_t + ".png"
+      title_box = "template-data/basic/title-boxes/" + title_t + ".png"
+      text_box = "template-data/basic/nonland-textboxes/" + text_t + ".png"
 
-    # Load the card art
-    card_art_path = Cards.get_card_art_crop(card)
+    # Find the card art
+    card_art_path = Cards.get_card_art_crop(card, verbose=self.verbose)
     if card_art_path == None:
-      return False
-    card_art = pygame.image.load(card_art_path)
+      return None
 
-    # By the template, the image should be about 2294x1686 and be placed at (200,420) + base, accounting for an offset
-    # if the image is too big in one direction (to center it)
-    card_art = Cards.dynamically_scale_card(card_art, (2294, 1686))
-    w_offset = (card_art.get_width() - 2294) // 2
-    h_offset = (card_art.get_height() - 1686) // 2
-
-    # Now create an output canvas of the proper size, draw things to it
-    canvas = pygame.Surface((2682+2*base,3744+2*base))
-    canvas.fill((255,255,255))  # Fill the canvas with white, before drawing to it
-    canvas.blit(card_art, (200+base-w_offset, 420+base-h_offset))
-    canvas.blit(background, (base, base))
+    # Every layer of the template goes over the art, these are composited into a single frame
+    # once for each combination of layers
+    layers = [background]
     if nyx:
-      canvas.blit(pygame.image.load("template-data/basic/nyx-border.png"), (base, base))
-    canvas.blit(text_box, (base, base))
-    canvas.blit(title_box, (base, base))
+      layers.append("template-data/basic/nyx-border.png")
+    layers += [text_box, title_box]
     if creature or "Vehicle" in card_type:
-      pt = self.get_file_name_colour(colours, 2)
-      canvas.blit(pygame.image.load("template-data/basic/pt-boxes/" + pt + ".png"), (base, base))
-
-    self.add_mana_cost(canvas, card, base=base)
-
-    return self.add_text(canvas, card, base=base)
-
-  def add_text(self, canvas, card, base=150, flavour_text=True):
+      layers.append("template-data/basic/pt-boxes/" + self.get_file_name_colour(colours, 2) + ".png")
+    layers = [(layer, (base, base)) for layer in layers]
+    if not basic:
+      # The MPC extended border is part of the frame
+      layers.append(("template-data/basic/border-extend.png", (0, 0)))
+    size = (2682+2*base, 3744+2*base)
+
+    plan = RenderPlan(size)
+    plan.add(("fill", (255,255,255)))   # Fill the canvas with white, before drawing to it
+    # By the template, the art should cover 2294x1686 at (200,420) + base, and is centered in
+    # that box if it is too big in one direction
+    plan.add(("art", card_art_path, (2294, 1686)), (200+base+2294//2, 420+base+1686//2), "center")
+    plan.add(("frame", size, tuple(layers)))
+    self.add_mana_cost(plan, card, base=base)
+    self.add_text(plan, card, base=base)
+    plan.dedupe()
+    return plan
+
+  def add_text(self, plan, card, base=150, flavour_text=True):
     """
-    Finishes up card creation by adding all the relevant text to the card.
+    Adds all the relevant text of the card to its plan
 
     PARAMETERS:
-     - canvas: The current card, formatted with the image already loaded
+     - plan: The RenderPlan of the card, with the template and the art already added
      - card: The card object
      - base: An offset for all the text. Do 150 for MPC format and 0 for regular format
      - flavour_text: If you want flavour text or not
-
-    RETURNS:
-     - The completed canvas, to be saved as a png file to output
     """
-    # For now, write a bunch of tests to make sure it actually works
-    write(canvas, card["name"], 220+base, 230+base, 140, bold=True)
-    write(canvas, card["type_line"], 220+base, 2170+base, 120, bold=True)
-    write_wrapped(canvas, card["oracle_text"], (230+base, 2464+base, 2200+base, 3420+base), 130)
+    plan.add(("text", card["name"], text_face(bold=True), 140, (0,0,0), True), (220+base, 230+base))
+    plan.add(("text", card["type_line"], text_face(bold=True), 120, (0,0,0), True), (220+base, 2170+base))
+    plan.extend(wrapped_ops(card["oracle_text"], (230+base, 2464+base, 2220, 956), 130, icons=self.icons))
 
     if "Creature" in card["type_line"] or "Vehicle" in card["type_line"]:
-      font = FONTS_BOLD[150]
-      pt = font.render(card["power"] + "/" + card["toughness"], 1, (0,0,0))
-      pt_rect = pt.get_rect(center=(2312+base,3450+base))
-      canvas.blit(pt, pt_rect)
-
-    return canvas
+      plan.add(("text", card["power"] + "/" + card["toughness"], "bold", 150, (0,0,0), True), (2312+base, 3450+base), "center")
   
-  def add_mana_cost(self, canvas, card, base=150):
+  def add_mana_cost(self, plan, card, base=150):
     """
-    Load and draw the mana cost to the card, using the initialized Icons.py
+    Adds the mana cost of the card to its plan, using the initialized Icons.py
 
     PARAMETERS:
-     - canvas: The card image that is currently being drawn to
+     - plan: The RenderPlan of the card
      - card: The card being drawn
      - base: An offset for all the text. Do 150 for MPC format and 0 for regular format
     """
@@ -409,7 +1013,7 @@ class BasicModern(Template):
     sx = 2484 + base
     sy = 206 + base
 
-    if "mana_cost" not in card:
+    if "mana_cost" not in card or card["mana_cost"] == "":
       return
     cost = card["mana_cost"]
 
@@ -418,13 +1022,13 @@ class BasicModern(Template):
     l = cost[1:-1]
     l = l.split('}{')
 
-    # Reverse the list as we are working backwards, then blit each icon and move back
+    # Reverse the list as we are working backwards, then place each icon and move back
     for c in reversed(l):
       i = self.icons.get_title(c)
       if i == None:
         break
       sx -= (i.get_width() + 6)
-      canvas.blit(i, (sx, sy))
+      plan.add(("mana", c), (sx, sy))
     return
 
   def get_file_name_colour(self, l, gold=2):
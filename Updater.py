@@ -1,49 +1,288 @@
-import requests, json, time, os
+import requests, json, time, os, threading
 import os.path as path
-import Cards
+import Cards, Database
 
 # Some Static Strings
 BULK_DATA_FILE = "data/bulk-data.json"
 BULK_DATA_PATH = "https://api.scryfall.com/bulk-data"
 ALL_CARDS_FILE = "data/all-cards.json"
+SNAPSHOT_FILE = "data/snapshot.json"
 
-def request_scryfall_data(url, filename, verbose=True):
+# The scryfall bulk files that can be downloaded as data/all-cards.json, by how much of each card they hold
+BULK_TYPES = {
+  "oracle":"oracle_cards",      # One printing of every card
+  "unique":"unique_artwork",    # One printing of every different art of every card
+  "default":"default_cards",    # Every printing, in English or the language it was printed in
+  "all":"all_cards"             # Every printing in every language, by far the largest
+}
+DEFAULT_BULK_TYPE = "oracle"
+
+# Downloads are streamed to disk in chunks of this many bytes, rather than held in memory
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_TIMEOUT = (10, 60)         # Seconds to wait to connect, and between chunks of data
+DOWNLOAD_REPORT_INTERVAL = 2        # Seconds between progress messages when verbose
+
+# Scryfall asks for no more than 10 requests a second, across every thread we download with
+SCRYFALL_RATE_LIMIT = 10
+
+class RateLimiter:
+  """
+  A thread safe token bucket. Tokens refill at a steady rate up to a maximum burst,
+  and every request has to take a token before it is sent, waiting for one if needed.
+  """
+  def __init__(self, rate, burst=1):
+    """
+    PARAMETERS:
+     - rate: How many tokens are added per second
+     - burst: The most tokens that can be saved up at once
+    """
+    self.rate = rate
+    self.burst = burst
+    self.tokens = burst
+    self.last = time.monotonic()
+    self.lock = threading.Lock()
+
+  def acquire(self):
+    """
+    Takes a token, blocking until one is available
+    """
+    while True:
+      with self.lock:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+          self.tokens -= 1
+          return
+        wait = (1 - self.tokens) / self.rate
+      time.sleep(wait)
+
+SCRYFALL_LIMITER = RateLimiter(SCRYFALL_RATE_LIMIT)
+
+# Each thread keeps its own session, so connections to scryfall get reused between requests
+_sessions = threading.local()
+
+def get_session():
+  """
+  RETURNS:
+   - The requests Session belonging to the current thread
+  """
+  if not hasattr(_sessions, "session"):
+    _sessions.session = requests.Session()
+  return _sessions.session
+
+def request_scryfall_data(url, filename, verbose=True, headers=None, retries=DOWNLOAD_RETRIES, resume=True):
   """
   A basic way to request data from scryfall and store it in file in data
 
+  The response is streamed to filename.part in chunks and only renamed to filename once it
+  is complete, so a failed transfer never leaves a truncated file behind. If a .part file
+  is already there from an interrupted transfer, the download resumes from where it left off,
+  as long as the server sent an ETag to make sure it is still the same file.
+
+  The file is asked for without any content encoding, so that the bytes on disk are the same
+  bytes the Range of a resumed download counts.
+
   PARAMETERS:
    - url: The full https path to the file you wish to access (such as https://api.scryfall.com/bulk-data)
    - filename: The name of the resulting file
-   - verbose: How much info you want to print to the terminal
-  """
+   - verbose: How much info you want to print to the terminal, including download progress
+   - headers: Any extra HTTP headers to send, such as If-None-Match
+   - retries: How many times to try resuming after the connection drops
+   - resume: Keep the .part file of a download that could not be completed, so a later run
+     can resume it. Small files such as card art are just downloaded again
 
-  # Wait 0.1 seconds every request as to not flood scryfall and get IP banned. This is per their request
-  time.sleep(0.1)
+  RETURNS:
+   - The response. If scryfall answers 304 Not Modified the file is left untouched
+   - None if the download could not be completed
+  """
+  part = filename + ".part"
+  validator = part + ".etag"    # The ETag of the partial download, so we only resume the same file
 
-  r = requests.get(url)
   if verbose:
     print(" - Connecting to " + url)
 
-  f = open(filename, 'wb')
-  f.write(r.content)
-  if verbose:
-    print(" - Writing Data...")
+  for attempt in range(retries + 1):
+    request_headers = { "Accept-Encoding":"identity" }
+    request_headers.update(headers or {})
+    offset = path.getsize(part) if path.exists(part) else 0
+    if offset > 0 and not path.exists(validator):
+      # Without an ETag there is no telling if the file changed since, so start over
+      os.remove(part)
+      offset = 0
+    if offset > 0:
+      request_headers["Range"] = "bytes=" + str(offset) + "-"
+      with open(validator) as f:
+        request_headers["If-Range"] = f.read()
+
+    # Limit requests to 10 a second as to not flood scryfall and get IP banned. This is per their request
+    SCRYFALL_LIMITER.acquire()
+
+    try:
+      with get_session().get(url, headers=request_headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+        if r.status_code == 304:
+          if verbose:
+            print(" - Not Modified")
+          return r
+        if r.status_code == 416:
+          # Our partial file does not line up with the file on the server anymore, start over
+          os.remove(part)
+          continue
+        if not r.ok:
+          print("Could not download " + url + " (" + str(r.status_code) + ")")
+          return None
+
+        # If the server encoded the body anyway, the file holds the decoded bytes, which neither
+        # its Content-Length nor the Range of a resumed download count
+        encoded = r.headers.get("Content-Encoding", "identity").lower() != "identity"
+        if encoded and r.status_code == 206:
+          os.remove(part)
+          continue
+
+        # Only append if the server actually honoured the range request
+        if r.status_code != 206:
+          offset = 0
+        elif verbose:
+          print(" - Resuming from " + format_size(offset))
+        if "ETag" in r.headers and not encoded:
+          with open(validator, 'w') as f:
+            f.write(r.headers["ETag"])
+        elif path.exists(validator):
+          os.remove(validator)
+
+        total = None
+        if "Content-Length" in r.headers and not encoded:
+          total = offset + int(r.headers["Content-Length"])
+
+        if verbose:
+          print(" - Writing Data...")
+        written = write_response(r, part, offset, total, verbose)
+        if total is not None and written < total:
+          raise requests.exceptions.ConnectionError("Connection closed after " + format_size(written))
+    except requests.exceptions.RequestException as e:
+      if attempt < retries:
+        print("Download of " + url + " interrupted, retrying: " + str(e))
+        time.sleep(2 ** attempt)
+        continue
+      print("Could not download " + url + ": " + str(e))
+      if resume:
+        print("Run the update again to resume it")
+      else:
+        for leftover in [part, validator]:
+          if path.exists(leftover):
+            os.remove(leftover)
+      return None
+
+    # The download is complete, move it into place in one step
+    os.replace(part, filename)
+    if path.exists(validator):
+      os.remove(validator)
+    if verbose:
+      print(" - Closing Connection")
+    return r
+  return None
+
+def write_response(r, filename, offset=0, total=None, verbose=True):
+  """
+  Streams the body of a response to a file in bounded chunks, printing progress if verbose
+
+  PARAMETERS:
+   - r: The streamed response to read from
+   - filename: The file to write to
+   - offset: How many bytes of the file are already downloaded, the response gets appended after them
+   - total: The full size of the file if it is known
+   - verbose: Print progress and throughput
+
+  RETURNS:
+   - The number of bytes of the file downloaded in total, including the offset
+  """
+  written = offset
+  start = time.time()
+  last_report = start
+  with open(filename, 'ab' if offset else 'wb') as f:
+    for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+      f.write(chunk)
+      written += len(chunk)
+
+      now = time.time()
+      if verbose and now - last_report >= DOWNLOAD_REPORT_INTERVAL:
+        last_report = now
+        progress = " - " + format_size(written)
+        if total:
+          progress += " / " + format_size(total) + " (" + str(written * 100 // total) + "%)"
+        print(progress + " at " + format_size((written - offset) / (now - start)) + "/s")
 
-  f.close()
   if verbose:
-    print(" - Closing Connection")
+    elapsed = max(time.time() - start, 0.001)
+    print(" - Downloaded " + format_size(written - offset) + " in " + str(round(elapsed, 1)) + "s (" + format_size((written - offset) / elapsed) + "/s)")
+  return written
+
+def format_size(n):
+  """
+  Formats a number of bytes to be human readable, such as "12.3 MB"
+  """
+  for unit in ["B", "KB", "MB"]:
+    if n < 1024:
+      return str(round(n, 1)) + " " + unit
+    n /= 1024
+  return str(round(n, 1)) + " GB"
+
+def load_snapshot():
+  """
+  Reads the metadata of the scryfall snapshot that was last downloaded to data/all-cards.json
+
+  RETURNS:
+   - A dictionary of the snapshot metadata, empty if nothing has been downloaded yet
+  """
+  if not path.exists(SNAPSHOT_FILE):
+    return {}
+  try:
+    with open(SNAPSHOT_FILE) as f:
+      return json.load(f)
+  except ValueError:
+    return {}
+
+def indexes_printings(snapshot, printings=DEFAULT_BULK_TYPE):
+  """
+  PARAMETERS:
+   - snapshot: The snapshot metadata, see load_snapshot
+   - printings: The bulk file to assume if nothing has been downloaded yet, see BULK_TYPES
 
-def get_all_cards_json(cards=0, verbose=True):
+  RETURNS:
+   - If the bulk file has several printings of each card, which are then worth writing to the
+     printing database. The oracle bulk file only has one
+  """
+  return snapshot.get("type", BULK_TYPES[printings]) != BULK_TYPES["oracle"]
+
+def save_snapshot(snapshot):
+  """
+  Records the metadata of the scryfall snapshot in data/snapshot.json
+
+  PARAMETERS:
+   - snapshot: A dictionary of type, updated_at, size, etag and download_uri, along with
+     what was last serialized from it
+  """
+  with open(SNAPSHOT_FILE, 'w') as f:
+    json.dump(snapshot, f, indent=2)
+
+def get_all_cards_json(cards=0, verbose=True, force=False):
   """
   Reads the bulk-data.json file to determine the url to get the json file
 
   PARAMETERS:
-   - Cards: An index of data in bulk-data, by scryfall:
+   - Cards: The type of bulk file such as "default_cards", see BULK_TYPES, or an index of data in bulk-data, by scryfall:
    - 0: A JSON file containing one Scryfall card object for each Oracle ID on Scryfall. The chosen sets for the cards are an attempt to return the most up-to-date recognizable version of the card.
    - 1: A JSON file of Scryfall card objects that together contain all unique artworks. The chosen cards promote the best image scans.
    - 2: A JSON file containing every card object on Scryfall in English or the printed language if the card is only available in one language.
    - 3: A JSON file containing every card object on Scryfall in every language.
    - 4: A JSON file containing all Rulings on Scryfall. Each ruling refers to cards via an `oracle_id`.
+   - verbose: If you would like to see all messages printed to the terminal
+   - force: Download the file even if the snapshot has not changed since the last download
+
+  RETURNS:
+   - True if a new snapshot was downloaded, False if the local copy is already up to date
+     or the bulk data could not be read
   """
 
   if verbose:
@@ -64,14 +303,57 @@ def get_all_cards_json(cards=0, verbose=True):
     print("Loading JSON...")
   bulk_data = json.loads(bulk_data_string)
 
-  # Then we want to determine the proper download_uri from the bulk data
-  # Currently the only field we care about is the download_uri, we can update this later
-  all_cards_uri = bulk_data["data"][cards]["download_uri"]
+  # Then we want to determine the proper download_uri from the bulk data, along with
+  # the metadata that tells us if it has changed since we last downloaded it
+  if isinstance(cards, str):
+    entries = [entry for entry in bulk_data["data"] if entry.get("type") == cards]
+    if len(entries) == 0:
+      print("Scryfall does not have a " + cards + " bulk file")
+      print("Aborting!")
+      return
+    entry = entries[0]
+  else:
+    entry = bulk_data["data"][cards]
+  all_cards_uri = entry["download_uri"]
+
+  snapshot = load_snapshot()
+  unchanged = snapshot.get("type") == entry.get("type") \
+    and snapshot.get("updated_at") == entry.get("updated_at") \
+    and snapshot.get("size") == entry.get("size")
+  if not force and unchanged and path.exists(ALL_CARDS_FILE):
+    # Always print this regardless of verbose, so scheduled updates have a clear result
+    print("Scryfall card database is up to date (" + str(entry.get("updated_at")) + ")")
+    return False
+
+  # Ask scryfall to skip sending the file if it still has the same ETag as our copy
+  headers = {}
+  if not force and snapshot.get("etag") and path.exists(ALL_CARDS_FILE):
+    headers["If-None-Match"] = snapshot["etag"]
 
   # Then request that scryfall data and save it as all-cards.json
   if verbose:
     print("Fetching Scryfall Card Database...")
-  request_scryfall_data(all_cards_uri, ALL_CARDS_FILE, verbose=verbose)
+  r = request_scryfall_data(all_cards_uri, ALL_CARDS_FILE, verbose=verbose, headers=headers)
+  if r is None:
+    print("Keeping the existing " + ALL_CARDS_FILE)
+    return False
+
+  previous = snapshot.get("updated_at")
+  snapshot["type"] = entry.get("type")
+  snapshot["updated_at"] = entry.get("updated_at")
+  snapshot["size"] = entry.get("size")
+  snapshot["download_uri"] = all_cards_uri
+  if r.status_code == 304:
+    # The file is byte for byte what we already have, so anything serialized from it is still current
+    if "serialized" in snapshot and snapshot["serialized"]["updated_at"] == previous:
+      snapshot["serialized"]["updated_at"] = entry.get("updated_at")
+    save_snapshot(snapshot)
+    print("Scryfall card database is up to date (" + str(entry.get("updated_at")) + ")")
+    return False
+
+  snapshot["etag"] = r.headers.get("ETag")
+  save_snapshot(snapshot)
+  return True
 
 def check_directories(verbose=True):
   """
@@ -98,7 +380,7 @@ def check_directories(verbose=True):
   if verbose and mkc:
     print("Some folders were missing! They have been created!")
 
-def update(bulk=True,cards=True,cards_finalize=True,verbose=True):
+def update(bulk=True,cards=True,cards_finalize=True,verbose=True,compact=False,force=False,printings=DEFAULT_BULK_TYPE):
   """
   Update the local database by pulling info from scryfall.
 
@@ -108,8 +390,13 @@ def update(bulk=True,cards=True,cards_finalize=True,verbose=True):
   PARAMETERS:
    - bulk: Download Scryfall's bulk data, which gives a temporary link to download all cards
    - cards: Use data/bulk-data.json to update data/all-cards.json.
-   - cards_finalize: Load and serialize data/all-cards.json to data/all-cards.ser, for quicker access between sessions
+   - cards_finalize: Load and serialize data/all-cards.json to data/all-cards.ser and the indexed data/all-cards.db,
+     for quicker access between sessions
    - verbose: If you would like to see all messages printed to the terminal
+   - compact: Serialize cards as Cards.CompactCard, only keeping the fields used by the templates
+   - force: Download and serialize the cards even if the scryfall snapshot has not changed
+   - printings: Which bulk file to download, see BULK_TYPES. Anything but "oracle" has several
+     printings of each card, which can then be rendered by set and collector number
   """
 
   if verbose:
@@ -125,12 +412,27 @@ def update(bulk=True,cards=True,cards_finalize=True,verbose=True):
     request_scryfall_data(BULK_DATA_PATH, BULK_DATA_FILE, verbose=verbose)
   
   # Read from bulk data, get the URI to download all cards as a JSON file
+  changed = True
   if cards:
-    get_all_cards_json(0, verbose=verbose)
+    changed = get_all_cards_json(BULK_TYPES[printings], verbose=verbose, force=force)
   
   # Serialize all scryfall data into an easier to parse format
   if cards_finalize:
-    Cards.serialize_all_cards(verbose=verbose)
+    # Skip serializing if this exact snapshot was already serialized in the same format
+    snapshot = load_snapshot()
+    serialized = { "type":snapshot.get("type"), "updated_at":snapshot.get("updated_at"), "compact":compact }
+    # Only bulk files with several printings of each card get a printing database
+    index_printings = indexes_printings(snapshot, printings)
+    if cards and not changed and not force and snapshot.get("serialized") == serialized \
+        and path.exists(Cards.ALL_CARDS_SERIALIZED) and path.exists(Database.ALL_CARDS_INDEXED) \
+        and (path.exists(Database.ALL_PRINTINGS_INDEXED) or not index_printings):
+      print("Local database is up to date, nothing to serialize")
+      return
+
+    Cards.serialize_all_cards(verbose=verbose, compact=compact, index_printings=index_printings)
+    if path.exists(Cards.ALL_CARDS_SERIALIZED) and snapshot:
+      snapshot["serialized"] = serialized
+      save_snapshot(snapshot)
   
     
     